@@ -0,0 +1,108 @@
+"""
+Helpers shared by the revisions in versions/
+Statements over whole tables run in primary key chunks, each committed on
+its own, so row locks are held briefly and the bot can keep serving traffic
+while they run.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from models import delivery_slot_for
+
+
+# Rows updated per committed statement
+CHUNK_SIZE = 10000
+
+topics = sa.table('topics',
+    sa.column('id', sa.SmallInteger),
+    sa.column('name', sa.String),
+    sa.column('category', sa.String),
+)
+sources = sa.table('sources',
+    sa.column('id', sa.SmallInteger),
+    sa.column('domain', sa.String),
+    sa.column('category', sa.String),
+)
+
+
+def backfill(conn, table, statement):
+    """Run an UPDATE over ``table`` in primary key ranges of CHUNK_SIZE"""
+    if op.get_context().as_sql:
+        op.execute(statement)
+        return
+
+    max_id = conn.execute(sa.text(f"SELECT MAX(id) FROM {table}")).scalar() or 0
+    for low in range(0, max_id, CHUNK_SIZE):
+        with op.get_context().autocommit_block():
+            conn.execute(
+                sa.text(f"{statement} AND id > :low AND id <= :high"),
+                {'low': low, 'high': low + CHUNK_SIZE},
+            )
+
+
+def add_missing(conn, dimension, column, legacy_values):
+    """Add legacy values stored since the dimension tables were seeded"""
+    if op.get_context().as_sql:
+        return
+    next_id = (conn.execute(sa.text(f"SELECT MAX(id) FROM {dimension.name}")).scalar() or 0) + 1
+    rows = [
+        {'id': next_id + i, column: value, 'category': category or 'other'}
+        for i, (value, category) in enumerate(conn.execute(legacy_values).fetchall())
+    ]
+    if rows:
+        op.bulk_insert(dimension, rows)
+
+
+def backfill_ids(conn):
+    """Fill topic_id and source_id wherever they are still NULL"""
+    add_missing(conn, topics, 'name', sa.text(
+        "SELECT topic_name, MAX(category) FROM user_topics "
+        "WHERE topic_id IS NULL AND topic_name NOT IN (SELECT name FROM topics) "
+        "GROUP BY topic_name"))
+    add_missing(conn, sources, 'domain', sa.text(
+        "SELECT source_domain, NULL FROM user_sources "
+        "WHERE source_id IS NULL AND source_domain NOT IN (SELECT domain FROM sources) "
+        "GROUP BY source_domain"))
+
+    backfill(conn, 'user_topics',
+        "UPDATE user_topics SET topic_id = "
+        "(SELECT topics.id FROM topics WHERE topics.name = user_topics.topic_name) "
+        "WHERE topic_id IS NULL")
+    backfill(conn, 'user_sources',
+        "UPDATE user_sources SET source_id = "
+        "(SELECT sources.id FROM sources WHERE sources.domain = user_sources.source_domain) "
+        "WHERE source_id IS NULL")
+
+
+def backfill_names(conn):
+    """Fill the legacy name columns of rows that only have their ids"""
+    backfill(conn, 'user_topics',
+        "UPDATE user_topics SET "
+        "topic_name = (SELECT topics.name FROM topics WHERE topics.id = user_topics.topic_id), "
+        "category = (SELECT topics.category FROM topics WHERE topics.id = user_topics.topic_id) "
+        "WHERE topic_name IS NULL")
+    backfill(conn, 'user_sources',
+        "UPDATE user_sources SET "
+        "source_domain = (SELECT sources.domain FROM sources WHERE sources.id = user_sources.source_id) "
+        "WHERE source_domain IS NULL")
+
+
+def backfill_delivery_slots(conn):
+    """Fill users.delivery_slot wherever it is still NULL; the slot is a hash computed in Python"""
+    if op.get_context().as_sql:
+        return
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text("SELECT id, chat_id FROM users WHERE id > :last_id AND delivery_slot IS NULL "
+                    "ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': CHUNK_SIZE},
+        ).fetchall()
+        if not rows:
+            break
+        with op.get_context().autocommit_block():
+            conn.execute(
+                sa.text("UPDATE users SET delivery_slot = :slot WHERE id = :id"),
+                [{'id': row.id, 'slot': delivery_slot_for(row.chat_id)} for row in rows],
+            )
+        last_id = rows[-1].id
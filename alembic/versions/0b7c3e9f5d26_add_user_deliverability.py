@@ -0,0 +1,30 @@
+"""add deliverability state to users
+
+Revision ID: 0b7c3e9f5d26
+Revises: f2a6d81b47c9
+Create Date: 2026-10-19 16:27:13.440862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7c3e9f5d26'
+down_revision = 'f2a6d81b47c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The server default fills existing rows without a table rewrite on Postgres
+    op.add_column('users', sa.Column('is_deliverable', sa.Boolean(), server_default=sa.true(), nullable=False))
+    op.drop_index('ix_users_delivery_slot', table_name='users')
+    op.create_index('ix_users_delivery', 'users', ['is_deliverable', 'delivery_slot', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_delivery', table_name='users')
+    op.create_index('ix_users_delivery_slot', 'users', ['delivery_slot', 'id'])
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('is_deliverable')
@@ -0,0 +1,133 @@
+"""constrain topic and source ids, drop the legacy columns (contract)
+
+Revision ID: a82f4c6e1d97
+Revises: 0b7c3e9f5d26
+Create Date: 2026-10-19 10:12:42.871930
+
+Last of the three topic/source steps, see c41f7a2d9e83. Run it once no
+process on the old code is left: it backfills the rows written since the
+backfill step and the users created since e5b09c7d3a14, then adds the
+constraints, makes users.delivery_slot NOT NULL and drops the legacy columns.
+
+On PostgreSQL no step holds an ACCESS EXCLUSIVE lock while scanning
+user_topics or user_sources:
+
+- the unique indexes are built CONCURRENTLY and attached as constraints
+- NOT NULL is proven by a CHECK added NOT VALID and validated on its own,
+  which SET NOT NULL then relies on instead of scanning (PostgreSQL 12+)
+- the foreign keys are added NOT VALID and validated on their own
+- DROP COLUMN only changes the catalog
+
+Each statement commits on its own and gives up after LOCK_TIMEOUT rather
+than queueing traffic behind a long transaction. Other databases rebuild
+the tables instead.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import backfill_ids, backfill_names, backfill_delivery_slots
+
+
+# revision identifiers, used by Alembic.
+revision = 'a82f4c6e1d97'
+down_revision = '0b7c3e9f5d26'
+branch_labels = None
+depends_on = None
+
+# Longest wait for a table lock before a step fails instead of blocking traffic
+LOCK_TIMEOUT = '5s'
+
+# table -> (id column, dimension table, unique constraint, foreign key, legacy columns)
+TABLES = {
+    'user_topics': ('topic_id', 'topics', 'uq_user_topic', 'fk_user_topics_topic_id', ('topic_name', 'category')),
+    'user_sources': ('source_id', 'sources', 'uq_user_source', 'fk_user_sources_source_id', ('source_domain',)),
+}
+
+
+def _set_not_null_postgresql(table, column):
+    """SET NOT NULL relying on a CHECK validated without an exclusive lock"""
+    check = f"ck_{table}_{column}_not_null"
+    op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check}")
+    op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {check} CHECK ({column} IS NOT NULL) NOT VALID")
+    op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}")
+    op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+    op.execute(f"ALTER TABLE {table} DROP CONSTRAINT {check}")
+
+
+def _constrain_postgresql(table, id_column, dimension, unique, foreign_key, legacy_columns):
+    index = f"{unique}_id"
+    with op.get_context().autocommit_block():
+        # A build cut short leaves an invalid index behind
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+        op.execute(f"CREATE UNIQUE INDEX CONCURRENTLY {index} ON {table} (user_id, {id_column})")
+
+        op.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+        _set_not_null_postgresql(table, id_column)
+
+        op.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {foreign_key}")
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {foreign_key} "
+            f"FOREIGN KEY ({id_column}) REFERENCES {dimension} (id) NOT VALID")
+        op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {foreign_key}")
+
+        # Swap the unique constraint in one statement; the index takes its name
+        op.execute(
+            f"ALTER TABLE {table} DROP CONSTRAINT {unique}, "
+            f"ADD CONSTRAINT {unique} UNIQUE USING INDEX {index}")
+        op.execute(f"ALTER TABLE {table} " + ", ".join(f"DROP COLUMN {column}" for column in legacy_columns))
+        op.execute("RESET lock_timeout")
+
+
+def _constrain_batch(table, id_column, dimension, unique, foreign_key, legacy_columns):
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.drop_constraint(unique, type_='unique')
+        batch_op.alter_column(id_column, existing_type=sa.SmallInteger(), nullable=False)
+        batch_op.create_foreign_key(foreign_key, dimension, [id_column], ['id'])
+        batch_op.create_unique_constraint(unique, ['user_id', id_column])
+        for column in legacy_columns:
+            batch_op.drop_column(column)
+
+
+def upgrade() -> None:
+    # Rows and users the old code wrote after the backfills
+    backfill_ids(op.get_bind())
+    backfill_delivery_slots(op.get_bind())
+
+    if op.get_context().dialect.name == 'postgresql':
+        constrain = _constrain_postgresql
+        with op.get_context().autocommit_block():
+            op.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+            _set_not_null_postgresql('users', 'delivery_slot')
+            op.execute("RESET lock_timeout")
+    else:
+        constrain = _constrain_batch
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.alter_column('delivery_slot', existing_type=sa.SmallInteger(), nullable=False)
+    for table, spec in TABLES.items():
+        constrain(table, *spec)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('delivery_slot', existing_type=sa.SmallInteger(), nullable=True)
+
+    op.add_column('user_topics', sa.Column('topic_name', sa.String(length=100), nullable=True))
+    op.add_column('user_topics', sa.Column('category', sa.String(length=50), nullable=True))
+    op.add_column('user_sources', sa.Column('source_domain', sa.String(length=100), nullable=True))
+
+    backfill_names(conn)
+
+    # Back to the shape left by the expand step: ids nullable, legacy names unique
+    with op.batch_alter_table('user_sources') as batch_op:
+        batch_op.drop_constraint('uq_user_source', type_='unique')
+        batch_op.drop_constraint('fk_user_sources_source_id', type_='foreignkey')
+        batch_op.alter_column('source_id', existing_type=sa.SmallInteger(), nullable=True)
+        batch_op.create_unique_constraint('uq_user_source', ['user_id', 'source_domain'])
+
+    with op.batch_alter_table('user_topics') as batch_op:
+        batch_op.drop_constraint('uq_user_topic', type_='unique')
+        batch_op.drop_constraint('fk_user_topics_topic_id', type_='foreignkey')
+        batch_op.alter_column('topic_id', existing_type=sa.SmallInteger(), nullable=True)
+        batch_op.create_unique_constraint('uq_user_topic', ['user_id', 'topic_name'])
@@ -0,0 +1,112 @@
+"""normalize topics and sources into dimension tables (expand)
+
+Revision ID: c41f7a2d9e83
+Revises: b9807055096a
+Create Date: 2026-10-19 10:12:40.118204
+
+First of three steps that can run while the bot is live:
+
+1. expand (this revision): create topics and sources, add nullable
+   topic_id/source_id columns and let the legacy name columns be NULL, so
+   both the old and the new code can write rows
+2. backfill (d7a3e1c5b820): fill the id columns in committed chunks
+3. contract (a82f4c6e1d97): backfill what was written since, then add the
+   constraints and drop the legacy columns
+
+The revisions between the backfill and the contract only add columns,
+tables and indexes the old code ignores. Deploy the new code once they have
+run, then run the contract once no old process is left:
+
+    python -m alembic upgrade 0b7c3e9f5d26
+    # restart the bot on the new code
+    python -m alembic upgrade head
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES
+from migration_helpers import topics, sources, backfill_names
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7a2d9e83'
+down_revision = 'b9807055096a'
+branch_labels = None
+depends_on = None
+
+
+def _seed_rows(conn, column, legacy_column, categories, key):
+    """Build dimension rows from the catalogue plus any legacy free-text values"""
+    rows = []
+    seen = set()
+    for cat_id, cat_data in categories.items():
+        for value in cat_data[key]:
+            if value not in seen:
+                seen.add(value)
+                rows.append({'id': len(rows) + 1, column: value, 'category': cat_id})
+
+    # Keep values that users stored but the catalogue no longer lists
+    if not op.get_context().as_sql:
+        for value, category in conn.execute(legacy_column).fetchall():
+            if value not in seen:
+                seen.add(value)
+                rows.append({'id': len(rows) + 1, column: value, 'category': category or 'other'})
+    return rows
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+
+    op.create_table('topics',
+    sa.Column('id', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('sources',
+    sa.Column('id', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('domain', sa.String(length=100), nullable=False),
+    sa.Column('category', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('domain')
+    )
+
+    op.bulk_insert(topics, _seed_rows(
+        conn, 'name',
+        sa.text("SELECT DISTINCT topic_name, category FROM user_topics"),
+        TOPIC_CATEGORIES, 'topics'))
+    op.bulk_insert(sources, _seed_rows(
+        conn, 'domain',
+        sa.text("SELECT DISTINCT source_domain, NULL FROM user_sources"),
+        SOURCE_CATEGORIES, 'sources'))
+
+    # Nullable, so existing rows stay valid. On PostgreSQL this and dropping
+    # NOT NULL below only change the catalog, the table is not rewritten.
+    op.add_column('user_topics', sa.Column('topic_id', sa.SmallInteger(), nullable=True))
+    op.add_column('user_sources', sa.Column('source_id', sa.SmallInteger(), nullable=True))
+
+    # The new code no longer writes the legacy columns
+    with op.batch_alter_table('user_topics') as batch_op:
+        batch_op.alter_column('topic_name', existing_type=sa.String(length=100), nullable=True)
+        batch_op.alter_column('category', existing_type=sa.String(length=50), nullable=True)
+    with op.batch_alter_table('user_sources') as batch_op:
+        batch_op.alter_column('source_domain', existing_type=sa.String(length=100), nullable=True)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+
+    # Rows written by the new code only have their ids
+    backfill_names(conn)
+
+    with op.batch_alter_table('user_sources') as batch_op:
+        batch_op.alter_column('source_domain', existing_type=sa.String(length=100), nullable=False)
+        batch_op.drop_column('source_id')
+    with op.batch_alter_table('user_topics') as batch_op:
+        batch_op.alter_column('topic_name', existing_type=sa.String(length=100), nullable=False)
+        batch_op.alter_column('category', existing_type=sa.String(length=50), nullable=False)
+        batch_op.drop_column('topic_id')
+
+    op.drop_table('sources')
+    op.drop_table('topics')
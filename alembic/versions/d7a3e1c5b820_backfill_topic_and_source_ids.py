@@ -0,0 +1,29 @@
+"""backfill topic and source ids (backfill)
+
+Revision ID: d7a3e1c5b820
+Revises: c41f7a2d9e83
+Create Date: 2026-10-19 10:12:41.306517
+
+Second of the three topic/source steps, see c41f7a2d9e83. Only UPDATEs in
+committed chunks, so it can run while the old code is still writing; rows
+written after it are picked up again by the contract step.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import backfill_ids
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3e1c5b820'
+down_revision = 'c41f7a2d9e83'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    backfill_ids(op.get_bind())
+
+
+def downgrade() -> None:
+    # The expand step's downgrade drops the id columns
+    pass
@@ -0,0 +1,41 @@
+"""add delivery slot to users and bot_state table
+
+Revision ID: e5b09c7d3a14
+Revises: d7a3e1c5b820
+Create Date: 2026-10-19 13:40:05.527391
+
+Runs before the topic/source contract step (a82f4c6e1d97) while the old
+code may still be creating users, so delivery_slot stays nullable here.
+The contract step fills the slots of users created since and sets NOT NULL.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migration_helpers import backfill_delivery_slots
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b09c7d3a14'
+down_revision = 'd7a3e1c5b820'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('bot_state',
+    sa.Column('key', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.add_column('users', sa.Column('delivery_slot', sa.SmallInteger(), nullable=True))
+
+    backfill_delivery_slots(op.get_bind())
+    op.create_index('ix_users_delivery_slot', 'users', ['delivery_slot', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_delivery_slot', table_name='users')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('delivery_slot')
+    op.drop_table('bot_state')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measure memory held by cached articles
+Compares raw NewsAPI article dicts (as returned by response.json()) with the
+slotted Article objects the fetcher keeps, for a given number of articles.
+
+Usage: python benchmarks/article_memory.py --articles 100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.article import Article
+from src.categories import get_all_sources
+
+PAGE_SIZE = 100
+WORDS = ("market", "launch", "model", "court", "energy", "vote", "league", "chip", "study",
+         "climate", "update", "report", "release", "deal", "security", "data", "team")
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def synthetic_pages(articles, seed=7):
+    """Return NewsAPI /everything response bodies (JSON text) with ``articles`` articles in total"""
+    rng = random.Random(seed)
+    domains = get_all_sources()
+    pages = []
+    for start in range(0, articles, PAGE_SIZE):
+        page = []
+        for n in range(start, min(start + PAGE_SIZE, articles)):
+            domain = rng.choice(domains)
+            name = domain.split('.')[0].upper()
+            page.append({
+                "source": {"id": name.lower(), "name": name},
+                "author": sentence(rng, 2),
+                "title": sentence(rng, 10),
+                "description": sentence(rng, 35),
+                "url": f"https://www.{domain}/2024/01/{n}/{sentence(rng, 5).replace(' ', '-').lower()}",
+                "urlToImage": f"https://cdn.{domain}/images/{n}.jpg",
+                "publishedAt": f"2024-01-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:00:00Z",
+                "content": sentence(rng, 30) + f"… [+{rng.randint(500, 9000)} chars]",
+            })
+        pages.append(json.dumps({"status": "ok", "totalResults": articles, "articles": page}))
+    return pages
+
+
+def measure(build):
+    """Return (bytes held by the result of ``build()``, result)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--articles', type=int, default=100000)
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.articles)
+
+    dict_bytes, dicts = measure(lambda: [article for page in pages for article in json.loads(page)["articles"]])
+    del dicts
+    article_bytes, articles = measure(lambda: [
+        Article.from_api(article) for page in pages for article in json.loads(page)["articles"]
+    ])
+
+    results = {
+        'articles': args.articles,
+        'dict_bytes': dict_bytes,
+        'article_bytes': article_bytes,
+        'dict_bytes_per_article': round(dict_bytes / args.articles),
+        'article_bytes_per_article': round(article_bytes / args.articles),
+        'reduction': round(1 - article_bytes / dict_bytes, 3),
+        'distinct_source_objects': len({id(article.source) for article in articles}),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
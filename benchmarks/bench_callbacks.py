@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of callback query decoding and dispatch
+Compares the old startswith/split chain with the table-driven router over a
+synthetic stream of callback data, and reports callback_data sizes.
+
+Usage: python benchmarks/bench_callbacks.py --taps 200000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES, get_all_topics, get_all_sources
+from src.callbacks import (
+    CALLBACKS, CallbackRouter, callback_data, SET_LANGUAGE, TOPIC_CATEGORY, SOURCE_CATEGORY,
+    TOPIC_TOGGLE, SOURCE_TOGGLE, SHOW_TOPICS, SHOW_SOURCES, GET_NEWS
+)
+
+
+class Query:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+def synthetic_stream(taps, seed=7):
+    """Return (legacy, compact) callback data lists with a toggle-heavy mix of taps"""
+    rng = random.Random(seed)
+    topics, sources = get_all_topics(), get_all_sources()
+    legacy, compact = [], []
+    for _ in range(taps):
+        roll = rng.random()
+        if roll < 0.45:
+            topic = rng.choice(topics)
+            legacy.append(f"topic:{topic}")
+            compact.append(callback_data(TOPIC_TOGGLE, topic))
+        elif roll < 0.75:
+            source = rng.choice(sources)
+            legacy.append(f"source:{source}")
+            compact.append(callback_data(SOURCE_TOGGLE, source))
+        elif roll < 0.85:
+            cat_id = rng.choice(list(TOPIC_CATEGORIES))
+            legacy.append(f"cat:{cat_id}")
+            compact.append(callback_data(TOPIC_CATEGORY, cat_id))
+        elif roll < 0.92:
+            cat_id = rng.choice(list(SOURCE_CATEGORIES))
+            legacy.append(f"src_cat:{cat_id}")
+            compact.append(callback_data(SOURCE_CATEGORY, cat_id))
+        else:
+            action, name = rng.choice([(SHOW_TOPICS, "show_topics"), (SHOW_SOURCES, "show_sources"), (GET_NEWS, "get_news")])
+            legacy.append(name)
+            compact.append(callback_data(action))
+    return legacy, compact
+
+
+async def noop(query, context, *args):
+    pass
+
+
+async def legacy_dispatch(query, context):
+    """The decoding chain button_click used before the router"""
+    data = query.data
+    if data == "set_lang_en":
+        await noop(query, context, 'en')
+    elif data == "set_lang_fa":
+        await noop(query, context, 'fa')
+    else:
+        if data.startswith("cat:"):
+            await noop(query, context, data.split(":")[1])
+        elif data.startswith("src_cat:"):
+            await noop(query, context, data.split(":")[1])
+        elif data.startswith("topic:"):
+            await noop(query, context, data.split(":", 1)[1])
+        elif data.startswith("source:"):
+            await noop(query, context, data.split(":", 1)[1])
+        elif data == "show_topics":
+            await noop(query, context)
+        elif data == "show_sources":
+            await noop(query, context)
+        elif data == "get_news":
+            await noop(query, context)
+
+
+async def run(dispatch, stream):
+    queries = [Query(data) for data in stream]
+    started = time.perf_counter()
+    for query in queries:
+        await dispatch(query, None)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--taps', type=int, default=200000)
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    router = CallbackRouter()
+    for action in (SET_LANGUAGE, TOPIC_CATEGORY, SOURCE_CATEGORY, TOPIC_TOGGLE, SOURCE_TOGGLE, SHOW_TOPICS, SHOW_SOURCES, GET_NEWS):
+        router.register(action, noop)
+
+    legacy, compact = synthetic_stream(args.taps)
+    legacy_seconds = asyncio.run(run(legacy_dispatch, legacy))
+    router_seconds = asyncio.run(run(router.dispatch, compact))
+
+    legacy_data = [data for data in CALLBACKS if ":" in data or "_" in data]
+    compact_data = [data for data in CALLBACKS if data not in legacy_data]
+    results = {
+        'taps': args.taps,
+        'legacy_ns_per_tap': round(legacy_seconds / args.taps * 1e9, 1),
+        'router_ns_per_tap': round(router_seconds / args.taps * 1e9, 1),
+        'legacy_max_callback_bytes': max(len(d.encode()) for d in legacy_data),
+        'compact_max_callback_bytes': max(len(d.encode()) for d in compact_data),
+        'telegram_callback_limit_bytes': 64,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
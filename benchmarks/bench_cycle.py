@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of one scheduled delivery cycle
+Generates synthetic users with skewed topic, source, language and activity
+preferences, then runs every bucket of a delivery cycle through
+TelegramBot.send_scheduled_news against the local fake NewsAPI and Bot API
+servers. Reports wall time, DB statements, upstream calls, peak RSS and
+messages per second for each population size.
+
+Each size runs in its own process on a fresh database, so peak RSS is per
+size. With --database-url (e.g. a Postgres database) all tables in it are
+dropped and recreated.
+
+Usage: python benchmarks/bench_cycle.py --users 1000 10000 100000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+TOKEN = "123456:BENCH"
+
+# Preferences create_user() gives every new user
+DEFAULT_TOPICS = ["Technology", "Programming", "AI", "Machine Learning"]
+DEFAULT_SOURCES = ['cnn.com', 'bbc.com', 'theverge.com', 'techcrunch.com', 'nytimes.com']
+
+# Share of users who never change the defaults, and of Farsi users
+KEEP_DEFAULTS = 0.5
+FARSI = 0.2
+# Users by days since last activity: active, dormant, abandoned
+ACTIVITY_MIX = ((0.5, 0, 7), (0.25, 7, 30), (0.25, 30, 180))
+# Users who blocked the bot since their last cycle
+UNDELIVERABLE = 0.03
+
+
+def zipf_weights(count, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, count + 1)]
+
+
+def synthetic_users(count, now, seed=7):
+    """
+    Yield (user row, topic names, source domains) for ``count`` users
+
+    Half keep the defaults; the others pick a few categories, popular ones
+    far more often (Zipf), and a handful of topics and sources in them.
+    """
+    from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES
+    from src.models import delivery_slot_for
+
+    rng = random.Random(seed)
+    topic_categories = list(TOPIC_CATEGORIES.values())
+    source_categories = list(SOURCE_CATEGORIES.values())
+    topic_weights = zipf_weights(len(topic_categories))
+    source_weights = zipf_weights(len(source_categories))
+    for n in range(count):
+        chat_id = str(100000000 + n)
+        share = rng.random()
+        for weight, newest, oldest in ACTIVITY_MIX:
+            if share < weight:
+                break
+            share -= weight
+        last_activity = now - timedelta(days=rng.uniform(newest, oldest))
+        if rng.random() < KEEP_DEFAULTS:
+            topics, sources = DEFAULT_TOPICS, DEFAULT_SOURCES
+        else:
+            topics, sources = set(), set()
+            for category in rng.choices(topic_categories, topic_weights, k=rng.randint(1, 3)):
+                topics.update(rng.sample(category["topics"], min(len(category["topics"]), rng.randint(1, 4))))
+            for category in rng.choices(source_categories, source_weights, k=rng.randint(1, 2)):
+                sources.update(rng.sample(category["sources"], min(len(category["sources"]), rng.randint(2, 5))))
+        yield {
+            'id': n + 1,
+            'chat_id': chat_id,
+            'first_name': "User",
+            'created_at': last_activity,
+            'last_activity': last_activity,
+            'language': 'fa' if rng.random() < FARSI else 'en',
+            'delivery_slot': delivery_slot_for(chat_id),
+            'is_deliverable': rng.random() >= UNDELIVERABLE,
+        }, topics, sources
+
+
+def populate(engine, users, now, batch_size=5000):
+    """Recreate the tables and insert ``users`` synthetic users with their preferences"""
+    from src.models import Base, User, UserTopic, UserSource, seed_catalogue
+    from src import db_helper
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    seed_catalogue(engine)
+    db_helper._load_catalogue(engine)
+
+    batch = ([], [], [])
+    def flush():
+        with engine.begin() as conn:
+            for table, rows in zip((User.__table__, UserTopic.__table__, UserSource.__table__), batch):
+                if rows:
+                    conn.execute(table.insert(), rows)
+                    rows.clear()
+
+    for user, topics, sources in synthetic_users(users, now):
+        batch[0].append(user)
+        batch[1].extend({'user_id': user['id'], 'topic_id': db_helper._topic_ids[t], 'is_enabled': True, 'created_at': now} for t in topics)
+        batch[2].extend({'user_id': user['id'], 'source_id': db_helper._source_ids[s], 'is_enabled': True, 'created_at': now} for s in sources)
+        if len(batch[0]) >= batch_size:
+            flush()
+    flush()
+
+
+async def run_cycle(bot, cycle):
+    scheduler = bot.delivery_scheduler
+    active_since = scheduler.active_since(cycle)
+    await bot.app.initialize()
+    try:
+        delivered = 0
+        for bucket in range(scheduler.window_minutes):
+            delivered += await bot.send_scheduled_news(slot_range=scheduler.slot_range(bucket), active_since=active_since)
+    finally:
+        await bot.app.shutdown()
+    return delivered
+
+
+def run_size(users, database_url, telegram_url, newsapi_url, queue):
+    """Populate a fresh database and time one digest cycle; runs in its own process"""
+    try:
+        queue.put(measure_size(users, database_url, telegram_url, newsapi_url))
+    except Exception:
+        queue.put({'users': users, 'error': traceback.format_exc()})
+
+
+def measure_size(users, database_url, telegram_url, newsapi_url):
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['TELEGRAM_BASE_URL'] = telegram_url
+    os.environ['NEWS_API_BASE_URL'] = newsapi_url
+    # Budget the whole cycle; the quota itself is not under test here
+    os.environ.setdefault('NEWS_API_DAILY_LIMIT', str(10 ** 9))
+
+    from sqlalchemy import event
+    from src import db_helper
+    from src.delivery_scheduler import DIGEST_HOUR
+    from src.telegram_bot import TelegramBot
+
+    engine, _ = db_helper.get_engine_and_session()
+    bot = TelegramBot(TOKEN, "bench-key")
+    scheduler = bot.delivery_scheduler
+    now = datetime.utcnow()
+    cycle = scheduler.time_zone.localize(datetime(now.year, now.month, now.day, DIGEST_HOUR))
+    cycle_utc = cycle.astimezone(pytz.utc).replace(tzinfo=None)
+
+    started = time.perf_counter()
+    populate(engine, users, cycle_utc)
+    populate_seconds = time.perf_counter() - started
+
+    statements = 0
+    def count(*args):
+        nonlocal statements
+        statements += 1
+    event.listen(engine, "before_cursor_execute", count)
+
+    newsapi_root, telegram_root = newsapi_url[:-len("/v2/")], telegram_url[:-len("/bot")]
+    for root in (newsapi_root, telegram_root):
+        requests.post(root + "/_reset", timeout=10)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    delivered = asyncio.run(run_cycle(bot, cycle))
+    elapsed = time.perf_counter() - started
+    event.remove(engine, "before_cursor_execute", count)
+
+    newsapi = requests.get(newsapi_root + "/_stats", timeout=10).json()
+    telegram = requests.get(telegram_root + "/_stats", timeout=10).json()
+    messages = telegram["calls"].get("sendMessage", 0)
+    return {
+        'users': users,
+        'users_in_cycle': delivered,
+        'populate_seconds': round(populate_seconds, 2),
+        'wall_seconds': round(elapsed, 2),
+        'db_statements': statements,
+        'db_statements_per_user': round(statements / delivered, 2) if delivered else None,
+        'newsapi_calls': newsapi["calls"],
+        'newsapi_statuses': newsapi["statuses"],
+        'telegram_calls': telegram["calls"],
+        'telegram_flood_waits': telegram["flood_waits"],
+        'messages': messages,
+        'messages_per_second': round(messages / elapsed, 1),
+        'digest_body_hits': bot.renderer.hits,
+        'digest_body_misses': bot.renderer.misses,
+        'peak_rss_mb_before_cycle': round(rss_before / 1024, 1),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--database-url', default=None, help="database to use (its tables are recreated); default: a temporary SQLite file")
+    parser.add_argument('--articles', type=int, default=20000, help="synthetic NewsAPI corpus size")
+    parser.add_argument('--newsapi-latency-ms', type=float, default=100)
+    parser.add_argument('--telegram-latency-ms', type=float, default=20)
+    parser.add_argument('--telegram-global-rate', type=float, default=0, help="Bot API messages per second, 0 for no flood limit")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    # Imported here: src modules read their settings on import, and the
+    # spawned workers must import them only after setting the fake URLs
+    from benchmarks import fake_newsapi, fake_telegram
+
+    newsapi, newsapi_url = fake_newsapi.start_fake_server(synthetic=args.articles, languages=('en', 'fa'),
+                                                          latency=args.newsapi_latency_ms / 1000)
+    telegram, telegram_url = fake_telegram.start_fake_server(latency=args.telegram_latency_ms / 1000,
+                                                             global_rate=args.telegram_global_rate)
+    results = {
+        'articles': args.articles,
+        'newsapi_latency_ms': args.newsapi_latency_ms,
+        'telegram_latency_ms': args.telegram_latency_ms,
+        'telegram_global_rate': args.telegram_global_rate,
+        'runs': [],
+    }
+    spawn = multiprocessing.get_context('spawn')
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for users in args.users:
+                database_url = args.database_url or f"sqlite:///{os.path.join(tmp, f'cycle_{users}.db')}"
+                queue = spawn.Queue()
+                process = spawn.Process(target=run_size, args=(users, database_url, telegram_url, newsapi_url, queue))
+                process.start()
+                run = queue.get()
+                process.join()
+                if 'error' in run:
+                    sys.exit(f"{users} users failed:\n{run['error']}")
+                print(f"{users:>7} users: {run['wall_seconds']:8.2f}s, {run['db_statements']} statements, "
+                      f"{run['newsapi_calls']} NewsAPI calls, {run['messages_per_second']} msg/s, "
+                      f"peak RSS {run['peak_rss_mb']} MiB")
+                results['runs'].append(run)
+    finally:
+        newsapi.terminate()
+        telegram.terminate()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency of the interactive handlers
+Builds TelegramBot with an in-process fake Bot API transport and feeds
+synthetic updates through Application.process_update, either as fast as
+they are handled or at a fixed rate. Simulated users send commands and tap
+buttons on the keyboards the bot last showed them, so the mix follows real
+menu navigation: /topics and /sources, category menus, topic and source
+toggles, back buttons and language changes. /news and Get News are left
+out, they are dominated by NewsAPI rather than the handlers.
+
+Reports latency percentiles and DB statements per handler. Statements are
+attributed to the update whose handler ran them, including the toggle
+writes done after the debounce delay.
+
+Usage: python benchmarks/bench_interactive.py --users 1000 --updates 5000 --rate 200
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import Update
+from telegram.request import BaseRequest
+from benchmarks.fake_telegram import message_update, callback_update
+from src.callbacks import (
+    decode, SET_LANGUAGE, TOPIC_CATEGORY, SOURCE_CATEGORY, TOPIC_TOGGLE, SOURCE_TOGGLE,
+    SHOW_TOPICS, SHOW_SOURCES, GET_NEWS
+)
+
+TOKEN = "123456:BENCH"
+
+# Commands users send, and their weights
+COMMANDS = (("/topics", 40), ("/sources", 25), ("/start", 10), ("/help", 10), ("/language", 10), ("/info", 5))
+# Handlers by callback action, named after the old callback data formats
+CALLBACK_LABELS = {
+    SET_LANGUAGE: "set_lang", TOPIC_CATEGORY: "cat:", SOURCE_CATEGORY: "src_cat:", TOPIC_TOGGLE: "topic:",
+    SOURCE_TOGGLE: "source:", SHOW_TOPICS: "show_topics", SHOW_SOURCES: "show_sources",
+}
+# Chance that the next update from a chat with a keyboard is a tap on it
+TAP_SHARE = 0.75
+
+# Statements counter of the update being handled
+_statements = contextvars.ContextVar('statements', default=None)
+
+
+class FakeBotRequest(BaseRequest):
+    """Bot API answered in-process; remembers the inline keyboard each chat was last shown"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.keyboards = {}  # chat_id -> (message_id, reply_markup)
+        self.next_message_id = 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if name == 'getMe':
+            result = {"id": 1, "is_bot": True, "first_name": "NewsBot", "username": "fake_news_bot"}
+        elif name in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            chat_id = int(params["chat_id"])
+            if name == 'sendMessage':
+                message_id = self.next_message_id
+                self.next_message_id += 1
+            else:
+                message_id = int(params["message_id"])
+            markup = params.get("reply_markup")
+            if markup and "inline_keyboard" in markup:
+                self.keyboards[chat_id] = (message_id, markup)
+            elif name != 'editMessageReplyMarkup' and self.keyboards.get(chat_id, (None,))[0] == message_id:
+                del self.keyboards[chat_id]
+            result = {"message_id": message_id, "date": int(time.time()), "text": params.get("text", "menu"),
+                      "chat": {"id": chat_id, "type": "private"}}
+            if markup:
+                result["reply_markup"] = markup
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateSource:
+    """Synthetic updates from ``users`` chats, following the keyboards the bot showed them"""
+
+    def __init__(self, users, transport, seed=7):
+        self.users = users
+        self.transport = transport
+        self.rng = random.Random(seed)
+        self.commands, self.weights = zip(*COMMANDS)
+
+    def next(self, update_id):
+        """Return (label, update dict)"""
+        keyboards = self.transport.keyboards
+        if keyboards and self.rng.random() < TAP_SHARE:
+            chat_id = self.rng.choice(list(keyboards))
+            message_id, markup = keyboards[chat_id]
+            buttons = [button["callback_data"] for row in markup["inline_keyboard"] for button in row
+                       if "callback_data" in button and (decode(button["callback_data"]) or (None,))[0] != GET_NEWS]
+            if buttons:
+                data = self.rng.choice(buttons)
+                update = callback_update(update_id, chat_id, data, message_id)
+                update["callback_query"]["message"]["reply_markup"] = markup
+                return CALLBACK_LABELS.get(decode(data)[0], "callback"), update
+        chat_id = 100000000 + self.rng.randrange(self.users)
+        command = self.rng.choices(self.commands, self.weights)[0]
+        return command, message_update(update_id, chat_id, command)
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def summary(values):
+    return {
+        'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+        'p90_ms': round(percentile(values, 0.9) * 1000, 2),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2),
+    }
+
+
+async def drive(bot, source, updates, rate, concurrency, settle):
+    """Feed ``updates`` updates; returns (records, seconds) with one (label, service, response, statements) per update"""
+    await bot.app.initialize()
+    slots = asyncio.Semaphore(concurrency)
+    records = []
+    loop = asyncio.get_running_loop()
+
+    async def handle(label, update, due):
+        statements = [0]
+        _statements.set(statements)
+        started = loop.time()
+        try:
+            await bot.app.process_update(update)
+        finally:
+            slots.release()
+        finished = loop.time()
+        records.append((label, finished - started, finished - due, statements))
+
+    tasks = []
+    begin = loop.time()
+    for update_id in range(1, updates + 1):
+        due = begin + (update_id - 1) / rate if rate else loop.time()
+        if due > loop.time():
+            await asyncio.sleep(due - loop.time())
+        await slots.acquire()
+        label, data = source.next(update_id)
+        tasks.append(asyncio.create_task(handle(label, Update.de_json(data, bot.app.bot), due)))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - begin
+    # Let debounced toggle writes land so their statements are counted
+    await asyncio.sleep(settle)
+    await bot.app.shutdown()
+    return records, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=0, help="updates per second, 0 to send each as soon as the last is handled")
+    parser.add_argument('--concurrency', type=int, default=1, help="updates handled at once (PTB's default is 1)")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="latency of each fake Bot API call")
+    parser.add_argument('--database-url', default=None, help="database to use (its tables are recreated); default: a temporary SQLite file")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmp, 'interactive.db')}"
+        # Imported once DATABASE_URL is set
+        from sqlalchemy import event
+        from src import db_helper
+        from src.telegram_bot import TelegramBot
+        from src.toggle_coalescer import TOGGLE_DEBOUNCE_SECONDS
+        from benchmarks.bench_cycle import populate
+
+        engine, _ = db_helper.get_engine_and_session()
+        populate(engine, args.users, datetime.utcnow())
+
+        def count(*_):
+            statements = _statements.get()
+            if statements is not None:
+                statements[0] += 1
+        event.listen(engine, "before_cursor_execute", count)
+
+        transport = FakeBotRequest(args.api_latency_ms / 1000)
+        bot = TelegramBot(TOKEN, "bench-key", transport=(transport, FakeBotRequest()))
+        source = UpdateSource(args.users, transport)
+        records, elapsed = asyncio.run(drive(bot, source, args.updates, args.rate, args.concurrency,
+                                             settle=TOGGLE_DEBOUNCE_SECONDS + 0.5))
+        engine.dispose()
+
+    handlers = defaultdict(list)
+    for record in records:
+        handlers[record[0]].append(record)
+    results = {
+        'users': args.users,
+        'updates': len(records),
+        'rate': args.rate,
+        'concurrency': args.concurrency,
+        'api_latency_ms': args.api_latency_ms,
+        'seconds': round(elapsed, 2),
+        'updates_per_second': round(len(records) / elapsed, 1),
+        'response': summary([record[2] for record in records]),
+        'db_statements_per_update': round(sum(record[3][0] for record in records) / len(records), 2),
+        'bot_api_calls': dict(transport.calls),
+        'handlers': {
+            label: dict(
+                count=len(rows),
+                **summary([row[1] for row in rows]),
+                db_statements_mean=round(sum(row[3][0] for row in rows) / len(rows), 2),
+                db_statements_max=max(row[3][0] for row in rows),
+            )
+            for label, rows in sorted(handlers.items(), key=lambda item: -len(item[1]))
+        },
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark sustained sendMessage throughput of the Bot API transport
+Sends messages to a local fake Bot API server with a fixed latency, with many
+sends in flight, for several connection pool sizes.
+
+Usage: python benchmarks/bench_transport.py --messages 5000 --latency-ms 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import Bot
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+from src.transport import build_requests
+from benchmarks.fake_telegram import start_fake_server
+
+TOKEN = "123456:TEST"
+
+
+async def run(request, base_url, messages, in_flight):
+    bot = Bot(TOKEN, base_url=base_url, request=request)
+    async with bot:
+        semaphore = asyncio.Semaphore(in_flight)
+        timed_out = 0
+
+        async def send(n):
+            nonlocal timed_out
+            async with semaphore:
+                try:
+                    await bot.send_message(chat_id=n, text="📰 Latest News")
+                except TimedOut:
+                    timed_out += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(n) for n in range(messages)))
+        elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 3),
+        'messages_per_second': round((messages - timed_out) / elapsed, 1),
+        'timed_out': timed_out,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--in-flight', type=int, default=256, help="sends running at the same time")
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[4, 16, 64, 256])
+    parser.add_argument('--base-url', default=None, help="use a running fake server instead of the built-in one")
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        # Flood limits off: this measures the transport, not Telegram's rate limits
+        server, base_url = start_fake_server(latency=args.latency_ms / 1000, chat_rate=0, group_rate_per_minute=0, global_rate=0)
+
+    results = {
+        'messages': args.messages,
+        'in_flight': args.in_flight,
+        'latency_ms': args.latency_ms,
+        'runs': [],
+    }
+    # PTB's own HTTPXRequest defaults (1s pool timeout, 5s timeouts) for reference
+    results['runs'].append(dict(
+        {'transport': 'HTTPXRequest defaults', 'pool_size': 256},
+        **asyncio.run(run(HTTPXRequest(connection_pool_size=256), base_url, args.messages, args.in_flight))
+    ))
+    for pool_size in args.pool_sizes:
+        request, _ = build_requests(pool_size=pool_size)
+        results['runs'].append(dict(
+            {'transport': 'build_requests', 'pool_size': pool_size},
+            **asyncio.run(run(request, base_url, args.messages, args.in_flight))
+        ))
+    if server:
+        server.terminate()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
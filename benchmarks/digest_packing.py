@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Measure Telegram API calls per delivered article for news digests
+Renders digests of increasing size with the old plain-text layout and with
+the packed HTML layout, and reports message lengths and sendMessage calls.
+
+Usage: python benchmarks/digest_packing.py --sizes 5 10 20 50
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.article import Article
+from src.categories import get_all_sources
+from src.renderer import DigestRenderer, MESSAGE_LIMIT, message_length, html_length
+
+WORDS = ("market", "launch", "model", "court", "energy", "vote", "league", "chip", "study",
+         "climate", "update", "report", "release", "deal", "security", "data", "team")
+TOPICS = ["Technology", "Programming", "AI", "Machine Learning"]
+SOURCES = ['cnn.com', 'bbc.com', 'theverge.com', 'techcrunch.com', 'nytimes.com']
+
+
+def synthetic_articles(count, seed=7):
+    rng = random.Random(seed)
+    domains = get_all_sources()
+    articles = []
+    for n in range(count):
+        domain = rng.choice(domains)
+        words = [rng.choice(WORDS) for _ in range(40)]
+        articles.append(Article.from_api({
+            "source": {"name": domain.split('.')[0].upper()},
+            "title": " ".join(words[:12]).capitalize(),
+            "description": " ".join(words[12:]).capitalize(),
+            "url": f"https://www.{domain}/2024/01/{n}/{'-'.join(words[:6])}",
+        }))
+    return articles
+
+
+def legacy_message(articles, topics, sources):
+    """The plain-text message send_news_to_user built before the packer"""
+    message = "📰 Latest News (based on your preferences):\n\n"
+    message += f"📚 Topics: {', '.join(topics[:3])} (+{len(topics) - 3} more)\n"
+    message += f"📰 Sources: {', '.join(sources[:3])} (+{len(sources) - 3} more)\n"
+    message += "\n" + "=" * 50 + "\n\n"
+    for article in articles:
+        message += f"🔸 {article.title}\n📝 {article.description}...\n📰 Source: {article.source}\n🔗 {article.url}\n\n"
+    return message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 20, 50])
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    renderer = DigestRenderer()
+    results = {'message_limit': MESSAGE_LIMIT, 'digests': []}
+    for size in args.sizes:
+        articles = synthetic_articles(size)
+        legacy = legacy_message(articles, TOPICS, SOURCES)
+        packed = renderer.render(articles, 'en', TOPICS, SOURCES)
+        results['digests'].append({
+            'articles': size,
+            'legacy_length': message_length(legacy),
+            'legacy_fits': message_length(legacy) <= MESSAGE_LIMIT,
+            'packed_messages': len(packed),
+            'packed_lengths': [html_length(message) for message in packed],
+            'calls_per_article': round(len(packed) / size, 3),
+        })
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
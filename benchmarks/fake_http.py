@@ -0,0 +1,93 @@
+"""
+Minimal asyncio HTTP/1.1 JSON server shared by the fake upstream servers
+
+A handler is ``async handler(verb, path, params, body)`` returning
+(status, payload) or raising HttpError; ``params`` merges the query string
+with a form or JSON body. Connections are kept alive, as real clients pool
+them.
+"""
+
+import asyncio
+import json
+import multiprocessing
+from urllib.parse import parse_qsl
+
+
+class HttpError(Exception):
+    def __init__(self, status, payload):
+        super().__init__(payload)
+        self.status = status
+        self.payload = payload
+
+
+def _parse_body(headers, body):
+    content_type = headers.get("content-type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        data = json.loads(body)
+        return data if isinstance(data, dict) else {}
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl(body.decode()))
+    return {}
+
+
+async def handle_connection(handler, reader, writer):
+    """Serve requests on one keep-alive connection"""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+            verb, target, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            path, _, query = target.partition("?")
+
+            try:
+                params = dict(parse_qsl(query))
+                params.update(_parse_body(headers, body))
+                status, payload = await handler(verb, path, params, body)
+            except HttpError as e:
+                status, payload = e.status, e.payload
+            except ValueError as e:
+                status, payload = 400, {"error": str(e)}
+
+            data = json.dumps(payload).encode()
+            writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (
+                status, b"OK" if status == 200 else b"Error", len(data), data))
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(handler, host="127.0.0.1", port=0, ready=None, banner=None):
+    """
+    Serve ``handler`` until cancelled. ``ready`` (a queue) receives the
+    port once listening; otherwise ``banner`` is printed with the port.
+    """
+    server = await asyncio.start_server(lambda r, w: handle_connection(handler, r, w), host, port, backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    if ready is not None:
+        ready.put(port)
+    elif banner:
+        print(banner.format(host=host, port=port))
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_process(target, *args):
+    """
+    Run ``target(*args, ready)`` in a child process, so the server does not
+    share the caller's event loop or GIL. Returns (process, port).
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (ready,), daemon=True)
+    process.start()
+    return process, ready.get(timeout=10)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for NewsAPI's /v2/everything
+Serves a recorded or synthetic article corpus, honouring q (OR, AND, NOT,
++/- and quoted phrases; parentheses are ignored), domains, from, to,
+language, sortBy, page and pageSize. Latency, server errors and per-key
+daily quotas can be injected, from the command line or at runtime with
+POST /_faults. GET /_stats returns call counters, POST /_reset clears them
+and the quota usage.
+
+Corpora are JSON files: a list of NewsAPI articles, a NewsAPI response, or
+one article per line. Articles may carry a "language" field. With
+--upstream the server forwards to a real NewsAPI instead and appends every
+article it sees to the --corpus file, which can be replayed later.
+
+Usage: python benchmarks/fake_newsapi.py --port 8082 --articles 20000
+       python benchmarks/fake_newsapi.py --corpus news.jsonl --upstream https://newsapi.org/v2/
+       NEWS_API_BASE_URL=http://127.0.0.1:8082/v2/ python main.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks import fake_http
+from src.categories import get_all_sources, get_all_topics
+from src.news_fetcher import MAX_QUERY_LENGTH
+
+WORDS = ("market", "launch", "model", "court", "energy", "vote", "league", "chip", "study",
+         "climate", "update", "report", "release", "deal", "security", "data", "team")
+
+# Results NewsAPI's developer plan lets a query page through
+MAX_RESULTS = 100
+MAX_PAGE_SIZE = 100
+
+# Filtered and sorted result lists kept for repeated queries
+RESULT_CACHE_SIZE = 500
+
+QUERY_TOKEN = re.compile(r'"([^"]+)"|(\S+)')
+WORD = re.compile(r'\w+')
+
+
+def _words(text):
+    return " ".join(WORD.findall(text.lower()))
+
+
+def synthetic_corpus(count, days=3, languages=("en",), seed=7):
+    """Articles spread over the last ``days`` days, each about one or two topics from the categories"""
+    rng = random.Random(seed)
+    topics = get_all_topics()
+    domains = get_all_sources()
+    now = datetime.now(timezone.utc)
+    articles = []
+    for n in range(count):
+        domain = rng.choice(domains)
+        about = rng.sample(topics, rng.choice((1, 1, 2)))
+        words = [rng.choice(WORDS) for _ in range(30)]
+        name = domain.split('.')[0].upper()
+        published = now - timedelta(seconds=rng.randrange(days * 86400))
+        articles.append({
+            "source": {"id": name.lower(), "name": name},
+            "author": None,
+            "title": f"{' and '.join(about)}: {' '.join(words[:8])}".capitalize(),
+            "description": f"{' '.join(words[8:])} on {about[0]}".capitalize(),
+            "url": f"https://www.{domain}/{published:%Y/%m/%d}/{n}-{'-'.join(words[:5])}",
+            "urlToImage": None,
+            "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "content": None,
+            "language": rng.choice(languages),
+        })
+    return articles
+
+
+def load_corpus(path):
+    """Articles from a JSON list, a NewsAPI response or a JSON-lines file"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data.get("articles", []) if isinstance(data, dict) else data
+
+
+def parse_query(q):
+    """
+    Parse a NewsAPI q into alternatives (joined by OR), each a list of
+    (words, wanted) terms that must all hold
+    """
+    alternatives = [[]]
+    negate = False
+    for phrase, word in QUERY_TOKEN.findall(q):
+        if word == "OR":
+            alternatives.append([])
+            continue
+        if word in ("AND", "(", ")"):
+            continue
+        if word == "NOT":
+            negate = True
+            continue
+        term = phrase or word.strip("()")
+        if not phrase and term[:1] in "+-":
+            negate = term[0] == "-"
+            term = term[1:]
+        term = _words(term)
+        if term:
+            alternatives[-1].append((f" {term} ", not negate))
+        negate = False
+    return [alternative for alternative in alternatives if alternative]
+
+
+def _date(value, end=False):
+    """Parse a from/to value; a bare date as ``to`` means the end of that day"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1, microseconds=-1)
+    return parsed
+
+
+class Indexed:
+    __slots__ = ('article', 'text', 'host', 'published', 'language', 'popularity')
+
+    def __init__(self, article):
+        language = article.get("language")
+        self.article = {name: value for name, value in article.items() if name != "language"}
+        self.text = f" {_words(' '.join(filter(None, (article.get('title'), article.get('description'), article.get('content')))))} "
+        self.host = (article.get("url") or "").split("/")[2] if "://" in (article.get("url") or "") else ""
+        self.published = _date(article["publishedAt"]) if article.get("publishedAt") else None
+        self.language = language
+        self.popularity = int(hashlib.md5((article.get("url") or "").encode()).hexdigest()[:8], 16)
+
+    def from_domain(self, domains):
+        return any(self.host == domain or self.host.endswith("." + domain) for domain in domains)
+
+
+class NewsApiError(fake_http.HttpError):
+    def __init__(self, status, code, message):
+        super().__init__(status, {"status": "error", "code": code, "message": message})
+
+
+class FakeNewsApi:
+    """
+    In-memory /everything over a corpus
+
+    ``daily_limit`` counts requests per API key (0 for no limit); keys in
+    ``exhausted_keys`` are refused as if their plan ran out. ``error_rate``
+    is the share of requests answered with a 500.
+    """
+
+    def __init__(self, articles=(), latency=0.2, jitter=0.0, error_rate=0.0, daily_limit=0,
+                 exhausted_keys=(), max_results=MAX_RESULTS, upstream=None, record=None, seed=7):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.daily_limit = daily_limit
+        self.exhausted_keys = set(exhausted_keys)
+        self.max_results = max_results
+        self.upstream = upstream.rstrip("/") + "/everything" if upstream else None
+        self.record = record
+        self.rng = random.Random(seed)
+        self.articles = []
+        self.urls = set()
+        self.add_articles(articles)
+        self.reset()
+
+    def add_articles(self, articles):
+        for article in articles:
+            url = article.get("url")
+            if url in self.urls:
+                continue
+            self.urls.add(url)
+            self.articles.append(Indexed(article))
+        self._results = OrderedDict()
+
+    def reset(self):
+        self.calls = 0
+        self.statuses = Counter()
+        self.key_usage = Counter()
+        self.started = time.monotonic()
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "key_usage": {key[:8]: count for key, count in self.key_usage.items()},
+            "articles": len(self.articles),
+            "seconds": round(time.monotonic() - self.started, 3),
+        }
+
+    def set_faults(self, faults):
+        for name in ("latency", "jitter", "error_rate", "daily_limit"):
+            if name in faults:
+                setattr(self, name, type(getattr(self, name))(faults[name]))
+        if "exhausted_keys" in faults:
+            self.exhausted_keys = set(faults["exhausted_keys"])
+        return {name: getattr(self, name) for name in ("latency", "jitter", "error_rate", "daily_limit")}
+
+    async def handle(self, verb, path, params, body):
+        if path == "/_stats":
+            return 200, self.stats()
+        if path == "/_reset":
+            self.reset()
+            return 200, {"ok": True}
+        if path == "/_faults" and verb == "POST":
+            return 200, self.set_faults(json.loads(body or b"{}"))
+        if not path.rstrip("/").endswith("/everything"):
+            raise NewsApiError(404, "endpointNotFound", "This endpoint is not available.")
+        self.calls += 1
+        try:
+            status, payload = await self.everything(params)
+        except fake_http.HttpError as e:
+            self.statuses[e.status] += 1
+            raise
+        self.statuses[status] += 1
+        return status, payload
+
+    async def everything(self, params):
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.upstream:
+            return await asyncio.to_thread(self._forward, params)
+
+        api_key = params.get("apiKey")
+        if not api_key:
+            raise NewsApiError(401, "apiKeyMissing", "Your API key is missing.")
+        if api_key in self.exhausted_keys:
+            raise NewsApiError(401, "apiKeyExhausted", "Your API key has no more requests available.")
+        if self.daily_limit and self.key_usage[api_key] >= self.daily_limit:
+            raise NewsApiError(429, "rateLimited", "You have made too many requests recently.")
+        self.key_usage[api_key] += 1
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise NewsApiError(500, "unexpectedError", "This shouldn't happen, and if it does then it's our fault.")
+
+        q = params.get("q", "")
+        domains = params.get("domains", "")
+        if not q and not domains:
+            raise NewsApiError(400, "parametersMissing", "Required parameters are missing. Please set any of the following parameters and try again: q, qInTitle, sources, domains.")
+        if len(q) > MAX_QUERY_LENGTH:
+            raise NewsApiError(400, "parameterInvalid", f"The q parameter is too long, it must be at most {MAX_QUERY_LENGTH} characters.")
+        page_size = min(int(params.get("pageSize", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = int(params.get("page", 1))
+        if self.max_results and page * page_size > self.max_results:
+            raise NewsApiError(426, "maximumResultsReached", f"You have requested too many results. Developer accounts are limited to a max of {self.max_results} results.")
+
+        results = self._search(q, domains, params.get("from"), params.get("to"),
+                               params.get("language"), params.get("sortBy", "publishedAt"))
+        start = (page - 1) * page_size
+        return 200, {
+            "status": "ok",
+            "totalResults": len(results),
+            "articles": [indexed.article for indexed in results[start:start + page_size]],
+        }
+
+    def _search(self, q, domains, since, until, language, sort_by):
+        key = (q, domains, since, until, language, sort_by)
+        results = self._results.get(key)
+        if results is not None:
+            self._results.move_to_end(key)
+            return results
+
+        alternatives = parse_query(q) if q else None
+        domain_list = [domain.strip().lower() for domain in domains.split(",") if domain.strip()]
+        since = _date(since) if since else None
+        until = _date(until, end=True) if until else None
+        scored = []
+        for indexed in self.articles:
+            if language and indexed.language and indexed.language != language:
+                continue
+            if domain_list and not indexed.from_domain(domain_list):
+                continue
+            if indexed.published and ((since and indexed.published < since) or (until and indexed.published > until)):
+                continue
+            score = 0
+            if alternatives:
+                matched = [alternative for alternative in alternatives
+                           if all((term in indexed.text) == wanted for term, wanted in alternative)]
+                if not matched:
+                    continue
+                score = sum(indexed.text.count(term) for alternative in matched for term, wanted in alternative if wanted)
+            scored.append((score, indexed))
+
+        newest = lambda item: item[1].published or datetime.min.replace(tzinfo=timezone.utc)
+        if sort_by == "relevancy":
+            scored.sort(key=lambda item: (item[0], newest(item)), reverse=True)
+        elif sort_by == "popularity":
+            scored.sort(key=lambda item: item[1].popularity, reverse=True)
+        else:
+            scored.sort(key=newest, reverse=True)
+        results = self._results[key] = [indexed for _, indexed in scored]
+        if len(self._results) > RESULT_CACHE_SIZE:
+            self._results.popitem(last=False)
+        return results
+
+    def _forward(self, params):
+        """Proxy to the real NewsAPI and record the articles it returns"""
+        response = requests.get(self.upstream, params=params, timeout=30)
+        try:
+            payload = response.json()
+        except ValueError:
+            raise NewsApiError(502, "unexpectedError", "Upstream answered with invalid JSON.")
+        if response.status_code == 200 and self.record:
+            new = [dict(article, language=params.get("language")) for article in payload.get("articles", [])
+                   if article.get("url") not in self.urls]
+            self.add_articles(new)
+            with open(self.record, 'a', encoding='utf-8') as f:
+                for article in new:
+                    f.write(json.dumps(article, ensure_ascii=False) + "\n")
+        return response.status_code, payload
+
+
+def _build(options):
+    corpus = options.pop("corpus", None)
+    count = options.pop("synthetic", 0)
+    languages = options.pop("languages", ("en",))
+    articles = []
+    if corpus and os.path.exists(corpus):
+        articles = load_corpus(corpus)
+    elif count:
+        articles = synthetic_corpus(count, languages=languages)
+    if options.get("upstream"):
+        options["record"] = corpus
+    return FakeNewsApi(articles, **options)
+
+
+async def serve(host="127.0.0.1", port=0, ready=None, **options):
+    """
+    Run the fake server until cancelled. Besides FakeNewsApi's options,
+    takes ``corpus`` (a file) or ``synthetic`` (a number of articles).
+    """
+    await fake_http.serve(_build(options).handle, host, port, ready,
+                          banner="Fake NewsAPI listening, NEWS_API_BASE_URL=http://{host}:{port}/v2/")
+
+
+def _run(host, port, options, ready):
+    asyncio.run(serve(host, port, ready, **options))
+
+
+def start_fake_server(host="127.0.0.1", port=0, **options):
+    """
+    Start the fake server in a child process. Returns (process, base_url);
+    stop it with ``process.terminate()``.
+    """
+    process, port = fake_http.start_in_process(_run, host, port, options)
+    return process, f"http://{host}:{port}/v2/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--corpus', default=None, help="article file to serve, or to record into with --upstream")
+    parser.add_argument('--articles', type=int, default=10000, help="synthetic articles when there is no corpus")
+    parser.add_argument('--languages', nargs='+', default=['en'])
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument('--daily-limit', type=int, default=0, help="requests per API key, 0 for no limit")
+    parser.add_argument('--exhausted-keys', nargs='*', default=[])
+    parser.add_argument('--max-results', type=int, default=MAX_RESULTS, help="0 for no paging limit")
+    parser.add_argument('--upstream', default=None, help="forward to this NewsAPI base URL and record into --corpus")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(
+            args.host, args.port,
+            corpus=args.corpus, synthetic=args.articles, languages=tuple(args.languages),
+            latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+            daily_limit=args.daily_limit, exhausted_keys=args.exhausted_keys,
+            max_results=args.max_results, upstream=args.upstream,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
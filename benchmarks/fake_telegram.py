@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API
+Implements getUpdates, sendMessage, editMessageText, editMessageReplyMarkup
+and answerCallbackQuery (plus the getMe/deleteWebhook calls PTB makes on
+startup) with configurable latency and Telegram-style flood control: a
+per-chat and a global message rate, answered with 429 and ``retry_after``
+like the real API. Point the bot at it with TELEGRAM_BASE_URL.
+
+Updates for getUpdates are queued with POST /_updates (a JSON list of
+Update objects, see message_update() and callback_update()). GET /_stats
+returns call counters, POST /_reset clears them.
+
+Usage: python benchmarks/fake_telegram.py --port 8081 --latency-ms 50
+       TELEGRAM_BASE_URL=http://127.0.0.1:8081/bot python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks import fake_http
+from src.rate_limit import TokenBucket
+from src.renderer import MESSAGE_LIMIT, message_length, html_length
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "NewsBot", "username": "fake_news_bot"}
+
+# Methods that post to a chat and count against its flood limits
+CHAT_METHODS = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup')
+
+# Longest getUpdates long poll the server holds open, in seconds
+MAX_POLL_TIMEOUT = 50
+
+
+def message_update(update_id, chat_id, text):
+    """An Update with a private text message; bot commands get their entity"""
+    message = {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        "from": {"id": abs(chat_id), "is_bot": False, "first_name": "User"},
+    }
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id, chat_id, data, message_id=1):
+    """An Update with a callback query for a button on a bot message"""
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": str(chat_id), "data": data,
+        "from": {"id": abs(chat_id), "is_bot": False, "first_name": "User"},
+        "message": {"message_id": message_id, "date": int(time.time()), "text": "menu",
+                    "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER},
+    }}
+
+
+class ApiError(fake_http.HttpError):
+    def __init__(self, code, description, retry_after=None):
+        payload = {"ok": False, "error_code": code, "description": description}
+        if retry_after is not None:
+            payload["parameters"] = {"retry_after": retry_after}
+        super().__init__(code, payload)
+
+
+class FakeTelegram:
+    """
+    In-memory Bot API state and method implementations
+
+    ``chat_rate`` and ``global_rate`` are messages per second (0 turns the
+    limit off); group chats (negative ids) get ``group_rate_per_minute``
+    instead of ``chat_rate``, as on Telegram. Chats whose id hashes into
+    ``blocked_ratio`` answer 403 as if the user blocked the bot.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, chat_rate=1.0, chat_burst=3, group_rate_per_minute=20,
+                 global_rate=30.0, global_burst=30, blocked_ratio=0.0, seed=7):
+        self.latency = latency
+        self.jitter = jitter
+        self.blocked_ratio = blocked_ratio
+        self.rng = random.Random(seed)
+        self.chat_limit = TokenBucket(chat_burst, chat_rate) if chat_rate else None
+        self.group_limit = TokenBucket(chat_burst, group_rate_per_minute / 60) if group_rate_per_minute else None
+        self.global_limit = TokenBucket(global_burst, global_rate) if global_rate else None
+        self.updates = []
+        self.updates_changed = asyncio.Event()
+        self.next_update_id = 1
+        self.message_ids = Counter()
+        self.messages = {}  # (chat_id, message_id) -> (hash of text, hash of markup)
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.flood_waits = 0
+        self.forbidden = 0
+        self.bad_requests = 0
+        self.chats = set()
+        self.started = time.monotonic()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "calls": dict(self.calls),
+            "flood_waits": self.flood_waits,
+            "forbidden": self.forbidden,
+            "bad_requests": self.bad_requests,
+            "chats": len(self.chats),
+            "pending_updates": len(self.updates),
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(sum(self.calls[m] for m in CHAT_METHODS) / elapsed, 1) if elapsed else 0,
+        }
+
+    def add_updates(self, updates):
+        for update in updates:
+            update.setdefault("update_id", self.next_update_id)
+            self.next_update_id = max(self.next_update_id, update["update_id"]) + 1
+            self.updates.append(update)
+        self.updates_changed.set()
+        return len(updates)
+
+    async def handle(self, verb, path, params, body):
+        if path == "/_stats":
+            return 200, self.stats()
+        if path == "/_reset":
+            self.reset()
+            return 200, {"ok": True}
+        if path == "/_updates" and verb == "POST":
+            return 200, {"ok": True, "queued": self.add_updates(json.loads(body))}
+        if not (path.startswith("/bot") and path.count("/") == 2):
+            raise ApiError(404, "Not Found")
+        try:
+            return 200, {"ok": True, "result": await self.call(path.rsplit("/", 1)[1], params)}
+        except (ValueError, KeyError) as e:
+            raise self._bad_request(str(e))
+
+    async def call(self, method, params):
+        handler = getattr(self, 'api_' + method, None)
+        if handler is None:
+            raise ApiError(404, "Not Found")
+        if method in CHAT_METHODS:
+            self._check_chat(params)
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        self.calls[method] += 1
+        return await handler(params)
+
+    def _check_chat(self, params):
+        try:
+            chat_id = int(params["chat_id"])
+        except (KeyError, ValueError):
+            raise ApiError(400, "Bad Request: chat_id is empty")
+        if self.blocked_ratio and (chat_id * 2654435761) % 1000 < self.blocked_ratio * 1000:
+            self.forbidden += 1
+            raise ApiError(403, "Forbidden: bot was blocked by the user")
+        limit = self.group_limit if chat_id < 0 else self.chat_limit
+        for bucket, key in ((limit, chat_id), (self.global_limit, None)):
+            wait = bucket.take(key) if bucket else 0
+            if wait:
+                self.flood_waits += 1
+                retry_after = max(1, math.ceil(wait))
+                raise ApiError(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+        self.chats.add(chat_id)
+
+    def _bad_request(self, description):
+        self.bad_requests += 1
+        return ApiError(400, "Bad Request: " + description)
+
+    def _text(self, params):
+        text = params.get("text", "")
+        if not text.strip():
+            raise self._bad_request("message text is empty")
+        length = html_length(text) if str(params.get("parse_mode", "")).upper() == "HTML" else message_length(text)
+        if length > MESSAGE_LIMIT:
+            raise self._bad_request("message is too long")
+        return text
+
+    def _message(self, chat_id, message_id, text=None):
+        message = {
+            "message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+        }
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def _existing(self, params):
+        key = (int(params["chat_id"]), int(params.get("message_id", 0)))
+        if key not in self.messages:
+            raise self._bad_request("message to edit not found")
+        return key
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_deleteWebhook(self, params):
+        return True
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get("offset", 0))
+        limit = min(int(params.get("limit", 100)), 100)
+        if offset:
+            # Asking for an offset confirms every update before it
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates:
+            self.updates_changed.clear()
+            try:
+                await asyncio.wait_for(self.updates_changed.wait(), min(float(params.get("timeout", 0)), MAX_POLL_TIMEOUT))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def api_sendMessage(self, params):
+        text = self._text(params)
+        chat_id = int(params["chat_id"])
+        self.message_ids[chat_id] += 1
+        message_id = self.message_ids[chat_id]
+        self.messages[(chat_id, message_id)] = (hash(text), hash(params.get("reply_markup")))
+        return self._message(chat_id, message_id, text)
+
+    async def api_editMessageText(self, params):
+        key = self._existing(params)
+        text = self._text(params)
+        state = (hash(text), hash(params.get("reply_markup")))
+        if self.messages[key] == state:
+            raise self._bad_request("message is not modified")
+        self.messages[key] = state
+        return self._message(*key, text)
+
+    async def api_editMessageReplyMarkup(self, params):
+        key = self._existing(params)
+        text_hash, markup_hash = self.messages[key]
+        if markup_hash == hash(params.get("reply_markup")):
+            raise self._bad_request("message is not modified")
+        self.messages[key] = (text_hash, hash(params.get("reply_markup")))
+        return self._message(*key)
+
+    async def api_answerCallbackQuery(self, params):
+        if not params.get("callback_query_id"):
+            raise self._bad_request("query is too old and response timeout expired or query ID is invalid")
+        return True
+
+
+async def serve(host="127.0.0.1", port=0, ready=None, **options):
+    """Run the fake server until cancelled; ``ready`` (a queue) receives the port once listening"""
+    await fake_http.serve(FakeTelegram(**options).handle, host, port, ready,
+                          banner="Fake Bot API listening, TELEGRAM_BASE_URL=http://{host}:{port}/bot")
+
+
+def _run(host, port, options, ready):
+    asyncio.run(serve(host, port, ready, **options))
+
+
+def start_fake_server(host="127.0.0.1", port=0, **options):
+    """
+    Start the fake server in a child process. Returns (process, base_url);
+    stop it with ``process.terminate()``.
+    """
+    process, port = fake_http.start_in_process(_run, host, port, options)
+    return process, f"http://{host}:{port}/bot"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--chat-rate', type=float, default=1.0, help="messages per second per private chat, 0 for no limit")
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--group-rate-per-minute', type=float, default=20, help="0 for no limit")
+    parser.add_argument('--global-rate', type=float, default=30.0, help="messages per second over all chats, 0 for no limit")
+    parser.add_argument('--global-burst', type=int, default=30)
+    parser.add_argument('--blocked-ratio', type=float, default=0.0, help="share of chats that answer 403")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(
+            args.host, args.port,
+            latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+            chat_rate=args.chat_rate, chat_burst=args.chat_burst,
+            group_rate_per_minute=args.group_rate_per_minute,
+            global_rate=args.global_rate, global_burst=args.global_burst,
+            blocked_ratio=args.blocked_ratio,
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Measure table and index size of the user preference tables
+Compares the free-text layout (before normalization) with the topics/sources
+dimension tables and small-int foreign keys, for a given number of users.
+
+Usage: python benchmarks/schema_size.py --users 1000000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import create_engine
+from src.models import Base, seed_catalogue, delivery_slot_for
+from src.categories import get_all_topics, get_all_sources
+
+# Rows every new user gets from create_user()
+DEFAULT_SOURCES = ['cnn.com', 'bbc.com', 'theverge.com', 'techcrunch.com', 'nytimes.com']
+DEFAULT_TOPICS = ["Technology", "Programming", "AI", "Machine Learning"]
+
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, chat_id VARCHAR(50) NOT NULL, username VARCHAR(100),
+    first_name VARCHAR(100), last_name VARCHAR(100), created_at DATETIME,
+    last_activity DATETIME, language VARCHAR(10),
+    PRIMARY KEY (id), UNIQUE (chat_id)
+);
+CREATE TABLE user_sources (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, source_domain VARCHAR(100) NOT NULL,
+    is_enabled BOOLEAN, created_at DATETIME,
+    PRIMARY KEY (id), CONSTRAINT uq_user_source UNIQUE (user_id, source_domain),
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE TABLE user_topics (
+    id INTEGER NOT NULL, user_id INTEGER NOT NULL, topic_name VARCHAR(100) NOT NULL,
+    category VARCHAR(50) NOT NULL, is_enabled BOOLEAN, created_at DATETIME,
+    PRIMARY KEY (id), CONSTRAINT uq_user_topic UNIQUE (user_id, topic_name),
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+"""
+
+
+def populate(conn, users, normalized, batch_size=50000):
+    """Insert ``users`` users with the default preference rows"""
+    now = datetime.utcnow().isoformat(sep=' ')
+    if normalized:
+        topic_ids = dict(conn.execute("SELECT name, id FROM topics"))
+        source_ids = dict(conn.execute("SELECT domain, id FROM sources"))
+        topic_values = [(topic_ids[t],) for t in DEFAULT_TOPICS]
+        source_values = [(source_ids[s],) for s in DEFAULT_SOURCES]
+        topic_sql = "INSERT INTO user_topics (user_id, topic_id, is_enabled, created_at) VALUES (?, ?, 1, ?)"
+        source_sql = "INSERT INTO user_sources (user_id, source_id, is_enabled, created_at) VALUES (?, ?, 1, ?)"
+        user_sql = ("INSERT INTO users (id, chat_id, created_at, last_activity, language, delivery_slot, "
+                    "is_deliverable) VALUES (?, ?, ?, ?, 'en', ?, 1)")
+    else:
+        topic_values = [(t, 'tech') for t in DEFAULT_TOPICS]
+        source_values = [(s,) for s in DEFAULT_SOURCES]
+        topic_sql = "INSERT INTO user_topics (user_id, topic_name, category, is_enabled, created_at) VALUES (?, ?, ?, 1, ?)"
+        source_sql = "INSERT INTO user_sources (user_id, source_domain, is_enabled, created_at) VALUES (?, ?, 1, ?)"
+        user_sql = "INSERT INTO users (id, chat_id, created_at, last_activity, language) VALUES (?, ?, ?, ?, 'en')"
+
+    for start in range(1, users + 1, batch_size):
+        ids = range(start, min(start + batch_size, users + 1))
+        chat_ids = [(i, str(100000000 + i)) for i in ids]
+        if normalized:
+            user_values = ((i, chat_id, now, now, delivery_slot_for(chat_id)) for i, chat_id in chat_ids)
+        else:
+            user_values = ((i, chat_id, now, now) for i, chat_id in chat_ids)
+        conn.executemany(user_sql, user_values)
+        conn.executemany(topic_sql, ((i,) + v + (now,) for i in ids for v in topic_values))
+        conn.executemany(source_sql, ((i,) + v + (now,) for i in ids for v in source_values))
+        conn.commit()
+
+
+def measure(path):
+    """Return the on-disk size in bytes of every table and index, from dbstat"""
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT d.name, m.type, m.tbl_name, SUM(d.pgsize) FROM dbstat d "
+            "JOIN sqlite_master m ON m.name = d.name GROUP BY d.name"
+        ).fetchall()
+    finally:
+        conn.close()
+    objects = {name: {'type': kind, 'table': table, 'bytes': size} for name, kind, table, size in rows}
+    totals = {}
+    for obj in objects.values():
+        if obj['table'] in ('user_topics', 'user_sources', 'topics', 'sources'):
+            key = 'index_bytes' if obj['type'] == 'index' else 'table_bytes'
+            totals[key] = totals.get(key, 0) + obj['bytes']
+    return {'objects': objects, 'preference_tables': totals, 'file_bytes': os.path.getsize(path)}
+
+
+def build(path, users, normalized):
+    if normalized:
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        seed_catalogue(engine)
+        engine.dispose()
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    if not normalized:
+        conn.executescript(LEGACY_SCHEMA)
+    started = time.perf_counter()
+    populate(conn, users, normalized)
+    conn.execute("VACUUM")
+    conn.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--output', default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    results = {
+        'users': args.users,
+        'rows_per_user': {'user_topics': len(DEFAULT_TOPICS), 'user_sources': len(DEFAULT_SOURCES)},
+        'catalogue': {'topics': len(get_all_topics()), 'sources': len(get_all_sources())},
+        'engine': f"sqlite {sqlite3.sqlite_version}",
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for layout, normalized in (('free_text', False), ('normalized', True)):
+            path = os.path.join(tmp, f"{layout}.db")
+            print(f"Building {layout} schema with {args.users} users...")
+            elapsed = build(path, args.users, normalized)
+            results[layout] = measure(path)
+            results[layout]['populate_seconds'] = round(elapsed, 2)
+
+    before = results['free_text']['preference_tables']
+    after = results['normalized']['preference_tables']
+    results['savings'] = {
+        key: round(1 - after[key] / before[key], 3) for key in ('table_bytes', 'index_bytes')
+    }
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', f"schema_size_{args.users}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    for layout in ('free_text', 'normalized'):
+        totals = results[layout]['preference_tables']
+        print(f"{layout:>10}: tables {totals['table_bytes'] / 2**20:8.1f} MiB, "
+              f"indexes {totals['index_bytes'] / 2**20:8.1f} MiB")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Shared setup for the pytest suites
+Loads .env the way the bot does and provides the fakes several test modules use
+"""
+
+import pytest
+from dotenv import load_dotenv
+
+# Load environment variables before the src modules read their settings
+load_dotenv()
+
+
+class FakeClock:
+    """Callable clock the tests move forward by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_articles():
+    """Factory for ``count`` numbered articles"""
+    from src.article import Article
+
+    def make(count, title="Story", description="Something happened", prefix="https://example.com/"):
+        return [
+            Article(f"{title} {i}", description, "Example", f"{prefix}{i}", "2030-01-01T00:00:00Z")
+            for i in range(count)
+        ]
+    return make
@@ -8,8 +8,14 @@ import os
 import logging
 import sys
 from dotenv import load_dotenv
+
+# Load environment variables before the src modules read their settings
+load_dotenv()
+
 from src.telegram_bot import TelegramBot
 from src.models import create_database
+from src.metrics import start_http_server, METRICS_PORT, METRICS_ADDR
+from src import query_profiler
 
 # Configure logging for production
 logging.basicConfig(
@@ -32,9 +38,6 @@ def handle_exception(exc_type, exc_value, exc_traceback):
 
 sys.excepthook = handle_exception
 
-# Load environment variables
-load_dotenv()
-
 def main():
     # Create database tables
     logger.info("Creating database tables...")
@@ -50,6 +53,14 @@ def main():
     if not bot_token:
         raise ValueError("BOT_TOKEN is not set in environment variables.")
 
+    # Prometheus metrics, scraped from a small HTTP server in a background thread
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, METRICS_ADDR)
+        logger.info(f"Serving metrics on http://{METRICS_ADDR}:{METRICS_PORT}/metrics")
+
+    # kill -USR2 <pid> switches the query profiler on and off
+    query_profiler.install_signal()
+
     logger.info("Starting Telegram bot...")
 
     # Run bot (no await, no asyncio.run)
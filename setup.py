@@ -50,6 +50,8 @@ def create_env_file():
 
 # API Keys
 API_KEY=your_newsapi_key_here
+# Optional pool of NewsAPI keys (comma separated), used instead of API_KEY
+# API_KEYS=key_one,key_two
 BOT_TOKEN=your_telegram_bot_token_here
 
 # Database Configuration
@@ -66,14 +68,81 @@ DATABASE_URL=sqlite:///newsreader.db
 BOT_WEBHOOK_URL=  # Leave empty for polling mode
 BOT_PORT=8443     # Only needed for webhook mode
 
-# News API Configuration
+# Telegram Bot API endpoint (the token is appended); for load tests point it
+# at benchmarks/fake_telegram.py, e.g. http://127.0.0.1:8081/bot
+TELEGRAM_BASE_URL=https://api.telegram.org/bot
+# Telegram Bot API connections for outgoing calls and their timeouts in seconds
+TELEGRAM_POOL_SIZE=256
+TELEGRAM_CONNECT_TIMEOUT=5
+TELEGRAM_READ_TIMEOUT=10
+TELEGRAM_WRITE_TIMEOUT=10
+TELEGRAM_POOL_TIMEOUT=5
+# Requires: pip install "httpx[http2]"
+TELEGRAM_HTTP2=false
+
+# News API Configuration; for load tests point NEWS_API_BASE_URL at
+# benchmarks/fake_newsapi.py, e.g. http://127.0.0.1:8082/v2/
 NEWS_API_BASE_URL=https://newsapi.org/v2/
-NEWS_API_TIMEOUT=30
+NEWS_API_TIMEOUT=10
+# After this many failed calls in a row NewsAPI is not called for
+# NEWS_API_BREAKER_RESET_SECONDS; cached articles are served meanwhile
+NEWS_API_BREAKER_FAILURES=5
+NEWS_API_BREAKER_RESET_SECONDS=60
+# Fetched NewsAPI pages are shared between users for this many seconds
+NEWS_PAGE_CACHE_SECONDS=300
+# Requests per NewsAPI key per day, and the share of it kept for /news
+NEWS_API_DAILY_LIMIT=100
+NEWS_API_INTERACTIVE_RESERVE=0.2
+# Below this share of the scheduled budget, digest cycles only reach active users
+NEWS_API_LOW_WATERMARK=0.3
+# NewsAPI calls at the same time; /news and Get News go ahead of scheduled news
+UPSTREAM_CONCURRENCY=4
+# On-demand news per chat: up to NEWS_RATE_BURST at once, refilling per minute
+NEWS_RATE_BURST=3
+NEWS_RATE_PER_MINUTE=2
+
+# Delivery Scheduling
+# Each cycle is spread over this many minutes, centred on the cycle hour
+DELIVERY_WINDOW_MINUTES=60
+# Users inactive for more than DELIVERY_ACTIVE_DAYS only get the digest cycle
+# at DELIVERY_DIGEST_HOUR; after DELIVERY_DORMANT_DAYS they get nothing
+DELIVERY_ACTIVE_DAYS=7
+DELIVERY_DORMANT_DAYS=30
+DELIVERY_DIGEST_HOUR=8
+
+# Interface
+# Articles per news digest; long digests are split over as few messages as fit
+DIGEST_MAX_ARTICLES=5
+# Show a link preview for the first article of each digest
+DIGEST_LINK_PREVIEW=false
+# Toggle taps within this many seconds are saved and shown together
+TOGGLE_DEBOUNCE_SECONDS=0.7
 
 # Logging Configuration
 LOG_LEVEL=INFO
 LOG_FILE=bot.log
 
+# Prometheus metrics at http://METRICS_ADDR:METRICS_PORT/metrics; leave empty to turn off
+METRICS_PORT=9108
+METRICS_ADDR=127.0.0.1
+
+# Span traces of updates and deliveries, written to TRACE_FILE (rotated at
+# TRACE_MAX_BYTES); leave TRACE_FILE empty to turn off. A TRACE_SAMPLE_RATE
+# share of traces is kept, plus every trace slower than TRACE_SLOW_MS.
+# Summarize with: python -m src.tracing --top 10
+TRACE_FILE=
+TRACE_SAMPLE_RATE=0.01
+TRACE_SLOW_MS=1000
+TRACE_MAX_BYTES=10485760
+TRACE_BACKUPS=5
+
+# Query profiler: statements per update, N+1 candidates and slow queries with
+# their call sites. Also switched at runtime with SIGUSR2 or
+# POST /queries?enabled=1 on the metrics server; GET /queries shows the report
+QUERY_PROFILER=false
+QUERY_SLOW_MS=100
+QUERY_REPEAT_THRESHOLD=5
+
 # Development Settings
 DEBUG=False
 ENVIRONMENT=production
@@ -0,0 +1,59 @@
+import sys
+
+# Characters of the description that are kept (the message shows this many)
+DESCRIPTION_LENGTH = 100
+
+
+class Article:
+    """
+    A news article as the bot uses it
+
+    Parsed once from a NewsAPI article dict, keeping only the fields a news
+    message shows. Instances are slotted and immutable, so they can be held
+    in caches and shared between users. Source names are interned, since a
+    few dozen sources cover every article.
+    """
+
+    __slots__ = ('title', 'description', 'source', 'url', 'published_at')
+
+    def __init__(self, title, description, source, url, published_at=None):
+        set_field = object.__setattr__
+        set_field(self, 'title', title)
+        set_field(self, 'description', description)
+        set_field(self, 'source', source)
+        set_field(self, 'url', url)
+        set_field(self, 'published_at', published_at)
+
+    @classmethod
+    def from_api(cls, data):
+        """Build an Article from a NewsAPI article dict"""
+        source = (data.get("source") or {}).get("name") or "Unknown"
+        return cls(
+            title=data.get("title") or "No title",
+            description=(data.get("description") or "No description")[:DESCRIPTION_LENGTH],
+            source=sys.intern(source),
+            url=data.get("url") or "",
+            published_at=data.get("publishedAt"),
+        )
+
+    @property
+    def id(self):
+        """Stable identity of the article across fetches"""
+        return self.url or self.title
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, Article):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self):
+        return hash((self.url, self.title))
+
+    def __repr__(self):
+        return f"Article({self.title!r}, {self.source!r}, {self.url!r})"
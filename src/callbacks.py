@@ -0,0 +1,121 @@
+from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES
+from src.db_helper import get_catalogue_ids
+
+LANGUAGES = ('en', 'fa')
+
+# Callback data is a two-character action code followed by fixed-width
+# numbers. Toggles carry the id of the topic or source row, which stays the
+# same when the catalogue is reordered; languages and categories carry a
+# two-digit index. For example "tt00042" toggles the topic with id 42.
+SET_LANGUAGE = "la"     # la<language>
+TOPIC_CATEGORY = "tc"   # tc<category>
+SOURCE_CATEGORY = "sc"  # sc<category>
+TOPIC_TOGGLE = "tt"     # tt<topic id>
+SOURCE_TOGGLE = "st"    # st<source id>
+SHOW_TOPICS = "mt"
+SHOW_SOURCES = "ms"
+GET_NEWS = "gn"
+
+# Readable action names, after the old callback data formats (for metrics)
+ACTION_NAMES = {
+    SET_LANGUAGE: "set_lang", TOPIC_CATEGORY: "cat", SOURCE_CATEGORY: "src_cat",
+    TOPIC_TOGGLE: "topic", SOURCE_TOGGLE: "source", SHOW_TOPICS: "show_topics",
+    SHOW_SOURCES: "show_sources", GET_NEWS: "get_news",
+}
+
+
+# Digits of a topic or source id; the ids are SMALLINTs
+ID_WIDTH = 5
+
+
+def encode(action, *numbers, width=2):
+    """Build callback data from an action code and catalogue indexes or ids"""
+    return action + "".join(f"{number:0{width}d}" for number in numbers)
+
+
+def _build_table():
+    """
+    Map every valid callback data string to (action, args)
+
+    The catalogue is small and fixed, so all callback data is known up
+    front. Decoding is then a single dict lookup, and the args are already
+    resolved to language codes, category ids, topic names and domains.
+    The old formats, text ("topic:AI", "cat:tech", ...) and toggles by
+    catalogue index ("tt0102"), are kept so buttons on messages sent before
+    the switch still work.
+    """
+    topic_ids, source_ids = get_catalogue_ids()
+    table = {}
+    encoded = {}
+
+    def add(data, action, args, *legacy):
+        table[data] = (action, args)
+        for old in legacy:
+            table.setdefault(old, (action, args))
+        encoded[action, args] = data
+
+    for lang_index, lang in enumerate(LANGUAGES):
+        add(encode(SET_LANGUAGE, lang_index), SET_LANGUAGE, (lang,), f"set_lang_{lang}")
+    add(encode(SHOW_TOPICS), SHOW_TOPICS, (), "show_topics")
+    add(encode(SHOW_SOURCES), SHOW_SOURCES, (), "show_sources")
+    add(encode(GET_NEWS), GET_NEWS, (), "get_news")
+
+    for cat_index, (cat_id, cat_data) in enumerate(TOPIC_CATEGORIES.items()):
+        add(encode(TOPIC_CATEGORY, cat_index), TOPIC_CATEGORY, (cat_id,), f"cat:{cat_id}")
+        for topic_index, topic in enumerate(cat_data["topics"]):
+            add(encode(TOPIC_TOGGLE, topic_ids[topic], width=ID_WIDTH), TOPIC_TOGGLE, (topic,),
+                f"topic:{topic}", encode(TOPIC_TOGGLE, cat_index, topic_index))
+
+    for cat_index, (cat_id, cat_data) in enumerate(SOURCE_CATEGORIES.items()):
+        add(encode(SOURCE_CATEGORY, cat_index), SOURCE_CATEGORY, (cat_id,), f"src_cat:{cat_id}")
+        for source_index, source in enumerate(cat_data["sources"]):
+            add(encode(SOURCE_TOGGLE, source_ids[source], width=ID_WIDTH), SOURCE_TOGGLE, (source,),
+                f"source:{source}", encode(SOURCE_TOGGLE, cat_index, source_index))
+
+    return table, encoded
+
+
+# Built on first use, once the ids can be read from the database
+CALLBACKS = {}
+_ENCODED = {}
+
+
+def _load():
+    if not CALLBACKS:
+        table, encoded = _build_table()
+        _ENCODED.update(encoded)
+        CALLBACKS.update(table)
+
+
+def callback_data(action, *args):
+    """Get the compact callback data for an action and its resolved args, e.g. (TOPIC_TOGGLE, "AI")"""
+    _load()
+    return _ENCODED[action, args]
+
+
+def decode(data):
+    """Return (action, args) for callback data, or None if it is unknown"""
+    _load()
+    return CALLBACKS.get(data)
+
+
+class CallbackRouter:
+    """Dispatch callback queries to handlers through an action table"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, action, handler):
+        """Register ``handler(query, context, *args)`` for an action code"""
+        self.handlers[action] = handler
+
+    async def dispatch(self, query, context):
+        """Call the handler for the query's callback data; returns False if there is none"""
+        decoded = decode(query.data)
+        if decoded is None:
+            return False
+        handler = self.handlers.get(decoded[0])
+        if handler is None:
+            return False
+        await handler(query, context, *decoded[1])
+        return True
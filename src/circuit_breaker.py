@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Consecutive upstream failures that open the circuit
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('NEWS_API_BREAKER_FAILURES', 5))
+# Seconds the circuit stays open before a probe request is let through
+BREAKER_RESET_SECONDS = float(os.getenv('NEWS_API_BREAKER_RESET_SECONDS', 60))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream that keeps failing
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    ``allow()`` returns False, so callers fail fast instead of waiting for
+    timeouts. Once ``reset_timeout`` seconds have passed, one probe call is
+    allowed (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go to the upstream now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Give back a call allowed by ``allow()`` that recorded no outcome
+
+        Once the outcome is recorded the circuit is no longer half-open and
+        this does nothing, so callers can release every allowed call.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"Circuit {self.name} opened after {self.failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self._probing = False
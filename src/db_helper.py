@@ -1,92 +1,209 @@
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from src.models import Base, User, UserSource, UserTopic
+from sqlalchemy import create_engine, func
+from src.models import Base, User, UserSource, UserTopic, Topic, Source, BotState, seed_catalogue, delivery_slot_for
 from datetime import datetime
 from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES, get_all_topics, get_all_sources
+from src.request_context import open_request, current_request
+from src.metrics import instrument_engine
+from src.tracing import traced
+from src import query_profiler
 import os
 
+_engine = None
+_Session = None
+
+# Catalogue lookups between names and the small-int ids of the dimension tables
+_topic_ids = {}
+_topic_names = {}
+_source_ids = {}
+_source_names = {}
+
 def get_engine_and_session():
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL is not set in environment variables.")
-    engine = create_engine(database_url)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return engine, Session
+    global _engine, _Session
+    if _engine is None:
+        database_url = os.getenv('DATABASE_URL')
+        if not database_url:
+            raise ValueError("DATABASE_URL is not set in environment variables.")
+        engine = create_engine(database_url)
+        instrument_engine(engine)
+        query_profiler.install(engine)
+        Base.metadata.create_all(engine)
+        seed_catalogue(engine)
+        _load_catalogue(engine)
+        _engine, _Session = engine, sessionmaker(bind=engine)
+    return _engine, _Session
+
+def _load_catalogue(engine):
+    """Load the topic and source dimension tables into the id lookup maps"""
+    with engine.connect() as conn:
+        topics = conn.execute(Topic.__table__.select()).fetchall()
+        sources = conn.execute(Source.__table__.select()).fetchall()
+    # Updated in place, as other threads may be reading; rows are never removed
+    _topic_ids.update((row.name, row.id) for row in topics)
+    _topic_names.update((row.id, row.name) for row in topics)
+    _source_ids.update((row.domain, row.id) for row in sources)
+    _source_names.update((row.id, row.domain) for row in sources)
+
+def _named(rows, id_column, names):
+    """Pair user_topics or user_sources rows with their topic or source name
+
+    Rows the old code wrote during the online migration have no id yet and
+    are skipped. An id added to the dimension tables since the catalogue was
+    loaded, by a migration or another process, reloads it once.
+    """
+    pairs = []
+    reloaded = False
+    for row in rows:
+        item_id = getattr(row, id_column)
+        if item_id is None:
+            continue
+        if item_id not in names and not reloaded:
+            _load_catalogue(_engine)
+            reloaded = True
+        if item_id in names:
+            pairs.append((names[item_id], row))
+    return pairs
+
+def get_catalogue_ids():
+    """Return (topic name -> id, source domain -> id) from the topics and sources tables"""
+    get_engine_and_session()
+    return dict(_topic_ids), dict(_source_ids)
 
 def get_session():
     """Get a new database session"""
     _, Session = get_engine_and_session()
     return Session()
 
+def begin_request(chat_id=None, label=None):
+    """Open the unit of work for one update; db_helper calls reuse its session until end_request()"""
+    # Finish an update that never reached its closing handler, e.g. after ApplicationHandlerStop
+    end_request()
+    return open_request(get_session(), chat_id, label)
+
+def end_request(failed=False):
+    """Commit the current unit of work once (or roll it back) and close its session"""
+    context = current_request()
+    if context is not None:
+        context.failed = context.failed or failed
+        context.close()
+
+def commit_request():
+    """Commit the current unit of work early, e.g. before slow network I/O"""
+    context = current_request()
+    if context is not None:
+        context.commit()
+
+def _open_session():
+    """Get the session of the current update, or a new session outside of one"""
+    context = current_request()
+    if context is not None:
+        return context.session
+    return get_session()
+
+def _in_request(session):
+    context = current_request()
+    return context is not None and context.session is session
+
+def _commit(session):
+    """Commit, or only flush when the session belongs to the current update"""
+    if _in_request(session):
+        session.flush()
+    else:
+        session.commit()
+
+def _rollback(session):
+    """Roll back; a failed update is also rolled back as a whole when it ends"""
+    if _in_request(session):
+        current_request().failed = True
+    session.rollback()
+
+def _close(session):
+    """Close the session unless the current update still uses it"""
+    if not _in_request(session):
+        session.close()
+
+def _find_user(session, chat_id):
+    """Load a user by chat_id, at most once per update"""
+    chat_id = str(chat_id)
+    context = current_request()
+    if context is not None and context.session is session and context.chat_id == chat_id:
+        if context.user is None:
+            context.user = session.query(User).filter_by(chat_id=chat_id).first()
+        return context.user
+    return session.query(User).filter_by(chat_id=chat_id).first()
+
+@traced('db')
 def create_user(chat_id, username=None, first_name=None, last_name=None, language='en'):
     """Create a new user in the database"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if not user:
             user = User(
                 chat_id=str(chat_id),
                 username=username,
                 first_name=first_name,
                 last_name=last_name,
-                language=language
+                language=language,
+                delivery_slot=delivery_slot_for(chat_id)
             )
             session.add(user)
-            session.commit()
             
             # Initialize default sources for new user
             default_sources = ['cnn.com', 'bbc.com', 'theverge.com', 'techcrunch.com', 'nytimes.com']
             for source in default_sources:
                 user_source = UserSource(
-                    user_id=user.id,
-                    source_domain=source,
+                    source_id=_source_ids[source],
                     is_enabled=True
                 )
-                session.add(user_source)
+                user.sources.append(user_source)
             
             # Initialize default topics for new user (Technology category)
             default_topics = ["Technology", "Programming", "AI", "Machine Learning"]
             for topic in default_topics:
                 user_topic = UserTopic(
-                    user_id=user.id,
-                    topic_name=topic,
-                    category="tech",
+                    topic_id=_topic_ids[topic],
                     is_enabled=True
                 )
-                session.add(user_topic)
+                user.topics.append(user_topic)
             
-            session.commit()
+            _commit(session)
+            context = current_request()
+            if context is not None and context.session is session and context.chat_id == str(chat_id):
+                context.user = user
             
         return user
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def update_user_activity(chat_id):
     """Update user's last activity timestamp"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
             user.last_activity = datetime.utcnow()
-            session.commit()
+            _commit(session)
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_user(chat_id):
     """Get user by chat_id"""
-    session = get_session()
+    session = _open_session()
     try:
-        return session.query(User).filter_by(chat_id=str(chat_id)).first()
+        return _find_user(session, chat_id)
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_all_users():
     """Get all users"""
     session = get_session()
@@ -95,179 +212,359 @@ def get_all_users():
     finally:
         session.close()
 
+# Columns a scheduled delivery cycle needs from each user row
+DELIVERY_COLUMNS = (User.id, User.chat_id, User.language)
+
+def iter_user_batches(columns=DELIVERY_COLUMNS, batch_size=1000, shard=None, shard_count=None, active_since=None, slot_range=None, deliverable=None):
+    """Yield pages of user rows in id order using keyset pagination
+
+    Only ``columns`` are selected, so rows are light tuples rather than ORM
+    objects. ``shard``/``shard_count`` split users by ``id % shard_count``,
+    ``active_since`` keeps only users active after that time,
+    ``slot_range`` keeps users whose delivery slot is in ``[start, end)`` and
+    ``deliverable`` filters on users.is_deliverable.
+    """
+    if User.id not in columns:
+        columns = (User.id,) + tuple(columns)
+    last_id = 0
+    while True:
+        session = get_session()
+        try:
+            query = session.query(*columns).filter(User.id > last_id)
+            if shard_count:
+                query = query.filter(User.id % shard_count == shard)
+            if active_since is not None:
+                query = query.filter(User.last_activity >= active_since)
+            if slot_range is not None:
+                query = query.filter(User.delivery_slot >= slot_range[0], User.delivery_slot < slot_range[1])
+            if deliverable is not None:
+                query = query.filter(User.is_deliverable == deliverable)
+            rows = query.order_by(User.id).limit(batch_size).all()
+        finally:
+            session.close()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def iter_users(columns=DELIVERY_COLUMNS, batch_size=1000, shard=None, shard_count=None, active_since=None, slot_range=None, deliverable=None):
+    """Yield user rows one at a time; see iter_user_batches()"""
+    for rows in iter_user_batches(columns, batch_size, shard, shard_count, active_since, slot_range, deliverable):
+        yield from rows
+
+@traced('db')
+def mark_user_undeliverable(chat_id):
+    """Stop scheduled deliveries to a chat that blocked or deleted the bot; returns False if the user was not found"""
+    session = get_session()
+    try:
+        updated = session.query(User).filter_by(chat_id=str(chat_id)).update(
+            {User.is_deliverable: False}, synchronize_session=False
+        )
+        session.commit()
+        return bool(updated)
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
+@traced('db')
+def mark_user_deliverable(chat_id):
+    """Make a chat deliverable again, e.g. after the user sends /start"""
+    session = _open_session()
+    try:
+        user = _find_user(session, chat_id)
+        if user and not user.is_deliverable:
+            user.is_deliverable = True
+            _commit(session)
+    except Exception as e:
+        _rollback(session)
+        raise e
+    finally:
+        _close(session)
+
+@traced('db')
+def count_users_by_activity(active_since, dormant_since):
+    """Count deliverable users per delivery tier using range counts on users.last_activity"""
+    session = get_session()
+    try:
+        deliverable = session.query(func.count(User.id)).filter(User.is_deliverable == True)
+        total = session.query(func.count(User.id)).scalar()
+        reachable = deliverable.scalar()
+        active = deliverable.filter(User.last_activity >= active_since).scalar()
+        recent = deliverable.filter(User.last_activity >= dormant_since).scalar()
+        return {
+            'active': active,
+            'dormant': recent - active,
+            'abandoned': reachable - recent,
+            'undeliverable': total - reachable,
+        }
+    finally:
+        session.close()
+
+@traced('db')
 def get_user_sources(chat_id):
     """Get all sources and their enabled status for a user"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
-            return {source.source_domain: source.is_enabled for source in user.sources}
+            return {name: source.is_enabled for name, source in _named(user.sources, 'source_id', _source_names)}
         return {}
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_enabled_sources_for_user(chat_id):
     """Get only enabled sources for a user"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
-            return [source.source_domain for source in user.sources if source.is_enabled]
+            return [name for name, source in _named(user.sources, 'source_id', _source_names) if source.is_enabled]
         return []
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_user_preferences(chat_id):
     """Get complete user preferences (queries, sources, and topics)"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
             return {
                 'queries': [],
-                'sources': {source.source_domain: source.is_enabled for source in user.sources},
-                'topics': {topic.topic_name: topic.is_enabled for topic in user.topics}
+                'sources': {name: source.is_enabled for name, source in _named(user.sources, 'source_id', _source_names)},
+                'topics': {name: topic.is_enabled for name, topic in _named(user.topics, 'topic_id', _topic_names)}
             }
         return {'queries': [], 'sources': {}, 'topics': {}}
     finally:
-        session.close()
+        _close(session)
 
 # New functions for topic management
+@traced('db')
 def toggle_user_topic(chat_id, topic_name):
     """Toggle a topic on/off for a user"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
-        if user:
-            user_topic = session.query(UserTopic).filter_by(
-                user_id=user.id,
-                topic_name=topic_name
-            ).first()
+        user = _find_user(session, chat_id)
+        topic_id = _topic_ids.get(topic_name)
+        if user and topic_id:
+            user_topic = next((t for t in user.topics if t.topic_id == topic_id), None)
             
             if user_topic:
                 user_topic.is_enabled = not user_topic.is_enabled
-                session.commit()
+                _commit(session)
                 return user_topic.is_enabled
             else:
                 # Create new topic entry if it doesn't exist
-                from src.categories import get_topic_category
-                category = get_topic_category(topic_name)
-                if category:
-                    user_topic = UserTopic(
-                        user_id=user.id,
-                        topic_name=topic_name,
-                        category=category,
-                        is_enabled=True
-                    )
-                    session.add(user_topic)
-                    session.commit()
-                    return True
+                user_topic = UserTopic(
+                    topic_id=topic_id,
+                    is_enabled=True
+                )
+                user.topics.append(user_topic)
+                _commit(session)
+                return True
         return None
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
+
+@traced('db')
+def toggle_user_source(chat_id, source_domain):
+    """Toggle a source on/off for a user"""
+    session = _open_session()
+    try:
+        user = _find_user(session, chat_id)
+        source_id = _source_ids.get(source_domain)
+        if user and source_id:
+            user_source = next((s for s in user.sources if s.source_id == source_id), None)
 
+            if user_source:
+                user_source.is_enabled = not user_source.is_enabled
+                _commit(session)
+                return user_source.is_enabled
+            else:
+                # Create new source entry if it doesn't exist
+                user_source = UserSource(
+                    source_id=source_id,
+                    is_enabled=True
+                )
+                user.sources.append(user_source)
+                _commit(session)
+                return True
+        return None
+    except Exception as e:
+        _rollback(session)
+        raise e
+    finally:
+        _close(session)
+
+@traced('db')
+def set_user_preferences(chat_id, topics=None, sources=None):
+    """Set several topics and sources on/off for a user in one transaction
+
+    ``topics`` maps topic names and ``sources`` maps domains to the wanted
+    enabled state. Missing rows are created.
+    """
+    session = _open_session()
+    topics = {_topic_ids[name]: enabled for name, enabled in (topics or {}).items() if name in _topic_ids}
+    sources = {_source_ids[domain]: enabled for domain, enabled in (sources or {}).items() if domain in _source_ids}
+    try:
+        user = _find_user(session, chat_id)
+        if not user:
+            return False
+        if topics:
+            for user_topic in user.topics:
+                if user_topic.topic_id in topics:
+                    user_topic.is_enabled = topics.pop(user_topic.topic_id)
+            for topic_id, enabled in topics.items():
+                user.topics.append(UserTopic(topic_id=topic_id, is_enabled=enabled))
+        if sources:
+            for user_source in user.sources:
+                if user_source.source_id in sources:
+                    user_source.is_enabled = sources.pop(user_source.source_id)
+            for source_id, enabled in sources.items():
+                user.sources.append(UserSource(source_id=source_id, is_enabled=enabled))
+        _commit(session)
+        return True
+    except Exception as e:
+        _rollback(session)
+        raise e
+    finally:
+        _close(session)
+
+@traced('db')
 def get_user_topics(chat_id):
     """Get all topics and their enabled status for a user"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
-            return {topic.topic_name: topic.is_enabled for topic in user.topics}
+            return {name: topic.is_enabled for name, topic in _named(user.topics, 'topic_id', _topic_names)}
         return {}
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_enabled_topics_for_user(chat_id):
     """Get only enabled topics for a user"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
-            return [topic.topic_name for topic in user.topics if topic.is_enabled]
+            return [name for name, topic in _named(user.topics, 'topic_id', _topic_names) if topic.is_enabled]
         return []
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def initialize_user_topics(chat_id):
     """Initialize all available topics for a user (disabled by default)"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
             all_topics = get_all_topics()
-            existing_topics = {topic.topic_name for topic in user.topics}
+            existing_topics = {topic.topic_id for topic in user.topics}
             
             for topic_name in all_topics:
-                if topic_name not in existing_topics:
-                    from src.categories import get_topic_category
-                    category = get_topic_category(topic_name)
-                    if category:
-                        user_topic = UserTopic(
-                            user_id=user.id,
-                            topic_name=topic_name,
-                            category=category,
-                            is_enabled=False  # Disabled by default
-                        )
-                        session.add(user_topic)
+                topic_id = _topic_ids.get(topic_name)
+                if topic_id and topic_id not in existing_topics:
+                    user_topic = UserTopic(
+                        topic_id=topic_id,
+                        is_enabled=False  # Disabled by default
+                    )
+                    user.topics.append(user_topic)
             
-            session.commit()
+            _commit(session)
             return True
         return False
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def initialize_user_sources(chat_id):
     """Initialize all available sources for a user (disabled by default)"""
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
             all_sources = get_all_sources()
-            existing_sources = {source.source_domain for source in user.sources}
+            existing_sources = {source.source_id for source in user.sources}
             
             for source_domain in all_sources:
-                if source_domain not in existing_sources:
+                source_id = _source_ids.get(source_domain)
+                if source_id and source_id not in existing_sources:
                     user_source = UserSource(
-                        user_id=user.id,
-                        source_domain=source_domain,
+                        source_id=source_id,
                         is_enabled=False  # Disabled by default
                     )
-                    session.add(user_source)
+                    user.sources.append(user_source)
             
-            session.commit()
+            _commit(session)
             return True
         return False
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def set_user_language(chat_id, language):
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user:
             user.language = language
-            session.commit()
+            _commit(session)
     except Exception as e:
-        session.rollback()
+        _rollback(session)
         raise e
     finally:
-        session.close()
+        _close(session)
 
+@traced('db')
 def get_user_language(chat_id):
-    session = get_session()
+    session = _open_session()
     try:
-        user = session.query(User).filter_by(chat_id=str(chat_id)).first()
+        user = _find_user(session, chat_id)
         if user and user.language:
             return user.language
         return 'en'
     finally:
-        session.close()
\ No newline at end of file
+        _close(session)
+
+@traced('db')
+def get_bot_state(key, default=None):
+    """Get a value from the persistent bot state store"""
+    session = get_session()
+    try:
+        state = session.query(BotState).filter_by(key=key).first()
+        return state.value if state else default
+    finally:
+        session.close()
+
+@traced('db')
+def set_bot_state(key, value):
+    """Set a value in the persistent bot state store"""
+    session = get_session()
+    try:
+        state = session.query(BotState).filter_by(key=key).first()
+        if state:
+            state.value = value
+        else:
+            session.add(BotState(key=key, value=value))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
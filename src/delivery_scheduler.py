@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import pytz
+
+from src.db_helper import get_bot_state, set_bot_state, count_users_by_activity
+from src.models import DELIVERY_SLOTS
+from src.metrics import CYCLE_BUCKET, CYCLE_BUCKETS, CYCLE_SENT
+
+logger = logging.getLogger(__name__)
+
+# Delivery cycles: 8 AM, 12 PM, 4 PM, 8 PM, 12 AM, 4 AM IRST
+DELIVERY_HOURS = [8, 12, 16, 20, 0, 4]
+DELIVERY_TIME_ZONE = 'Asia/Tehran'
+
+# Key in the bot_state table holding the last delivered bucket
+PROGRESS_KEY = 'delivery_progress'
+
+# Delivery tiers by days since last activity: active users get every cycle,
+# dormant users only the daily digest cycle, abandoned users nothing
+ACTIVE_DAYS = int(os.getenv('DELIVERY_ACTIVE_DAYS', 7))
+DORMANT_DAYS = int(os.getenv('DELIVERY_DORMANT_DAYS', 30))
+DIGEST_HOUR = int(os.getenv('DELIVERY_DIGEST_HOUR', 8))
+
+
+class DeliveryScheduler:
+    """
+    Spread each delivery cycle over a window of one-minute buckets
+
+    Every user has a fixed delivery slot (a hash of their chat_id), and the
+    slots are mapped onto the minutes of a window centred on each cycle hour.
+    A job ticks once a minute and delivers every bucket that is due. The last
+    delivered bucket is stored in bot_state, so after a restart the next tick
+    picks up where the previous process stopped. Buckets still undelivered
+    when the window closes (slow buckets, a restart near its end) are sent
+    after it, unless a newer cycle has begun by then; a bucket that fails is
+    retried on the next tick.
+
+    Only active users are included in regular cycles; the digest cycle also
+    includes dormant users. The tier cutoffs are taken from the cycle time,
+    so every bucket of a cycle uses the same ones.
+
+    With a QuotaManager, a digest cycle is downgraded to active users when
+    the NewsAPI budget is low, and buckets are deferred while scheduled work
+    has no budget left at all.
+
+    ``load`` and ``save`` read and write the progress as JSON text; they
+    default to the PROGRESS_KEY row of bot_state.
+    """
+
+    def __init__(self, job_queue, deliver, window_minutes=None, hours=None, time_zone=DELIVERY_TIME_ZONE, quota=None,
+                 load=None, save=None):
+        self.job_queue = job_queue
+        self.deliver = deliver
+        self.quota = quota
+        self.load = load or (lambda: get_bot_state(PROGRESS_KEY))
+        self.save = save or (lambda state: set_bot_state(PROGRESS_KEY, state))
+        self.window_minutes = window_minutes or int(os.getenv('DELIVERY_WINDOW_MINUTES', 60))
+        self.hours = hours or DELIVERY_HOURS
+        self.time_zone = pytz.timezone(time_zone)
+
+    def start(self):
+        """Register the minute tick with the job queue"""
+        now = datetime.now(self.time_zone)
+        first = 60 - now.second  # Align ticks to the start of each minute
+        CYCLE_BUCKETS.set(self.window_minutes)
+        self.job_queue.run_repeating(self.tick, interval=60, first=first, name="delivery_tick")
+
+    def current_bucket(self, now):
+        """Return (cycle_time, bucket) for the window containing ``now``, or None"""
+        before = timedelta(minutes=self.window_minutes // 2)
+        after = timedelta(minutes=self.window_minutes) - before
+        for day_offset in (-1, 0, 1):
+            day = (now + timedelta(days=day_offset)).date()
+            for hour in self.hours:
+                cycle = self.time_zone.localize(datetime(day.year, day.month, day.day, hour, 0))
+                if cycle - before <= now < cycle + after:
+                    bucket = int((now - (cycle - before)).total_seconds() // 60)
+                    return cycle, bucket
+        return None
+
+    def last_cycle(self, now):
+        """Return the latest cycle whose window has started by ``now``"""
+        before = timedelta(minutes=self.window_minutes // 2)
+        latest = None
+        for day_offset in (-1, 0, 1):
+            day = (now + timedelta(days=day_offset)).date()
+            for hour in self.hours:
+                cycle = self.time_zone.localize(datetime(day.year, day.month, day.day, hour, 0))
+                if cycle - before <= now and (latest is None or cycle > latest):
+                    latest = cycle
+        return latest
+
+    def slot_range(self, bucket):
+        """Return the [start, end) delivery slots that belong to a bucket"""
+        start = bucket * DELIVERY_SLOTS // self.window_minutes
+        end = (bucket + 1) * DELIVERY_SLOTS // self.window_minutes
+        return start, end
+
+    def tier_cutoffs(self, cycle):
+        """Return (active_since, dormant_since) as naive UTC, like users.last_activity"""
+        cycle_utc = cycle.astimezone(pytz.utc).replace(tzinfo=None)
+        return cycle_utc - timedelta(days=ACTIVE_DAYS), cycle_utc - timedelta(days=DORMANT_DAYS)
+
+    def active_since(self, cycle):
+        """Return the oldest last_activity that still gets this cycle"""
+        active_since, dormant_since = self.tier_cutoffs(cycle)
+        if cycle.hour == DIGEST_HOUR and not (self.quota and self.quota.is_low()):
+            return dormant_since
+        return active_since
+
+    def _stored_progress(self):
+        raw = self.load()
+        return json.loads(raw) if raw else None
+
+    def _load_progress(self, cycle):
+        """Return the stored progress for ``cycle``, or a fresh one"""
+        progress = self._stored_progress()
+        if progress and progress.get('cycle') == cycle.isoformat():
+            return progress
+        return {'cycle': cycle.isoformat(), 'bucket': -1, 'sent': 0}
+
+    def _save_progress(self, progress):
+        self.save(json.dumps(progress))
+
+    def report_tiers(self, cycle):
+        """Log how many users fall in each delivery tier for this cycle"""
+        tiers = count_users_by_activity(*self.tier_cutoffs(cycle))
+        digest = cycle.hour == DIGEST_HOUR
+        included = tiers['active'] + (tiers['dormant'] if digest else 0)
+        logger.info(
+            f"Cycle {cycle:%Y-%m-%d %H:%M}{' (digest)' if digest else ''}: "
+            f"{tiers['active']} active, {tiers['dormant']} dormant, {tiers['abandoned']} abandoned, "
+            f"{tiers['undeliverable']} undeliverable; "
+            f"delivering to {included}"
+        )
+        return tiers
+
+    async def tick(self, context=None):
+        """Deliver every bucket that is due and not yet sent"""
+        await self.run_due(datetime.now(self.time_zone))
+
+    async def run_due(self, now):
+        """Deliver the buckets due at ``now``, finishing the previous cycle first if it was cut short"""
+        current = self.current_bucket(now)
+        stored = self._stored_progress()
+        if stored and stored['bucket'] < self.window_minutes - 1 and (
+                current is None or stored['cycle'] != current[0].isoformat()):
+            cycle = datetime.fromisoformat(stored['cycle'])
+            if current is None and cycle == self.last_cycle(now):
+                # The window closed before every bucket was sent
+                await self._deliver_buckets(cycle, stored, self.window_minutes - 1)
+                return
+            logger.warning(
+                f"Cycle {cycle:%Y-%m-%d %H:%M} superseded, buckets {stored['bucket'] + 2}-{self.window_minutes} "
+                f"of {self.window_minutes} were not delivered"
+            )
+            stored['skipped'] = self.window_minutes - 1 - stored['bucket']
+            stored['bucket'] = self.window_minutes - 1
+            self._save_progress(stored)
+        if current is None:
+            return
+        cycle, bucket = current
+        await self._deliver_buckets(cycle, self._load_progress(cycle), bucket)
+
+    async def _deliver_buckets(self, cycle, progress, last):
+        """Deliver the buckets of ``cycle`` after the stored progress, up to ``last``"""
+        if progress['bucket'] < 0:
+            self.report_tiers(cycle)
+        active_since = self.active_since(cycle)
+        for pending in range(progress['bucket'] + 1, last + 1):
+            if self.quota and self.quota.scheduled_left() <= 0:
+                # Picked up by a later tick if budget frees up in time
+                logger.warning(f"NewsAPI budget for scheduled news used up, deferring bucket {pending + 1}/{self.window_minutes}")
+                return
+            slot_range = self.slot_range(pending)
+            logger.debug(f"Delivering cycle {cycle:%Y-%m-%d %H:%M} bucket {pending + 1}/{self.window_minutes} (slots {slot_range[0]}-{slot_range[1] - 1})")
+            try:
+                delivered = await self.deliver(slot_range, active_since)
+            except Exception:
+                logger.exception(f"Delivering bucket {pending + 1}/{self.window_minutes} failed, retrying on the next tick")
+                return
+            progress['sent'] += delivered or 0
+            progress['bucket'] = pending
+            self._save_progress(progress)
+            CYCLE_BUCKET.set(pending)
+            CYCLE_SENT.set(progress['sent'])
+            if pending == self.window_minutes - 1:
+                logger.info(f"Cycle {cycle:%Y-%m-%d %H:%M} finished: {progress['sent']} users delivered")
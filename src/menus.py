@@ -0,0 +1,170 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES
+from src.callbacks import (
+    LANGUAGES, callback_data, SET_LANGUAGE, TOPIC_CATEGORY, SOURCE_CATEGORY,
+    TOPIC_TOGGLE, SOURCE_TOGGLE, SHOW_TOPICS, SHOW_SOURCES, GET_NEWS
+)
+
+ENABLED_ICON = "✅"
+DISABLED_ICON = "❌"
+
+# Static menu texts per language
+TEXTS = {
+    'en': {
+        'topics': "📚 Choose a topic category to manage your news topics:\n\n",
+        'sources': "📰 Choose a source category to manage your news sources:\n\n",
+        'topic_category': "📚 {name}\n\nSelect topics to enable/disable:\n\n",
+        'source_category': "📰 {name}\n\nSelect sources to enable/disable:\n\n",
+        'topics_button': "📚 Topics",
+        'sources_button': "🔧 Sources",
+        'news_button': "📰 Get News",
+        'back_button': "⬅️ Back to Categories",
+    },
+    'fa': {
+        'topics': "📚 یک دسته‌بندی موضوعی را برای مدیریت موضوعات خبری انتخاب کنید:\n\n",
+        'sources': "📰 یک دسته‌بندی منبع را برای مدیریت منابع خبری انتخاب کنید:\n\n",
+        'topic_category': "📚 {name}\n\nموضوعات را برای فعال/غیرفعال کردن انتخاب کنید:\n\n",
+        'source_category': "📰 {name}\n\nمنابع را برای فعال/غیرفعال کردن انتخاب کنید:\n\n",
+        'topics_button': "📚 موضوعات",
+        'sources_button': "🔧 منابع",
+        'news_button': "📰 دریافت خبر",
+        'back_button': "⬅️ بازگشت به دسته‌ها",
+    },
+}
+
+
+class MenuRegistry:
+    """
+    Menus and keyboards built once at startup from the category catalogue
+
+    The category menus are fully static per language. Toggle keyboards keep
+    one enabled and one disabled button per topic or source, so a keyboard is
+    assembled from ready buttons, and a single toggle swaps only one button.
+    """
+
+    def __init__(self):
+        self.topic_menus = {}
+        self.source_menus = {}
+        self.topic_category_texts = {}
+        self.source_category_texts = {}
+        self.topic_nav_rows = {}
+        self.source_nav_rows = {}
+
+        # (disabled, enabled) buttons, indexed by topic name / source domain
+        self.topic_buttons = {
+            topic: self._toggle_buttons(topic, callback_data(TOPIC_TOGGLE, topic))
+            for cat_data in TOPIC_CATEGORIES.values() for topic in cat_data["topics"]
+        }
+        self.source_buttons = {
+            source: self._toggle_buttons(source, callback_data(SOURCE_TOGGLE, source))
+            for cat_data in SOURCE_CATEGORIES.values() for source in cat_data["sources"]
+        }
+
+        self.language_menu = InlineKeyboardMarkup([
+            [InlineKeyboardButton("English 🇬🇧", callback_data=callback_data(SET_LANGUAGE, 'en'))],
+            [InlineKeyboardButton("فارسی 🇮🇷", callback_data=callback_data(SET_LANGUAGE, 'fa'))]
+        ])
+
+        for lang in LANGUAGES:
+            texts = TEXTS[lang]
+            topics_button = InlineKeyboardButton(texts['topics_button'], callback_data=callback_data(SHOW_TOPICS))
+            sources_button = InlineKeyboardButton(texts['sources_button'], callback_data=callback_data(SHOW_SOURCES))
+            news_button = InlineKeyboardButton(texts['news_button'], callback_data=callback_data(GET_NEWS))
+
+            # First-level keyboards with categories
+            keyboard = [[InlineKeyboardButton(cat_data["name"], callback_data=callback_data(TOPIC_CATEGORY, cat_id))]
+                        for cat_id, cat_data in TOPIC_CATEGORIES.items()]
+            keyboard.append([sources_button, news_button])
+            self.topic_menus[lang] = (texts['topics'], InlineKeyboardMarkup(keyboard))
+
+            keyboard = [[InlineKeyboardButton(cat_data["name"], callback_data=callback_data(SOURCE_CATEGORY, cat_id))]
+                        for cat_id, cat_data in SOURCE_CATEGORIES.items()]
+            keyboard.append([InlineKeyboardButton(texts['topics_button'], callback_data=callback_data(SHOW_TOPICS)), news_button])
+            self.source_menus[lang] = (texts['sources'], InlineKeyboardMarkup(keyboard))
+
+            # Navigation rows under the second-level toggle keyboards
+            self.topic_nav_rows[lang] = [
+                InlineKeyboardButton(texts['back_button'], callback_data=callback_data(SHOW_TOPICS)), sources_button
+            ]
+            self.source_nav_rows[lang] = [
+                InlineKeyboardButton(texts['back_button'], callback_data=callback_data(SHOW_SOURCES)),
+                InlineKeyboardButton(texts['topics_button'], callback_data=callback_data(SHOW_TOPICS))
+            ]
+            for cat_id, cat_data in TOPIC_CATEGORIES.items():
+                self.topic_category_texts[lang, cat_id] = texts['topic_category'].format(name=cat_data["name"])
+            for cat_id, cat_data in SOURCE_CATEGORIES.items():
+                self.source_category_texts[lang, cat_id] = texts['source_category'].format(name=cat_data["name"])
+
+    @staticmethod
+    def _toggle_buttons(label, data):
+        return (
+            InlineKeyboardButton(f"{DISABLED_ICON} {label}", callback_data=data),
+            InlineKeyboardButton(f"{ENABLED_ICON} {label}", callback_data=data),
+        )
+
+    @staticmethod
+    def _lang(lang):
+        return lang if lang in LANGUAGES else 'en'
+
+    def topics_menu(self, lang):
+        """Return (text, reply_markup) of the topic category menu"""
+        return self.topic_menus[self._lang(lang)]
+
+    def sources_menu(self, lang):
+        """Return (text, reply_markup) of the source category menu"""
+        return self.source_menus[self._lang(lang)]
+
+    def topic_category(self, lang, category_id, user_topics):
+        """Return (text, reply_markup) with topic toggles of a category, or None"""
+        cat_data = TOPIC_CATEGORIES.get(category_id)
+        if not cat_data:
+            return None
+        lang = self._lang(lang)
+        keyboard = [[self.topic_buttons[topic][bool(user_topics.get(topic, False))]] for topic in cat_data["topics"]]
+        keyboard.append(self.topic_nav_rows[lang])
+        return self.topic_category_texts[lang, category_id], InlineKeyboardMarkup(keyboard)
+
+    def source_category(self, lang, category_id, user_sources):
+        """Return (text, reply_markup) with source toggles of a category, or None"""
+        cat_data = SOURCE_CATEGORIES.get(category_id)
+        if not cat_data:
+            return None
+        lang = self._lang(lang)
+        keyboard = [[self.source_buttons[source][bool(user_sources.get(source, False))]] for source in cat_data["sources"]]
+        keyboard.append(self.source_nav_rows[lang])
+        return self.source_category_texts[lang, category_id], InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def shows_enabled(reply_markup, tapped_data, buttons):
+        """Return True if the tapped toggle button is displayed as enabled"""
+        if reply_markup:
+            for row in reply_markup.inline_keyboard:
+                for button in row:
+                    if button.callback_data in (tapped_data, buttons[1].callback_data):
+                        return button.text == buttons[1].text
+        return False
+
+    @staticmethod
+    def flip(reply_markup, tapped_data, buttons, is_enabled):
+        """
+        Return ``reply_markup`` with the tapped toggle button set to ``is_enabled``
+
+        ``tapped_data`` is the callback data of the tapped button and
+        ``buttons`` the (disabled, enabled) pair of the toggled item. Every
+        other button is reused as is. Returns None when the button is not in
+        the markup, and the markup itself when it already shows that state.
+        """
+        if not reply_markup:
+            return None
+        new_button = buttons[bool(is_enabled)]
+        matches = (tapped_data, new_button.callback_data)
+        keyboard = []
+        found = False
+        for row in reply_markup.inline_keyboard:
+            if not found and any(button.callback_data in matches for button in row):
+                found = True
+                if any(button == new_button for button in row):
+                    return reply_markup
+                row = [new_button if button.callback_data in matches else button for button in row]
+            keyboard.append(row)
+        return InlineKeyboardMarkup(keyboard) if found else None
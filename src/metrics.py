@@ -0,0 +1,294 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Port of the Prometheus endpoint started by main.py; empty or 0 to turn it off
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+
+# Histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base for metrics with an optional fixed set of label names"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+
+
+class Counter(Metric):
+    """Monotonic count per label values, or read from ``func`` when scraped"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), func=None):
+        super().__init__(name, help, labels)
+        self.func = func
+        # Unlabelled metrics are exported from the start, as 0
+        self._values = {} if self.label_names else {(): 0}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        if self.func is not None:
+            values = sorted(self.func().items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return "".join(f"{self.name}{_labels(self.label_names, labels)} {value}\n" for labels, value in values)
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        """Context manager observing the seconds spent in its block"""
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def render(self):
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, (('le', bound),))} {cumulative}\n")
+            label_text = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {values[-2]}\n")
+            lines.append(f"{self.name}_count{label_text} {values[-1]}\n")
+        return "".join(lines)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), func=None):
+        return self.register(Counter(name, help, labels, func))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        parts = []
+        for metric in list(self._metrics.values()):
+            try:
+                body = metric.render()
+            except Exception:
+                logger.exception(f"Error collecting metric {metric.name}")
+                continue
+            parts.append(metric.header() + body)
+        return "".join(parts)
+
+
+REGISTRY = Registry()
+
+# Telegram updates, by command or callback action
+HANDLER_SECONDS = REGISTRY.histogram(
+    'newsbot_handler_seconds', "Time to handle an update, from opening to committing its unit of work", ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('newsbot_handler_errors_total', "Updates whose handlers raised", ('handler',))
+
+# NewsAPI calls; status is the HTTP status, or "error" when there was no response
+NEWSAPI_SECONDS = REGISTRY.histogram('newsbot_newsapi_request_seconds', "NewsAPI request latency", ('status',))
+NEWSAPI_STALE = REGISTRY.counter('newsbot_newsapi_stale_results_total', "Fetches answered from the stale cache because NewsAPI could not be used")
+
+# Database statements, by kind of statement
+DB_SECONDS = REGISTRY.histogram('newsbot_db_query_seconds', "Database statement latency", ('operation',), DB_BUCKETS)
+
+# Scheduled delivery
+DELIVERIES = REGISTRY.counter('newsbot_scheduled_deliveries_total', "Users processed by scheduled delivery", ('result',))
+CYCLE_BUCKET = REGISTRY.gauge('newsbot_cycle_bucket', "Last delivered bucket of the current delivery cycle")
+CYCLE_BUCKETS = REGISTRY.gauge('newsbot_cycle_buckets', "Buckets in a delivery cycle")
+CYCLE_SENT = REGISTRY.gauge('newsbot_cycle_users_sent', "Users delivered so far in the current delivery cycle")
+
+
+# Caches report their hit and miss counts, read when scraped
+_caches = {}
+
+
+def register_cache(name, func):
+    """Report a cache's lookups; ``func()`` returns (hits, misses)"""
+    _caches[name] = func
+
+
+def _cache_lookups():
+    values = {}
+    for name, func in list(_caches.items()):
+        hits, misses = func()
+        values[name, 'hit'] = hits
+        values[name, 'miss'] = misses
+    return values
+
+
+CACHE_LOOKUPS = REGISTRY.counter('newsbot_cache_lookups_total', "Cache lookups by result", ('cache', 'result'), _cache_lookups)
+
+
+def instrument_engine(engine):
+    """
+    Time every statement run on ``engine`` into DB_SECONDS
+
+    Only done when the endpoint is enabled: SQLAlchemy's event dispatch
+    alone adds some 10-20µs to each statement.
+    """
+    if not METRICS_PORT:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.lstrip()[:6].upper()
+        if operation not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            operation = 'OTHER'
+        DB_SECONDS.observe(time.perf_counter() - context._metrics_started, operation)
+
+
+# Pages served next to /metrics: path -> func(method, params) returning text
+_pages = {}
+
+
+def register_page(path, func):
+    """Serve ``func(method, params)`` at ``path`` on GET and POST, e.g. a debug report"""
+    _pages[path] = func
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path in _pages:
+            self._page(path)
+            return
+        if path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        self._reply(self.registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path not in _pages:
+            self.send_error(404)
+            return
+        self._page(path)
+
+    def _page(self, path):
+        try:
+            body = _pages[path](self.command, dict(parse_qsl(urlsplit(self.path).query)))
+        except Exception:
+            logger.exception(f"Error serving {path}")
+            self.send_error(500)
+            return
+        self._reply(body, 'text/plain; charset=utf-8')
+
+    def _reply(self, text, content_type):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT, addr=METRICS_ADDR, registry=REGISTRY):
+    """Serve ``registry`` on http://addr:port/metrics from a daemon thread; returns the server"""
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
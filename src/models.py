@@ -1,11 +1,19 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, UniqueConstraint
+from sqlalchemy import create_engine, func, Column, Integer, SmallInteger, String, Boolean, ForeignKey, DateTime, Text, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import zlib
 
 Base = declarative_base()
 
+# Users are spread over this many delivery slots by a stable hash of chat_id
+DELIVERY_SLOTS = 10000
+
+def delivery_slot_for(chat_id):
+    """Get the delivery slot for a chat; the same chat always maps to the same slot"""
+    return zlib.crc32(str(chat_id).encode()) % DELIVERY_SLOTS
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -15,43 +23,72 @@ class User(Base):
     first_name = Column(String(100), nullable=True)
     last_name = Column(String(100), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_activity = Column(DateTime, default=datetime.utcnow)
+    last_activity = Column(DateTime, default=datetime.utcnow, index=True)
     language = Column(String(10), default='en')  # 'en' for English, 'fa' for Farsi
+    delivery_slot = Column(SmallInteger, nullable=False)  # see delivery_slot_for()
+    is_deliverable = Column(Boolean, default=True, nullable=False)  # False once the chat blocked or deleted the bot
     
     # Relationships
     sources = relationship("UserSource", back_populates="user", cascade="all, delete-orphan")
     topics = relationship("UserTopic", back_populates="user", cascade="all, delete-orphan")
 
+    __table_args__ = (Index('ix_users_delivery', 'is_deliverable', 'delivery_slot', 'id'),)
+
+class Topic(Base):
+    __tablename__ = 'topics'
+
+    # Dimension table seeded from TOPIC_CATEGORIES; ids are small and stable
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    name = Column(String(100), unique=True, nullable=False)  # e.g., 'AI', 'Technology', 'Politics'
+    category = Column(String(50), nullable=False)  # e.g., 'tech', 'sci', 'pol'
+
+class Source(Base):
+    __tablename__ = 'sources'
+
+    # Dimension table seeded from SOURCE_CATEGORIES; ids are small and stable
+    id = Column(SmallInteger, primary_key=True, autoincrement=False)
+    domain = Column(String(100), unique=True, nullable=False)  # e.g., 'cnn.com', 'bbc.com'
+    category = Column(String(50), nullable=False)  # e.g., 'gen', 'tech'
+
 class UserSource(Base):
     __tablename__ = 'user_sources'
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    source_domain = Column(String(100), nullable=False)  # e.g., 'cnn.com', 'bbc.com'
+    source_id = Column(SmallInteger, ForeignKey('sources.id'), nullable=False)
     is_enabled = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship
     user = relationship("User", back_populates="sources")
+    source = relationship("Source")
     
     # Ensure unique combination of user and source
-    __table_args__ = (UniqueConstraint('user_id', 'source_domain', name='uq_user_source'),)
+    __table_args__ = (UniqueConstraint('user_id', 'source_id', name='uq_user_source'),)
 
 class UserTopic(Base):
     __tablename__ = 'user_topics'
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    topic_name = Column(String(100), nullable=False)  # e.g., 'AI', 'Technology', 'Politics'
-    category = Column(String(50), nullable=False)  # e.g., 'tech', 'sci', 'pol'
+    topic_id = Column(SmallInteger, ForeignKey('topics.id'), nullable=False)
     is_enabled = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationship
     user = relationship("User", back_populates="topics")
+    topic = relationship("Topic")
     
     # Ensure unique combination of user and topic
-    __table_args__ = (UniqueConstraint('user_id', 'topic_name', name='uq_user_topic'),)
+    __table_args__ = (UniqueConstraint('user_id', 'topic_id', name='uq_user_topic'),)
+
+class BotState(Base):
+    __tablename__ = 'bot_state'
+
+    # Small key/value store for state that must survive restarts
+    key = Column(String(100), primary_key=True)
+    value = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Database setup
 def create_database():
@@ -60,8 +97,40 @@ def create_database():
         raise ValueError("DATABASE_URL is not set in environment variables.")
     engine = create_engine(database_url)
     Base.metadata.create_all(engine)
+    seed_catalogue(engine)
     return engine
 
+def seed_catalogue(engine):
+    """Insert any topics and sources from the category catalogue that are missing"""
+    from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        existing_topics = {name for (name,) in session.query(Topic.name)}
+        next_id = (session.query(func.max(Topic.id)).scalar() or 0) + 1
+        for cat_id, cat_data in TOPIC_CATEGORIES.items():
+            for topic_name in cat_data["topics"]:
+                if topic_name not in existing_topics:
+                    session.add(Topic(id=next_id, name=topic_name, category=cat_id))
+                    existing_topics.add(topic_name)
+                    next_id += 1
+
+        existing_sources = {domain for (domain,) in session.query(Source.domain)}
+        next_id = (session.query(func.max(Source.id)).scalar() or 0) + 1
+        for cat_id, cat_data in SOURCE_CATEGORIES.items():
+            for source_domain in cat_data["sources"]:
+                if source_domain not in existing_sources:
+                    session.add(Source(id=next_id, domain=source_domain, category=cat_id))
+                    existing_sources.add(source_domain)
+                    next_id += 1
+
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+
 def get_session():
     database_url = os.getenv('DATABASE_URL')
     if not database_url:
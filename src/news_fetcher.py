@@ -1,63 +1,331 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
+import asyncio
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
 import requests
 
+from src.rate_limit import INTERACTIVE
+from src.circuit_breaker import CircuitBreaker
+from src.article import Article
+from src.metrics import NEWSAPI_SECONDS, NEWSAPI_STALE, register_cache
+from src import tracing
+
+logger = logging.getLogger(__name__)
+
+# NewsAPI error codes meaning the key has no requests left
+QUOTA_ERRORS = ("rateLimited", "apiKeyExhausted")
+
+# NewsAPI endpoint; point it at a local server (see benchmarks/fake_newsapi.py) for load tests
+NEWS_API_BASE_URL = os.getenv('NEWS_API_BASE_URL', 'https://newsapi.org/v2/')
+
+# Seconds to wait for NewsAPI before counting the call as failed
+NEWS_API_TIMEOUT = float(os.getenv('NEWS_API_TIMEOUT', 10))
+
+# Last good result per query, served while NewsAPI is unavailable
+STALE_CACHE_SIZE = 1000
+
+# NewsAPI limits: q is at most 500 characters; long domain lists are split too
+MAX_QUERY_LENGTH = 500
+MAX_DOMAINS_PER_REQUEST = 20
+
+# Pages fetched by any NewsFetcher are reused for this many seconds
+NEWS_PAGE_CACHE_SECONDS = float(os.getenv('NEWS_PAGE_CACHE_SECONDS', 300))
+PAGE_CACHE_SIZE = 2000
+
+# Pages a stream asks for at most (NewsAPI developer plan: 100 results)
+STREAM_MAX_PAGES = 5
+
+# Shards of one oversized fetch run in parallel on this pool; stream_news
+# runs them through its ``run`` instead, e.g. the bot's upstream gate
+_shard_pool = ThreadPoolExecutor(max_workers=int(os.getenv('NEWS_API_SHARD_WORKERS', 8)), thread_name_prefix="newsapi-shard")
+
+
+class NewsResult(list):
+    """
+    Articles from a fetch; ``stale`` is True when they come from the fallback
+    cache because NewsAPI could not be reached, ``more`` when NewsAPI has
+    further pages for the same request
+    """
+
+    def __init__(self, articles=(), stale=False, more=False):
+        super().__init__(articles)
+        self.stale = stale
+        self.more = more
+
+
+class PageCache:
+    """Thread-safe LRU of fetched pages that expire after ``ttl`` seconds"""
+
+    def __init__(self, ttl=NEWS_PAGE_CACHE_SECONDS, size=PAGE_CACHE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.size = size
+        self.clock = clock
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                del self._pages[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._pages[key] = (self.clock(), result)
+            self._pages.move_to_end(key)
+            if len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+
+# Shared by all fetchers, so users with the same preferences share pages
+page_cache = PageCache()
+register_cache('newsapi_page', lambda: (page_cache.hits, page_cache.misses))
+
+
+def pack_terms(terms, separator, max_length):
+    """Group terms into as few ``separator``-joined strings of at most ``max_length`` as order allows"""
+    shards = []
+    current = ""
+    for term in terms:
+        candidate = f"{current}{separator}{term}" if current else term
+        if current and len(candidate) > max_length:
+            shards.append(current)
+            current = term
+        else:
+            current = candidate
+    if current:
+        shards.append(current)
+    return shards
+
+
+def query_terms(query):
+    """Lowercased terms of an OR query built by pack_terms, without quotes"""
+    terms = (term.strip().strip('"()').strip().lower() for term in (query or "").split(" OR "))
+    return [term for term in terms if term]
+
+
+def merge_results(results, limit=None):
+    """
+    Merge ranked article lists from several shards into one
+
+    Each shard is ranked by relevancy on its own, so positions are turned
+    into a score in (0, 1] per shard: the top article of every shard scores
+    1. Duplicates (same URL) keep their best score. Ties go to the newer
+    article. The result is stale if any shard was, and has more pages if
+    any shard has. With ``limit`` None nothing is cut.
+    """
+    best = {}
+    for articles in results:
+        count = len(articles)
+        for rank, article in enumerate(articles):
+            score = 1 - rank / count
+            key = article.id
+            if key not in best or score > best[key][0]:
+                best[key] = (score, article)
+    ranked = sorted(best.values(), key=lambda item: (item[0], item[1].published_at or ""), reverse=True)
+    stale = any(getattr(articles, "stale", False) for articles in results)
+    more = any(getattr(articles, "more", False) for articles in results)
+    return NewsResult([article for _, article in ranked[:limit]], stale=stale, more=more)
+
 
 class NewsFetcher:
 
-    def __init__(self, api_key, language="en", page_size=10):
+    def __init__(self, api_key, language="en", page_size=10, quota=None, base_url=NEWS_API_BASE_URL):
         """
         Initialize NewsFetcher with API key and default settings
+
+        With a QuotaManager, each request takes its key from the quota's
+        key pool instead of using ``api_key``.
         """
         self.api_key = api_key
+        self.quota = quota
         self.language = language
         self.page_size = page_size
-        self.url = "https://newsapi.org/v2/everything"
+        self.url = base_url.rstrip("/") + "/everything"
+        self.timeout = NEWS_API_TIMEOUT
+        self.breaker = CircuitBreaker("newsapi")
+        self._stale = OrderedDict()
+        self._stale_lock = threading.Lock()
+
+    def _get_articles(self, params, priority=INTERACTIVE):
+        """
+        Request articles, moving on to the next key when one runs out of quota
+
+        While the circuit breaker is open, or when the call fails, the last
+        good result for the same query is returned as a stale NewsResult.
+        """
+        page_key = tuple(sorted((name, value) for name, value in params.items() if name != "apiKey"))
+        cached = page_cache.get(page_key)
+        if cached is not None:
+            return cached
+        cache_key = (params.get("q"), params.get("domains"), params.get("language"), params.get("page", 1))
+        if not self.breaker.allow():
+            return self._stale_result(cache_key)
+        # A call that ends without recording an outcome, even by raising,
+        # must not leave the breaker waiting on its probe
+        try:
+            attempts = len(self.quota.api_keys) if self.quota else 1
+            for _ in range(attempts):
+                api_key = self.quota.acquire(priority) if self.quota else self.api_key
+                if api_key is None:
+                    logger.warning("NewsAPI quota exhausted, skipping request")
+                    return self._stale_result(cache_key)
+                params["apiKey"] = api_key
+                try:
+                    status = "error"
+                    started = time.perf_counter()
+                    with tracing.span("everything", "newsapi", page=params.get("page", 1)) as span:
+                        try:
+                            response = requests.get(self.url, params=params, timeout=self.timeout)
+                            status = str(response.status_code)
+                        finally:
+                            NEWSAPI_SECONDS.observe(time.perf_counter() - started, status)
+                            span.set(status=status)
+                    if response.status_code >= 500:
+                        response.raise_for_status()
+                    # NewsAPI answered, so it is up even if the request is refused
+                    self.breaker.record_success()
+                    if self.quota and response.status_code in (401, 429) and self._error_code(response) in QUOTA_ERRORS:
+                        self.quota.exhausted(api_key)
+                        continue
+                    response.raise_for_status()
+                    data = response.json()
+                    articles = [Article.from_api(article) for article in data.get("articles", [])]
+                    self._remember(cache_key, articles)
+                    page_size = params.get("pageSize", self.page_size)
+                    more = len(articles) >= page_size and params.get("page", 1) * page_size < data.get("totalResults", 0)
+                    result = NewsResult(articles, more=more)
+                    page_cache.put(page_key, result)
+                    return result
+                except requests.RequestException as e:
+                    if e.response is None or e.response.status_code >= 500:
+                        self.breaker.record_failure()
+                    print(f"Error fetching news: {e}")
+                    return self._stale_result(cache_key)
+            return self._stale_result(cache_key)
+        finally:
+            self.breaker.release()
+
+    def _remember(self, cache_key, articles):
+        if not articles:
+            return
+        with self._stale_lock:
+            self._stale[cache_key] = articles
+            self._stale.move_to_end(cache_key)
+            if len(self._stale) > STALE_CACHE_SIZE:
+                self._stale.popitem(last=False)
+
+    def _stale_result(self, cache_key):
+        """
+        Last good articles for the request, else the newest cached articles
+        in its language that mention one of its query terms and come from
+        one of its domains (any domain when it names none)
+        """
+        NEWSAPI_STALE.inc()
+        with self._stale_lock:
+            articles = self._stale.get(cache_key)
+            if articles is None:
+                query, domain_list, language = cache_key[:3]
+                terms = query_terms(query)
+                # Whole words, so "AI" does not match "said"
+                mentions = re.compile(r"\b(?:%s)\b" % "|".join(map(re.escape, terms))).search if terms else None
+                domains = set(filter(None, (domain_list or "").split(",")))
+                seen = set()
+                articles = []
+                for (_, _, cached_language, _), cached in reversed(self._stale.items()):
+                    if mentions is None or cached_language != language:
+                        continue
+                    for article in cached:
+                        url = article.url
+                        if url in seen or (domains and not any(domain in url for domain in domains)):
+                            continue
+                        if not mentions(f"{article.title} {article.description}".lower()):
+                            continue
+                        seen.add(url)
+                        articles.append(article)
+                articles.sort(key=lambda article: article.published_at or "", reverse=True)
+        return NewsResult(articles, stale=True)
 
-    def fetch_news_for_user(self, user_queries, enabled_sources):
+    def _shards(self, params, terms, domains):
+        """
+        Split a request for ``terms`` (joined with OR) from ``domains`` into
+        shard params that fit NewsAPI's limits
+        """
+        query_shards = pack_terms(terms, " OR ", MAX_QUERY_LENGTH)
+        domain_shards = [",".join(domains[i:i + MAX_DOMAINS_PER_REQUEST])
+                         for i in range(0, len(domains), MAX_DOMAINS_PER_REQUEST)] or [""]
+        shards = []
+        for query in query_shards:
+            for domain_list in domain_shards:
+                shard = dict(params, q=query)
+                if domain_list:
+                    shard["domains"] = domain_list
+                shards.append(shard)
+        return shards
+
+    def _fetch_sharded(self, params, terms, domains, priority=INTERACTIVE, limit=True):
+        """
+        Fetch ``terms`` (joined with OR) from ``domains``, splitting both into
+        shards that fit NewsAPI's limits. Shards run concurrently and their
+        results are merged into one ranked list of ``page_size`` articles
+        (of all of them with ``limit`` False).
+        """
+        shards = self._shards(params, terms, domains)
+        if len(shards) == 1:
+            return self._get_articles(shards[0], priority)
+        # Each shard runs in a copy of the caller's context, so it is traced with it
+        futures = [_shard_pool.submit(contextvars.copy_context().run, self._get_articles, shard, priority) for shard in shards]
+        return merge_results([future.result() for future in futures], self.page_size if limit else None)
+
+    @staticmethod
+    def _error_code(response):
+        try:
+            return response.json().get("code")
+        except ValueError:
+            return None
+
+    def fetch_news_for_user(self, user_queries, enabled_sources, priority=INTERACTIVE):
         """
         Fetch news for a specific user based on their queries and enabled sources
         """
         if not user_queries or not enabled_sources:
             return []
         
-        # Combine all user queries with OR operator
-        combined_query = " OR ".join(user_queries)
-        
-        # Combine enabled sources with comma separator
-        domains = ",".join(enabled_sources)
-        
         # Date range: from 2 days ago to today
         two_days_ago = (datetime.now() - timedelta(days=2)).strftime("%Y-%m-%d")
         today = datetime.now().strftime("%Y-%m-%d")
         
         params = {
-            "q": combined_query,
             "language": self.language,
             "sortBy": "relevancy",
             "from": two_days_ago,
             "to": today,
             "pageSize": self.page_size,
-            "domains": domains,
-            "apiKey": self.api_key,
         }
 
-        try:
-            response = requests.get(self.url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("articles", [])
-        except requests.RequestException as e:
-            print(f"Error fetching news: {e}")
-            return []
+        # User queries are combined with OR, split over several requests if too long
+        return self._fetch_sharded(params, list(user_queries), list(enabled_sources), priority)
 
-    def fetch_news_by_topics_and_sources(self, enabled_topics, enabled_sources, user_queries=None):
+    def _topic_request(self, enabled_topics, enabled_sources, user_queries=None):
         """
-        Fetch news for a user based on their enabled topics and sources
+        Build (params, terms, domains) for a topics and sources request
         """
-        if not enabled_topics and not enabled_sources:
-            return []
-        
         # Build query from enabled topics
         topic_queries = []
         for topic in enabled_topics:
@@ -71,38 +339,74 @@ class NewsFetcher:
         if user_queries:
             topic_queries.extend(user_queries)
         
-        # Combine all queries with OR operator
-        combined_query = " OR ".join(topic_queries) if topic_queries else "technology"
-        
-        # Combine enabled sources with comma separator
-        domains = ",".join(enabled_sources) if enabled_sources else ""
-        
         # Date range: from 2 days ago to today
         two_days_ago = (datetime.now() - timedelta(days=2)).strftime("%Y-%m-%d")
         today = datetime.now().strftime("%Y-%m-%d")
         
         params = {
-            "q": combined_query,
             "language": self.language,
             "sortBy": "relevancy",
             "from": two_days_ago,
             "to": today,
             "pageSize": self.page_size,
-            "apiKey": self.api_key,
         }
         
-        # Add domains parameter only if sources are specified
-        if domains:
-            params["domains"] = domains
+        # Queries are combined with OR and sources with commas; both are
+        # split over several requests when they exceed NewsAPI's limits
+        return params, topic_queries or ["technology"], list(enabled_sources or [])
 
-        try:
-            response = requests.get(self.url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("articles", [])
-        except requests.RequestException as e:
-            print(f"Error fetching news: {e}")
+    def fetch_news_by_topics_and_sources(self, enabled_topics, enabled_sources, user_queries=None, priority=INTERACTIVE):
+        """
+        Fetch news for a user based on their enabled topics and sources
+        """
+        if not enabled_topics and not enabled_sources:
             return []
+        
+        params, terms, domains = self._topic_request(enabled_topics, enabled_sources, user_queries)
+        return self._fetch_sharded(params, terms, domains, priority)
+
+    def fetch_page(self, enabled_topics, enabled_sources, page=1, priority=INTERACTIVE):
+        """
+        Fetch one page of news for topics and sources; ``more`` on the result
+        tells whether a next page exists
+        """
+        if not enabled_topics and not enabled_sources:
+            return NewsResult()
+        
+        params, terms, domains = self._topic_request(enabled_topics, enabled_sources)
+        params["page"] = page
+        return self._fetch_sharded(params, terms, domains, priority, limit=False)
+
+    async def stream_news(self, enabled_topics, enabled_sources, priority=INTERACTIVE, max_pages=STREAM_MAX_PAGES, run=None):
+        """
+        Yield pages of articles (NewsResult) one at a time
+
+        The next page is only requested when the consumer asks for it, so
+        stopping early costs no further requests. Each NewsAPI request of a
+        page (one per shard) is made with ``await run(func, *args, **kwargs)``,
+        by default in a worker thread; pass a PriorityGate's ``run`` to bound
+        the requests in flight. A stale page ends the stream.
+        """
+        if run is None:
+            run = asyncio.to_thread
+        for page in range(1, max_pages + 1):
+            with tracing.span("fetch_page", "newsapi", page=page) as span:
+                result = await self._fetch_page_with(run, enabled_topics, enabled_sources, page, priority)
+                span.set(articles=len(result), stale=result.stale)
+            yield result
+            if result.stale or not result.more:
+                return
+
+    async def _fetch_page_with(self, run, enabled_topics, enabled_sources, page, priority):
+        """fetch_page(), with the shards run concurrently through ``run`` instead of the shard pool"""
+        if not enabled_topics and not enabled_sources:
+            return NewsResult()
+
+        params, terms, domains = self._topic_request(enabled_topics, enabled_sources)
+        params["page"] = page
+        shards = self._shards(params, terms, domains)
+        results = await asyncio.gather(*(run(self._get_articles, shard, priority) for shard in shards))
+        return results[0] if len(results) == 1 else merge_results(results)
 
     def fetch_news(self, query=None, sources=None):
         """
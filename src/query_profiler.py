@@ -0,0 +1,287 @@
+"""
+Statement profiler for N+1 queries and slow queries
+
+While enabled, every statement run on the bot's engine is counted against
+the update or delivery it belongs to. Statements of the same shape run
+over and over within one unit (typically lazy loads of User.topics or
+User.sources in a loop) are logged as N+1 candidates, and statements
+slower than QUERY_SLOW_MS are logged with the src/ call site that ran them.
+
+Switch it on with QUERY_PROFILER=true, at runtime with SIGUSR2, or with
+POST /queries?enabled=1 on the metrics server; GET /queries shows the report.
+Switching at runtime needs QUERY_PROFILER or METRICS_PORT set at startup.
+"""
+
+import contextvars
+import logging
+import os
+import re
+import signal
+import threading
+import time
+import traceback
+from collections import Counter, deque
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+# Profile from startup
+QUERY_PROFILER = os.getenv('QUERY_PROFILER', 'false').lower() in ('1', 'true', 'yes')
+# Statements at least this slow are logged with their call site
+QUERY_SLOW_MS = float(os.getenv('QUERY_SLOW_MS', 100))
+# Runs of one statement shape within a unit that make it an N+1 candidate
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', 5))
+
+# Slow queries kept for the report
+SLOW_QUERIES_KEPT = 50
+# Statement text shown in logs and the report
+STATEMENT_LENGTH = 300
+
+_SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Bind parameter lists, e.g. "IN (?, ?, ?)", whose length varies between runs
+PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+STATEMENTS_PER_UNIT = metrics.REGISTRY.histogram(
+    'newsbot_db_statements_per_unit', "Statements per update or delivery while the query profiler is on",
+    ('unit',), (1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+_unit = contextvars.ContextVar('query_unit', default=None)
+
+# Engines the listeners are attached to
+_engines = []
+# Checked by the listeners; switching only flips it
+_enabled = False
+_lock = threading.Lock()
+
+# name -> [units, statements, most statements in one unit]
+_units = {}
+# (unit name, shape) -> [units it repeated in, most runs in one unit, call site]
+_repeats = {}
+_slow = deque(maxlen=SLOW_QUERIES_KEPT)
+
+
+class Unit:
+    """Statements of one update or delivery"""
+
+    __slots__ = ('name', 'statements', 'seconds', 'shapes', 'sites', 'closed', '_token')
+
+    def __init__(self, name):
+        self.name = name
+        self.statements = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.sites = {}  # shape -> call site when it reached the repeat threshold
+        self.closed = False
+        self._token = None
+
+
+def shape(statement):
+    """Statement text with parameter lists collapsed, so runs with different values match"""
+    return PARAMETER_LIST.sub("(?)", WHITESPACE.sub(" ", statement).strip())
+
+
+def call_site(limit=3):
+    """Innermost src/ frames of the current stack, e.g. 'db_helper.py:312 get_user_topics'"""
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(_SRC) and not frame.filename.endswith(('query_profiler.py', 'metrics.py'))
+    ]
+    return " <- ".join(
+        f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}" for frame in reversed(frames[-limit:])
+    ) or "?"
+
+
+def _short(statement):
+    statement = WHITESPACE.sub(" ", statement).strip()
+    return statement if len(statement) <= STATEMENT_LENGTH else statement[:STATEMENT_LENGTH] + "…"
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if _enabled:
+        context._profiler_started = time.perf_counter()
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_profiler_started', None)
+    if started is None or not _enabled:
+        # Profiling was switched on or off while the statement ran
+        return
+    elapsed = time.perf_counter() - started
+    unit = _unit.get()
+    if unit is not None and not unit.closed:
+        unit.statements += 1
+        unit.seconds += elapsed
+        key = shape(statement)
+        unit.shapes[key] += 1
+        if unit.shapes[key] == QUERY_REPEAT_THRESHOLD:
+            unit.sites[key] = call_site()
+    if elapsed * 1000 >= QUERY_SLOW_MS:
+        site = call_site()
+        name = unit.name if unit is not None else None
+        _slow.append((time.time(), elapsed, name, _short(statement), site))
+        logger.warning(f"Slow query ({elapsed * 1000:.1f} ms, {name or 'no unit'}) at {site}: {_short(statement)}")
+
+
+def _switchable():
+    return QUERY_PROFILER or bool(metrics.METRICS_PORT)
+
+
+def install(engine):
+    """
+    Attach the profiler's listeners to ``engine``, once
+
+    They stay attached and only check a flag, so switching profiling from a
+    signal handler or the metrics server never touches SQLAlchemy's event
+    registry while it may be dispatching. Event dispatch slows every
+    statement down, so they are only attached with QUERY_PROFILER or
+    METRICS_PORT set; the metrics listeners are attached then anyway.
+    """
+    if not _switchable():
+        return
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", _before)
+    event.listen(engine, "after_cursor_execute", _after)
+    _engines.append(engine)
+    if QUERY_PROFILER:
+        enable()
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    if _enabled:
+        return
+    if not _switchable():
+        logger.warning("Query profiler unavailable: start with QUERY_PROFILER or METRICS_PORT set")
+        return
+    _enabled = True
+    logger.info("Query profiler on")
+
+
+def disable():
+    global _enabled
+    if not _enabled:
+        return
+    _enabled = False
+    logger.info("Query profiler off")
+
+
+def toggle(*_):
+    """Switch profiling on or off, e.g. from a signal handler"""
+    if _enabled:
+        disable()
+    else:
+        enable()
+
+
+def install_signal(signum=getattr(signal, 'SIGUSR2', None)):
+    """Toggle profiling on ``signum`` (SIGUSR2 by default); must be called from the main thread"""
+    if signum is not None:
+        signal.signal(signum, toggle)
+
+
+def begin(name):
+    """Start counting statements for an update or delivery; returns the unit, or None while off"""
+    if not _enabled:
+        return None
+    unit = Unit(name)
+    unit._token = _unit.set(unit)
+    return unit
+
+
+def current_unit():
+    """Return the unit statements are counted against, or None"""
+    unit = _unit.get()
+    return unit if unit is not None and not unit.closed else None
+
+
+def end(unit):
+    """Finish a unit started with begin(), logging its N+1 candidates"""
+    if unit is None or unit.closed:
+        return
+    unit.closed = True
+    try:
+        _unit.reset(unit._token)
+    except ValueError:
+        _unit.set(None)
+    STATEMENTS_PER_UNIT.observe(unit.statements, unit.name)
+    repeated = [(key, count) for key, count in unit.shapes.items() if count >= QUERY_REPEAT_THRESHOLD]
+    with _lock:
+        stats = _units.setdefault(unit.name, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += unit.statements
+        stats[2] = max(stats[2], unit.statements)
+        for key, count in repeated:
+            repeat = _repeats.setdefault((unit.name, key), [0, 0, unit.sites.get(key)])
+            repeat[0] += 1
+            repeat[1] = max(repeat[1], count)
+    for key, count in repeated:
+        logger.warning(f"Possible N+1 in {unit.name}: {count} runs of {_short(key)} at {unit.sites.get(key)}")
+
+
+class profile:
+    """Context manager counting the statements of its block as one unit"""
+
+    def __init__(self, name):
+        self.name = name
+        self.unit = None
+
+    def __enter__(self):
+        self.unit = begin(self.name)
+        return self.unit
+
+    def __exit__(self, *exc):
+        end(self.unit)
+        return False
+
+
+def reset():
+    """Forget the statistics collected so far"""
+    with _lock:
+        _units.clear()
+        _repeats.clear()
+        _slow.clear()
+
+
+def report():
+    """Text summary of statements per unit, N+1 candidates and recent slow queries"""
+    with _lock:
+        units = sorted(_units.items(), key=lambda item: -item[1][1])
+        repeats = sorted(_repeats.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        slow = list(_slow)
+    lines = [
+        f"Query profiler: {'on' if _enabled else 'off'} "
+        f"(slow >= {QUERY_SLOW_MS:g} ms, N+1 at >= {QUERY_REPEAT_THRESHOLD} runs per unit)",
+        "",
+        "Statements per unit:",
+        f"  {'unit':<20} {'units':>8} {'statements':>11} {'mean':>7} {'max':>6}",
+    ]
+    for name, (count, statements, most) in units:
+        lines.append(f"  {name:<20} {count:>8} {statements:>11} {statements / count:>7.1f} {most:>6}")
+    lines += ["", "N+1 candidates (units affected, most runs in one unit):"]
+    for (name, key), (count, most, site) in repeats:
+        lines.append(f"  {count:>6} {most:>5}x  {name}  at {site}\n      {_short(key)}")
+    lines += ["", "Slow queries (latest last):"]
+    for at, elapsed, name, statement, site in slow:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at))
+        lines.append(f"  {stamp} {elapsed * 1000:9.1f} ms  {name or '-'}  at {site}\n      {statement}")
+    return "\n".join(lines) + "\n"
+
+
+def _page(method, params):
+    """/queries on the metrics server; POST with enabled=0/1 switches profiling, reset=1 clears it"""
+    if method == 'POST':
+        if 'enabled' in params:
+            (enable if params['enabled'] in ('1', 'true', 'on') else disable)()
+        if params.get('reset') in ('1', 'true'):
+            reset()
+    return report()
+
+
+metrics.register_page('/queries', _page)
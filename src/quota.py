@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from src.rate_limit import INTERACTIVE
+
+logger = logging.getLogger(__name__)
+
+# Key in the bot_state table holding today's usage per API key
+QUOTA_KEY = 'news_api_quota'
+
+# Requests per key per day (NewsAPI developer plan: 100)
+NEWS_API_DAILY_LIMIT = int(os.getenv('NEWS_API_DAILY_LIMIT', 100))
+# Share of each key's daily limit that only interactive requests may use
+NEWS_API_INTERACTIVE_RESERVE = float(os.getenv('NEWS_API_INTERACTIVE_RESERVE', 0.2))
+# Below this share of the pool left for scheduled work, deliveries are downgraded
+NEWS_API_LOW_WATERMARK = float(os.getenv('NEWS_API_LOW_WATERMARK', 0.3))
+# Usage is written to bot_state at most this often
+QUOTA_SAVE_SECONDS = 30
+
+
+def load_api_keys(default=None):
+    """Return the NewsAPI key pool from API_KEYS (comma separated), or [default]"""
+    keys = [key.strip() for key in os.getenv('API_KEYS', '').split(',') if key.strip()]
+    if not keys and default:
+        keys = [default]
+    return keys
+
+
+def _key_id(api_key):
+    """Short fingerprint of a key, so keys themselves are never stored"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class QuotaManager:
+    """
+    Daily NewsAPI request budget across a pool of keys
+
+    Each call to ``acquire()`` picks the key with the most requests left
+    today. The last ``reserve`` share of every key is kept for interactive
+    requests, so scheduled deliveries cannot starve /news. A key NewsAPI
+    reports as rate limited is treated as used up until the day rolls over
+    (UTC, like NewsAPI). Usage is persisted in bot_state and survives
+    restarts.
+    """
+
+    def __init__(self, api_keys, daily_limit=NEWS_API_DAILY_LIMIT, reserve=NEWS_API_INTERACTIVE_RESERVE,
+                 low_watermark=NEWS_API_LOW_WATERMARK, load=None, save=None):
+        if not api_keys:
+            raise ValueError("At least one NewsAPI key is required.")
+        self.api_keys = list(api_keys)
+        self.daily_limit = daily_limit
+        self.reserved = int(daily_limit * reserve)
+        self.low_watermark = low_watermark
+        self.save = save
+        self._ids = {key: _key_id(key) for key in self.api_keys}
+        self._lock = threading.Lock()
+        self._day = self._today()
+        self._used = {}
+        self._saved_at = 0
+        if load:
+            self._restore(load())
+
+    @staticmethod
+    def _today():
+        return datetime.utcnow().date().isoformat()
+
+    def _restore(self, raw):
+        if not raw:
+            return
+        try:
+            state = json.loads(raw)
+        except ValueError:
+            logger.warning("Ignoring unreadable NewsAPI quota state")
+            return
+        if state.get('day') == self._day:
+            known = set(self._ids.values())
+            self._used = {key_id: used for key_id, used in state.get('used', {}).items() if key_id in known}
+
+    def _roll_over(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._used = {}
+
+    def _left(self, api_key):
+        return self.daily_limit - self._used.get(self._ids[api_key], 0)
+
+    def acquire(self, priority=INTERACTIVE):
+        """Take one request from the budget; returns the API key to use, or None if there is none left"""
+        with self._lock:
+            self._roll_over()
+            floor = 0 if priority == INTERACTIVE else self.reserved
+            api_key = max(self.api_keys, key=self._left)
+            if self._left(api_key) <= floor:
+                return None
+            key_id = self._ids[api_key]
+            self._used[key_id] = self._used.get(key_id, 0) + 1
+        self._persist()
+        return api_key
+
+    def exhausted(self, api_key):
+        """Mark a key as used up for today, e.g. after NewsAPI answered rateLimited"""
+        with self._lock:
+            self._roll_over()
+            self._used[self._ids[api_key]] = self.daily_limit
+        logger.warning(f"NewsAPI key {self._ids[api_key]} exhausted for {self._day}")
+        self._persist(force=True)
+
+    def scheduled_left(self):
+        """Requests left today for scheduled work, over the whole pool"""
+        with self._lock:
+            self._roll_over()
+            return sum(max(0, self._left(api_key) - self.reserved) for api_key in self.api_keys)
+
+    def is_low(self):
+        """True once scheduled work has less than the low watermark of its budget left"""
+        budget = (self.daily_limit - self.reserved) * len(self.api_keys)
+        return self.scheduled_left() < budget * self.low_watermark
+
+    def _persist(self, force=False):
+        if not self.save:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at < QUOTA_SAVE_SECONDS:
+            return
+        self._saved_at = now
+        with self._lock:
+            state = json.dumps({'day': self._day, 'used': dict(self._used)})
+        try:
+            self.save(state)
+        except Exception:
+            logger.exception("Error saving NewsAPI quota state")
+
+    def flush(self):
+        """Write the current usage now, e.g. on shutdown"""
+        self._persist(force=True)
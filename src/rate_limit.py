@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# On-demand news requests per chat: burst size and refill rate
+NEWS_RATE_BURST = int(os.getenv('NEWS_RATE_BURST', 3))
+NEWS_RATE_PER_MINUTE = float(os.getenv('NEWS_RATE_PER_MINUTE', 2))
+
+# NewsAPI calls running at the same time, shared by interactive and scheduled work
+UPSTREAM_CONCURRENCY = int(os.getenv('UPSTREAM_CONCURRENCY', 4))
+
+# Upstream priorities, lower runs first
+INTERACTIVE = 0
+SCHEDULED = 1
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter keyed by chat
+
+    Every key starts with ``capacity`` tokens, and each call to ``take()``
+    spends one. Tokens refill at ``rate`` per second. Buckets that are full
+    again are dropped, so idle chats cost no memory.
+    """
+
+    def __init__(self, capacity=NEWS_RATE_BURST, rate=NEWS_RATE_PER_MINUTE / 60, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = rate
+        self.clock = clock
+        self._buckets = {}  # key -> (tokens, updated)
+
+    def take(self, key):
+        """Spend a token for ``key``; returns 0 if allowed, else seconds until the next token"""
+        now = self.clock()
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate if self.rate else float('inf')
+        self._buckets[key] = (tokens - 1, now)
+        if len(self._buckets) > 10000:
+            self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+
+
+class InFlightRegistry:
+    """
+    One running task per key
+
+    ``start()`` runs a coroutine as a task unless a task for the same key
+    is still running, in which case the caller is attached to that task
+    instead of starting another one.
+    """
+
+    def __init__(self, create_task=asyncio.create_task):
+        self.create_task = create_task
+        self._tasks = {}
+
+    def running(self, key):
+        """Return the running task for ``key``, or None"""
+        task = self._tasks.get(key)
+        if task is not None and task.done():
+            del self._tasks[key]
+            return None
+        return task
+
+    def start(self, key, coroutine_factory):
+        """Return (task, joined); ``joined`` is True when an existing task was reused"""
+        task = self.running(key)
+        if task is not None:
+            return task, True
+        task = self.create_task(coroutine_factory())
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._tasks.pop(key, None) if self._tasks.get(key) is done else None)
+        return task, False
+
+
+class PriorityGate:
+    """
+    Concurrency limit for upstream calls where interactive work goes first
+
+    At most ``limit`` calls run at once. When the gate is full, waiters are
+    admitted by priority and then in arrival order, so a user tapping
+    "Get News" does not queue behind a scheduled delivery cycle.
+    """
+
+    def __init__(self, limit=UPSTREAM_CONCURRENCY):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority=SCHEDULED):
+        # Drop waiters that were cancelled while queued
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted right before being cancelled, pass the slot on
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # The slot moves straight to the waiter
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    async def run(self, priority, func, /, *args, **kwargs):
+        """Run a blocking ``func(*args, **kwargs)`` in a worker thread once admitted"""
+        await self.acquire(priority)
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        finally:
+            self.release()
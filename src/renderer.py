@@ -0,0 +1,146 @@
+import os
+import re
+from collections import OrderedDict
+from html import escape, unescape
+
+# Rendered digest bodies kept, keyed by (article ids, language)
+DIGEST_CACHE_SIZE = 1000
+
+# Articles per news digest
+DIGEST_MAX_ARTICLES = int(os.getenv('DIGEST_MAX_ARTICLES', 5))
+# Show a link preview for the first article of a digest
+DIGEST_LINK_PREVIEW = os.getenv('DIGEST_LINK_PREVIEW', 'false').lower() in ('1', 'true', 'yes')
+
+# Telegram's limit for the text of one message, counted after HTML parsing
+MESSAGE_LIMIT = 4096
+# Longest title kept, so a single article always fits in a message
+TITLE_LENGTH = 300
+
+# Topics or sources listed by name in the header before "(+N more)"
+HEADER_ITEMS = 3
+
+# News message templates per language (Telegram HTML)
+TEMPLATES = {
+    'en': {
+        'title': "📰 <b>Latest News</b> (based on your preferences)\n",
+        'topics': "📚 Topics: {names}{more}\n",
+        'sources': "📰 Sources: {names}{more}\n",
+        'more': " (+{count} more)",
+        'stale': "⚠️ <i>The news service is not responding, these articles may be slightly stale.</i>\n",
+        'separator': "\n",
+        'article': "🔸 <b>{title}</b>\n{description}…\n<a href=\"{url}\">{source}</a>\n\n",
+    },
+    'fa': {
+        'title': "📰 <b>آخرین اخبار</b> (بر اساس تنظیمات شما)\n",
+        'topics': "📚 موضوعات: {names}{more}\n",
+        'sources': "📰 منابع: {names}{more}\n",
+        'more': " (+{count} بیشتر)",
+        'stale': "⚠️ <i>سرویس خبر پاسخ نمی‌دهد، این اخبار ممکن است کمی قدیمی باشند.</i>\n",
+        'separator': "\n",
+        'article': "🔸 <b>{title}</b>\n{description}…\n<a href=\"{url}\">{source}</a>\n\n",
+    },
+}
+
+
+TAG = re.compile(r'<[^>]+>')
+
+
+def message_length(text):
+    """Length of a text as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def html_length(html):
+    """Length of an HTML message once Telegram has parsed it: tags and link targets don't count"""
+    return message_length(unescape(TAG.sub('', html)))
+
+
+class DigestRenderer:
+    """
+    Render news digests from a per-user header and a shared body
+
+    The body (the articles) depends only on the articles and the language,
+    so it is rendered once and cached on (article ids, lang). Users who get
+    the same articles only pay for their short header with their topics and
+    sources, which is cached too since most users keep similar settings.
+    Rendering cost per cycle then scales with distinct digests.
+
+    Digests are Telegram HTML, packed into as few messages as fit in the
+    message length limit without splitting an article.
+    """
+
+    def __init__(self, cache_size=DIGEST_CACHE_SIZE, limit=MESSAGE_LIMIT):
+        self.cache_size = cache_size
+        self.limit = limit
+        self._bodies = OrderedDict()
+        self._headers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _templates(lang):
+        return TEMPLATES.get(lang, TEMPLATES['en'])
+
+    def header(self, lang, topics, sources, stale=False):
+        """Render the per-user part above the articles"""
+        key = (lang, tuple(topics), tuple(sources), stale)
+        header = self._headers.get(key)
+        if header is None:
+            header = self._headers[key] = self._render_header(lang, topics, sources, stale)
+            if len(self._headers) > self.cache_size:
+                self._headers.popitem(last=False)
+        else:
+            self._headers.move_to_end(key)
+        return header
+
+    def _render_header(self, lang, topics, sources, stale):
+        templates = self._templates(lang)
+        parts = [templates['title']]
+        for key, names in (('topics', topics), ('sources', sources)):
+            if names:
+                extra = len(names) - HEADER_ITEMS
+                more = templates['more'].format(count=extra) if extra > 0 else ""
+                parts.append(templates[key].format(names=escape(", ".join(names[:HEADER_ITEMS]), quote=False), more=more))
+        if stale:
+            parts.append(templates['stale'])
+        parts.append(templates['separator'])
+        return "".join(parts)
+
+    def body(self, articles, lang):
+        """Render the articles as a tuple of (html, length) chunks, or return them from the cache"""
+        key = (tuple(article.id for article in articles), lang)
+        body = self._bodies.get(key)
+        if body is not None:
+            self.hits += 1
+            self._bodies.move_to_end(key)
+            return body
+        self.misses += 1
+        article_template = self._templates(lang)['article']
+        chunks = []
+        for article in articles:
+            chunk = article_template.format(
+                title=escape(article.title[:TITLE_LENGTH], quote=False),
+                description=escape(article.description, quote=False),
+                source=escape(article.source, quote=False),
+                url=escape(article.url),
+            )
+            chunks.append((chunk, html_length(chunk)))
+        body = self._bodies[key] = tuple(chunks)
+        if len(self._bodies) > self.cache_size:
+            self._bodies.popitem(last=False)
+        return body
+
+    def render(self, articles, lang, topics=(), sources=(), stale=False):
+        """Render a digest as a list of messages, each within the length limit"""
+        header = self.header(lang, topics, sources, stale)
+        messages = []
+        parts = [header]
+        length = html_length(header)
+        for chunk, chunk_length in self.body(articles, lang):
+            if length + chunk_length > self.limit and len(parts) > 1:
+                messages.append("".join(parts).rstrip())
+                parts, length = [], 0
+            parts.append(chunk)
+            length += chunk_length
+        messages.append("".join(parts).rstrip())
+        return messages
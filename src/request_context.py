@@ -0,0 +1,84 @@
+import time
+from contextvars import ContextVar
+
+_current = ContextVar('request_context', default=None)
+
+
+class RequestContext:
+    """
+    Unit of work for one Telegram update
+
+    Holds the single database session used while the update is handled and
+    the update's ``User`` row once it has been loaded. db_helper functions
+    called while a context is active reuse both, and flush instead of
+    committing. The context commits once when it is closed.
+    """
+
+    __slots__ = ('session', 'chat_id', 'user', 'failed', 'closed', 'label', 'started', 'trace', '_token')
+
+    def __init__(self, session, chat_id=None, label=None):
+        self.session = session
+        self.chat_id = str(chat_id) if chat_id is not None else None
+        self.user = None
+        self.failed = False
+        self.closed = False
+        self.label = label  # what the update is, for metrics
+        self.started = time.perf_counter()
+        self.trace = None  # root span of the update's trace
+        self._token = None
+
+    def commit(self):
+        """Commit work done so far, e.g. before slow network I/O"""
+        if not self.closed:
+            self.session.commit()
+
+    def close(self):
+        """Commit (or roll back after a failure) and release the session"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.failed:
+                self.session.rollback()
+            else:
+                self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.close()
+            if self._token is not None:
+                try:
+                    _current.reset(self._token)
+                except ValueError:
+                    # Closed from a different context than it was opened in
+                    _current.set(None)
+
+
+def open_request(session, chat_id=None, label=None):
+    """Open a request context and make it current"""
+    context = RequestContext(session, chat_id, label)
+    context._token = _current.set(context)
+    return context
+
+
+def current_request():
+    """Return the active request context, or None outside of an update"""
+    context = _current.get()
+    if context is None or context.closed:
+        return None
+    return context
+
+
+def detached(coroutine_factory):
+    """
+    Wrap a coroutine factory so its coroutine runs outside any request
+
+    Tasks copy the context they are created in, so a task started while an
+    update is handled would otherwise see that update's request context and
+    use its session after the update has closed it.
+    """
+    async def run():
+        _current.set(None)
+        return await coroutine_factory()
+    return run
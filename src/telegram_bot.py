@@ -1,15 +1,35 @@
 import os
+import asyncio
+import functools
+import time
 import requests
 from src.news_fetcher import NewsFetcher
+from src.delivery_scheduler import DeliveryScheduler
+from src.menus import MenuRegistry
+from src.toggle_coalescer import ToggleCoalescer
+from src.renderer import DigestRenderer, DIGEST_MAX_ARTICLES, DIGEST_LINK_PREVIEW
+from src.transport import build_requests, TracedRequest, TELEGRAM_BASE_URL
+from src.rate_limit import TokenBucket, InFlightRegistry, PriorityGate, INTERACTIVE, SCHEDULED
+from src.quota import QuotaManager, QUOTA_KEY, load_api_keys
+from src.callbacks import (
+    CallbackRouter, callback_data, decode, ACTION_NAMES, SET_LANGUAGE, TOPIC_CATEGORY, SOURCE_CATEGORY,
+    TOPIC_TOGGLE, SOURCE_TOGGLE, SHOW_TOPICS, SHOW_SOURCES, GET_NEWS
+)
+from src import metrics, tracing, query_profiler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackContext, ContextTypes, JobQueue, CallbackQueryHandler, MessageHandler, filters
+from telegram.constants import ParseMode
+from telegram.error import TelegramError, Forbidden, BadRequest, RetryAfter
+from telegram.ext import Application, CommandHandler, CallbackContext, ContextTypes, JobQueue, CallbackQueryHandler, MessageHandler, TypeHandler, filters
 from src.db_helper import (
     create_user, update_user_activity, get_user_sources,
     get_enabled_sources_for_user,
-    get_all_users, get_user_preferences, toggle_user_topic, get_user_topics,
+    iter_user_batches, get_user_preferences, set_user_preferences, get_user_topics,
     get_enabled_topics_for_user, initialize_user_topics, initialize_user_sources,
-    get_user, set_user_language, get_user_language
+    get_user, set_user_language, get_user_language, get_bot_state, set_bot_state,
+    mark_user_undeliverable, mark_user_deliverable,
+    begin_request, end_request, commit_request
 )
+from src.request_context import current_request, detached
 from src.categories import TOPIC_CATEGORIES, SOURCE_CATEGORIES, get_all_topics, get_all_sources
 import pytz
 from datetime import datetime, timedelta
@@ -17,21 +37,99 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Handler group that closes the per-update unit of work, after all other groups
+REQUEST_CLOSE_GROUP = 1000
+
+# Title NewsAPI gives articles that were taken down
+REMOVED_TITLE = "[Removed]"
+
+# Times a message is sent again after Telegram's flood control asked to wait
+FLOOD_RETRIES = 3
+
+def handle_delivery_error(chat_id, error):
+    """
+    Handle a failed scheduled send; blocked or deleted chats are marked undeliverable
+
+    Other errors (timeouts, network errors, flood control that outlasted
+    the retries, bad requests) say nothing about the chat, so they are
+    only logged and the user is tried again next cycle.
+    """
+    permanent = isinstance(error, Forbidden) or (
+        isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+    )
+    if not permanent:
+        logger.warning(f"Failed to deliver news to {chat_id}, will retry next cycle: {error}")
+        return
+    if mark_user_undeliverable(chat_id):
+        logger.info(f"Chat {chat_id} marked undeliverable: {error}")
+
 class TelegramBot:
 
-    def __init__(self, token, api_key):
+    def __init__(self, token, api_key, transport=None):
+        """
+        ``transport`` is an optional (request, get_updates_request) pair to
+        use instead of build_requests(), e.g. a fake Bot API for benchmarks.
+        """
         self.token = token
         self.api_key = api_key
-        self.base_url = f"https://api.telegram.org/bot{self.token}"
+        self.base_url = f"{TELEGRAM_BASE_URL}{self.token}"
         print("Starting Bot...")
-        self.app = Application.builder().token(token).build()
+        request, get_updates_request = transport or build_requests()
+        if tracing.TRACING:
+            request = TracedRequest(request)
+        self.app = (
+            Application.builder().token(token)
+            .base_url(TELEGRAM_BASE_URL)
+            .request(request)
+            .get_updates_request(get_updates_request)
+            .post_stop(self.on_stop)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+
+        # Daily NewsAPI budget over the key pool, persisted in bot_state
+        self.quota = QuotaManager(
+            load_api_keys(self.api_key),
+            load=lambda: get_bot_state(QUOTA_KEY),
+            save=lambda state: set_bot_state(QUOTA_KEY, state)
+        )
 
         # Create NewsFetcher instance
-        self.news_fetcher = NewsFetcher(api_key=self.api_key)
+        self.news_fetcher = NewsFetcher(api_key=self.api_key, quota=self.quota)
 
         # Available news sources (now from categories)
         self.available_sources = get_all_sources()
 
+        # Static menus and toggle buttons, built once per language
+        self.menus = MenuRegistry()
+
+        # News messages, with article bodies cached per article set and language
+        self.renderer = DigestRenderer()
+
+        # Rapid toggle taps are written and shown in one go per keyboard
+        self.toggles = ToggleCoalescer(set_user_preferences)
+
+        # On-demand news: one delivery at a time per chat, rate limited, and
+        # ahead of scheduled deliveries when NewsAPI calls are at the limit
+        self.news_in_flight = InFlightRegistry(self.app.create_task)
+        self.news_limiter = TokenBucket()
+        self.upstream = PriorityGate()
+
+        # Callback query handlers, indexed by action code
+        self.callbacks = CallbackRouter()
+        self.callbacks.register(SET_LANGUAGE, self.on_set_language)
+        self.callbacks.register(TOPIC_CATEGORY, self.on_topic_category)
+        self.callbacks.register(SOURCE_CATEGORY, self.on_source_category)
+        self.callbacks.register(TOPIC_TOGGLE, self.on_topic_toggle)
+        self.callbacks.register(SOURCE_TOGGLE, self.on_source_toggle)
+        self.callbacks.register(SHOW_TOPICS, self.on_show_topics)
+        self.callbacks.register(SHOW_SOURCES, self.on_show_sources)
+        self.callbacks.register(GET_NEWS, self.on_get_news)
+
+        # One database session and user lookup per update, committed once
+        self.app.add_handler(TypeHandler(Update, self.open_request), group=-1)
+        self.app.add_handler(TypeHandler(Update, self.close_request), group=REQUEST_CLOSE_GROUP)
+
         # Commands
         self.app.add_handler(CommandHandler('start', self.start))
         self.app.add_handler(CommandHandler('help', self.help))
@@ -50,6 +148,13 @@ class TelegramBot:
         # Error handler
         self.app.add_error_handler(self.error)
 
+        # Commands handled, the metrics label of any other command is "/other"
+        self.commands = {
+            f"/{command}" for handler in self.app.handlers[0]
+            if isinstance(handler, CommandHandler) for command in handler.commands
+        }
+        metrics.register_cache('digest_body', lambda: (self.renderer.hits, self.renderer.misses))
+
         # Job queue for scheduled news (only if available)
         try:
             self.job_queue = self.app.job_queue
@@ -68,22 +173,60 @@ class TelegramBot:
             allowed_updates=["message", "callback_query"]
         )
 
+    async def on_stop(self, application):
+        """Write toggle taps still waiting for their debounce, while keyboards can still be edited"""
+        await self.toggles.flush()
+
+    async def on_shutdown(self, application):
+        """Write any toggle taps left, then the NewsAPI quota usage counted since it was last written"""
+        await self.toggles.flush()
+        self.quota.flush()
+
     def schedule_news_updates(self):
-        """Schedule news updates every 4 hours"""
+        """Schedule news updates every 4 hours, staggered over a window per cycle"""
         if not self.job_queue:
             return
             
-        iran_time_zone = pytz.timezone('Asia/Tehran')
-        now = datetime.now(iran_time_zone)
+        self.delivery_scheduler = DeliveryScheduler(self.job_queue, self.send_scheduled_news, quota=self.quota)
+        self.delivery_scheduler.start()
 
-        # Schedule times: 8 AM, 12 PM, 4 PM, 8 PM, 12 AM, 4 AM IRST
-        times = [8, 12, 16, 20, 0, 4]
-        for hour in times:
-            scheduled_time = iran_time_zone.localize(datetime(now.year, now.month, now.day, hour, 0))
-            if scheduled_time < now:
-                scheduled_time += timedelta(days=1)
+    def update_label(self, update):
+        """Name an update by its command or callback action, for metrics"""
+        if not isinstance(update, Update):
+            return "other"
+        if update.callback_query:
+            decoded = decode(update.callback_query.data or "")
+            return ACTION_NAMES.get(decoded[0], "callback") if decoded else "callback"
+        message = update.message
+        if message and message.text:
+            if message.text.startswith("/"):
+                command = message.text.split()[0].split("@")[0]
+                return command if command in self.commands else "/other"
+            return "text"
+        return "other"
 
-            self.job_queue.run_once(self.send_scheduled_news, when=scheduled_time)
+    async def open_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Open the unit of work that the handlers of this update share"""
+        chat = update.effective_chat if isinstance(update, Update) else None
+        label = self.update_label(update)
+        request = begin_request(chat.id if chat else None, label)
+        request.trace = tracing.begin('update', handler=label, chat_id=request.chat_id)
+        query_profiler.begin(label)
+
+    async def close_request(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Commit the unit of work of this update once all handlers are done"""
+        request = current_request()
+        try:
+            with tracing.span('commit', 'db'):
+                end_request()
+        except Exception:
+            logger.exception("Error committing update")
+        if request is not None:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - request.started, request.label)
+            if request.failed:
+                metrics.HANDLER_ERRORS.inc(request.label)
+            tracing.end(request.trace, 'failed' if request.failed else None)
+        query_profiler.end(query_profiler.current_unit())
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -93,7 +236,12 @@ class TelegramBot:
             chat_id = str(update.message.chat.id)
             user = update.effective_user
             user_obj = get_user(chat_id)
-            if not user_obj:
+            if user_obj:
+                # Returning users move back into the active delivery tier
+                update_user_activity(chat_id)
+                if not user_obj.is_deliverable:
+                    mark_user_deliverable(chat_id)
+            else:
                 create_user(
                     chat_id=chat_id,
                     username=getattr(user, 'username', None),
@@ -104,11 +252,7 @@ class TelegramBot:
                 user_obj = get_user(chat_id)
             # Ask for language selection if not set
             if not user_obj or not getattr(user_obj, 'language', None):
-                keyboard = [
-                    [InlineKeyboardButton("English 🇬🇧", callback_data="set_lang_en")],
-                    [InlineKeyboardButton("فارسی 🇮🇷", callback_data="set_lang_fa")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = self.menus.language_menu
                 if update.message:
                     await update.message.reply_text("Please select your language:\nلطفا زبان خود را انتخاب کنید:", reply_markup=reply_markup)
                 return
@@ -232,9 +376,9 @@ class TelegramBot:
                     info_message += "No sources enabled. Use /sources to enable some!\n"
             # Add action buttons
             keyboard = [
-                [InlineKeyboardButton("📚 Manage Topics" if lang != 'fa' else "📚 مدیریت موضوعات", callback_data="show_topics")],
-                [InlineKeyboardButton("📰 Manage Sources" if lang != 'fa' else "📰 مدیریت منابع", callback_data="show_sources")],
-                [InlineKeyboardButton("📰 Get News Now" if lang != 'fa' else "📰 دریافت خبر", callback_data="get_news")]
+                [InlineKeyboardButton("📚 Manage Topics" if lang != 'fa' else "📚 مدیریت موضوعات", callback_data=callback_data(SHOW_TOPICS))],
+                [InlineKeyboardButton("📰 Manage Sources" if lang != 'fa' else "📰 مدیریت منابع", callback_data=callback_data(SHOW_SOURCES))],
+                [InlineKeyboardButton("📰 Get News Now" if lang != 'fa' else "📰 دریافت خبر", callback_data=callback_data(GET_NEWS))]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             if update.message:
@@ -254,22 +398,7 @@ class TelegramBot:
             lang = get_user_language(chat_id)
             # Initialize topics if not already done
             initialize_user_topics(chat_id)
-            message = "📚 Choose a topic category to manage your news topics:\n\n" if lang != 'fa' else "📚 یک دسته‌بندی موضوعی را برای مدیریت موضوعات خبری انتخاب کنید:\n\n"
-            # Create first-level keyboard with categories
-            keyboard = []
-            for cat_id, cat_data in TOPIC_CATEGORIES.items():
-                keyboard.append([
-                    InlineKeyboardButton(
-                        cat_data["name"], 
-                        callback_data=f"cat:{cat_id}"
-                    )
-                ])
-            # Add navigation buttons
-            keyboard.append([
-                InlineKeyboardButton("🔧 Sources" if lang != 'fa' else "🔧 منابع", callback_data="show_sources"),
-                InlineKeyboardButton("📰 Get News" if lang != 'fa' else "📰 دریافت خبر", callback_data="get_news")
-            ])
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            message, reply_markup = self.menus.topics_menu(lang)
             if update.message:
                 await update.message.reply_text(message, reply_markup=reply_markup)
         except Exception as e:
@@ -287,22 +416,7 @@ class TelegramBot:
             lang = get_user_language(chat_id)
             # Initialize sources if not already done
             initialize_user_sources(chat_id)
-            message = "📰 Choose a source category to manage your news sources:\n\n" if lang != 'fa' else "📰 یک دسته‌بندی منبع را برای مدیریت منابع خبری انتخاب کنید:\n\n"
-            # Create first-level keyboard with categories
-            keyboard = []
-            for cat_id, cat_data in SOURCE_CATEGORIES.items():
-                keyboard.append([
-                    InlineKeyboardButton(
-                        cat_data["name"], 
-                        callback_data=f"src_cat:{cat_id}"
-                    )
-                ])
-            # Add navigation buttons
-            keyboard.append([
-                InlineKeyboardButton("📚 Topics" if lang != 'fa' else "📚 موضوعات", callback_data="show_topics"),
-                InlineKeyboardButton("📰 Get News" if lang != 'fa' else "📰 دریافت خبر", callback_data="get_news")
-            ])
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            message, reply_markup = self.menus.sources_menu(lang)
             if update.message:
                 await update.message.reply_text(message, reply_markup=reply_markup)
         except Exception as e:
@@ -313,35 +427,14 @@ class TelegramBot:
     async def show_topic_category(self, chat_id, category_id):
         """Show topics within a specific category"""
         try:
-            cat_data = TOPIC_CATEGORIES.get(category_id)
-            if not cat_data:
+            if category_id not in TOPIC_CATEGORIES:
                 return None
             
             user_topics = get_user_topics(chat_id)
             lang = get_user_language(chat_id)
             
-            message_text = f"📚 {cat_data['name']}\n\nSelect topics to enable/disable:\n\n" if lang != 'fa' else f"📚 {cat_data['name']}\n\nموضوعات را برای فعال/غیرفعال کردن انتخاب کنید:\n\n"
-            
-            # Create second-level keyboard with topic toggles
-            keyboard = []
-            for topic in cat_data["topics"]:
-                is_enabled = user_topics.get(topic, False)
-                status = "✅" if is_enabled else "❌"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{status} {topic}", 
-                        callback_data=f"topic:{topic}"
-                    )
-                ])
-            
-            # Add navigation buttons
-            keyboard.append([
-                InlineKeyboardButton("⬅️ Back to Categories" if lang != 'fa' else "⬅️ بازگشت به دسته‌ها", callback_data="show_topics"),
-                InlineKeyboardButton("🔧 Sources" if lang != 'fa' else "🔧 منابع", callback_data="show_sources")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            return message_text, reply_markup
+            # Second-level keyboard with topic toggles, from the prebuilt buttons
+            return self.menus.topic_category(lang, category_id, user_topics)
             
         except Exception as e:
             print(f"Error in show_topic_category: {e}")
@@ -350,35 +443,14 @@ class TelegramBot:
     async def show_source_category(self, chat_id, category_id):
         """Show sources within a specific category"""
         try:
-            cat_data = SOURCE_CATEGORIES.get(category_id)
-            if not cat_data:
+            if category_id not in SOURCE_CATEGORIES:
                 return None
             
             user_sources = get_user_sources(chat_id)
             lang = get_user_language(chat_id)
             
-            message_text = f"📰 {cat_data['name']}\n\nSelect sources to enable/disable:\n\n" if lang != 'fa' else f"📰 {cat_data['name']}\n\nمنابع را برای فعال/غیرفعال کردن انتخاب کنید:\n\n"
-            
-            # Create second-level keyboard with source toggles
-            keyboard = []
-            for source in cat_data["sources"]:
-                is_enabled = user_sources.get(source, False)
-                status = "✅" if is_enabled else "❌"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{status} {source}", 
-                        callback_data=f"source:{source}"
-                    )
-                ])
-            
-            # Add navigation buttons
-            keyboard.append([
-                InlineKeyboardButton("⬅️ Back to Categories" if lang != 'fa' else "⬅️ بازگشت به دسته‌ها", callback_data="show_sources"),
-                InlineKeyboardButton("📚 Topics" if lang != 'fa' else "📚 موضوعات", callback_data="show_topics")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            return message_text, reply_markup
+            # Second-level keyboard with source toggles, from the prebuilt buttons
+            return self.menus.source_category(lang, category_id, user_sources)
             
         except Exception as e:
             print(f"Error in show_source_category: {e}")
@@ -401,237 +473,132 @@ class TelegramBot:
     async def button_click(self, update: Update, context: CallbackContext):
         """Handle inline button clicks"""
         query = update.callback_query
-        chat_id = str(query.message.chat.id)
-        data = query.data
         try:
-            if data == "set_lang_en":
-                set_user_language(chat_id, 'en')
-                await query.answer()
-                await query.edit_message_text("Language set to English.\nزبان به انگلیسی تغییر یافت.")
-                await self.send_welcome_message(query, 'en')
-            elif data == "set_lang_fa":
-                set_user_language(chat_id, 'fa')
+            if not await self.callbacks.dispatch(query, context):
                 await query.answer()
-                await query.edit_message_text("زبان به فارسی تغییر یافت.\nLanguage set to Farsi.")
-                await self.send_welcome_message(query, 'fa')
-            else:
-                # Handle topic category selection
-                if data.startswith("cat:"):
-                    category_id = data.split(":")[1]
-                    result = await self.show_topic_category(chat_id, category_id)
-                    if result:
-                        message_text, reply_markup = result
-                        await query.edit_message_text(text=message_text, reply_markup=reply_markup)
-                    else:
-                        await query.message.reply_text("❌ Category not found.")
-                    
-                # Handle source category selection
-                elif data.startswith("src_cat:"):
-                    category_id = data.split(":")[1]
-                    result = await self.show_source_category(chat_id, category_id)
-                    if result:
-                        message_text, reply_markup = result
-                        await query.edit_message_text(text=message_text, reply_markup=reply_markup)
-                    else:
-                        await query.message.reply_text("❌ Category not found.")
-                    
-                # Handle topic toggle
-                elif data.startswith("topic:"):
-                    topic_name = data.split(":", 1)[1]
-                    is_enabled = toggle_user_topic(chat_id, topic_name)
-                    status = "enabled" if is_enabled else "disabled"
-                    
-                    # Recreate the keyboard with updated status
-                    keyboard = []
-                    user_topics = get_user_topics(chat_id)
-                    
-                    # Find which category this topic belongs to
-                    from src.categories import get_topic_category
-                    category_id = get_topic_category(topic_name)
-                    if category_id and category_id in TOPIC_CATEGORIES:
-                        cat_data = TOPIC_CATEGORIES[category_id]
-                        
-                        # Recreate topic buttons
-                        for topic in cat_data["topics"]:
-                            is_topic_enabled = user_topics.get(topic, False)
-                            status_icon = "✅" if is_topic_enabled else "❌"
-                            keyboard.append([
-                                InlineKeyboardButton(
-                                    f"{status_icon} {topic}", 
-                                    callback_data=f"topic:{topic}"
-                                )
-                            ])
-                        
-                        # Add navigation buttons
-                        lang = get_user_language(chat_id)
-                        keyboard.append([
-                            InlineKeyboardButton("⬅️ Back to Categories" if lang != 'fa' else "⬅️ بازگشت به دسته‌ها", callback_data="show_topics"),
-                            InlineKeyboardButton("🔧 Sources" if lang != 'fa' else "🔧 منابع", callback_data="show_sources")
-                        ])
-                        
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        # Check if markup is different before updating
-                        if query.message.reply_markup and query.message.reply_markup.to_dict() == reply_markup.to_dict():
-                            await query.answer("No change.")
-                        else:
-                            await query.edit_message_reply_markup(reply_markup=reply_markup)
-                    else:
-                        await query.message.reply_text(f"❌ Error: Topic category not found")
-                
-                # Handle source toggle
-                elif data.startswith("source:"):
-                    source_domain = data.split(":", 1)[1]
-                    # Inline toggle_user_source logic
-                    from src.db_helper import get_user, get_session
-                    from src.models import UserSource
-                    session = get_session()
-                    try:
-                        user = get_user(chat_id)
-                        is_enabled = None
-                        if user:
-                            user_source = session.query(UserSource).filter_by(user_id=user.id, source_domain=source_domain).first()
-                            if user_source:
-                                user_source.is_enabled = not user_source.is_enabled
-                                session.commit()
-                                is_enabled = user_source.is_enabled
-                            else:
-                                # Create new source entry if it doesn't exist
-                                user_source = UserSource(
-                                    user_id=user.id,
-                                    source_domain=source_domain,
-                                    is_enabled=True
-                                )
-                                session.add(user_source)
-                                session.commit()
-                                is_enabled = True
-                    except Exception as e:
-                        session.rollback()
-                        raise e
-                    finally:
-                        session.close()
-                    status = "enabled" if is_enabled else "disabled"
-                    
-                    # Recreate the keyboard with updated status
-                    keyboard = []
-                    user_sources = get_user_sources(chat_id)
-                    
-                    # Find which category this source belongs to
-                    from src.categories import get_source_category
-                    category_id = get_source_category(source_domain)
-                    if category_id and category_id in SOURCE_CATEGORIES:
-                        cat_data = SOURCE_CATEGORIES[category_id]
-                        
-                        # Recreate source buttons
-                        for source in cat_data["sources"]:
-                            is_source_enabled = user_sources.get(source, False)
-                            status_icon = "✅" if is_source_enabled else "❌"
-                            keyboard.append([
-                                InlineKeyboardButton(
-                                    f"{status_icon} {source}", 
-                                    callback_data=f"source:{source}"
-                                )
-                            ])
-                        
-                        # Add navigation buttons
-                        lang = get_user_language(chat_id)
-                        keyboard.append([
-                            InlineKeyboardButton("⬅️ Back to Categories" if lang != 'fa' else "⬅️ بازگشت به دسته‌ها", callback_data="show_sources"),
-                            InlineKeyboardButton("📚 Topics" if lang != 'fa' else "📚 موضوعات", callback_data="show_topics")
-                        ])
-                        
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        # Check if markup is different before updating
-                        if query.message.reply_markup and query.message.reply_markup.to_dict() == reply_markup.to_dict():
-                            await query.answer("No change.")
-                        else:
-                            await query.edit_message_reply_markup(reply_markup=reply_markup)
-                    else:
-                        await query.message.reply_text(f"❌ Error: Source category not found")
-                
-                # Handle navigation buttons
-                elif data == "show_topics":
-                    # Initialize topics if not already done
-                    initialize_user_topics(chat_id)
-                    lang = get_user_language(chat_id)
-                    
-                    message = "📚 Choose a topic category to manage your news topics:\n\n" if lang != 'fa' else "📚 یک دسته‌بندی موضوعی را برای مدیریت موضوعات خبری انتخاب کنید:\n\n"
-                    
-                    # Create first-level keyboard with categories
-                    keyboard = []
-                    for cat_id, cat_data in TOPIC_CATEGORIES.items():
-                        keyboard.append([
-                            InlineKeyboardButton(
-                                cat_data["name"], 
-                                callback_data=f"cat:{cat_id}"
-                            )
-                        ])
-                    
-                    # Add navigation buttons
-                    keyboard.append([
-                        InlineKeyboardButton("🔧 Sources" if lang != 'fa' else "🔧 منابع", callback_data="show_sources"),
-                        InlineKeyboardButton("📰 Get News" if lang != 'fa' else "📰 دریافت خبر", callback_data="get_news")
-                    ])
-                    
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await query.edit_message_text(text=message, reply_markup=reply_markup)
-                    
-                elif data == "show_sources":
-                    # Initialize sources if not already done
-                    initialize_user_sources(chat_id)
-                    lang = get_user_language(chat_id)
-                    
-                    message = "📰 Choose a source category to manage your news sources:\n\n" if lang != 'fa' else "📰 یک دسته‌بندی منبع را برای مدیریت منابع خبری انتخاب کنید:\n\n"
-                    
-                    # Create first-level keyboard with categories
-                    keyboard = []
-                    for cat_id, cat_data in SOURCE_CATEGORIES.items():
-                        keyboard.append([
-                            InlineKeyboardButton(
-                                cat_data["name"], 
-                                callback_data=f"src_cat:{cat_id}"
-                            )
-                        ])
-                    
-                    # Add navigation buttons
-                    keyboard.append([
-                        InlineKeyboardButton("📚 Topics" if lang != 'fa' else "📚 موضوعات", callback_data="show_topics"),
-                        InlineKeyboardButton("📰 Get News" if lang != 'fa' else "📰 دریافت خبر", callback_data="get_news")
-                    ])
-                    
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await query.edit_message_text(text=message, reply_markup=reply_markup)
-                    
-                elif data == "get_news":
-                    # Send a loading message first
-                    lang = get_user_language(chat_id)
-                    loading_message = "📰 Fetching your personalized news..." if lang != 'fa' else "📰 در حال دریافت اخبار شخصی‌سازی شده شما..."
-                    await query.message.reply_text(loading_message)
-                    await self.send_news_to_user(chat_id, None, context)
-                
         except Exception as e:
             print("Exception in button_click:", e)
             logger.exception("Error in button_click")
             await query.edit_message_text("❌ An error occurred. Please try again.\nیک خطا رخ داد. لطفا دوباره تلاش کنید.")
 
+    async def on_set_language(self, query, context, lang):
+        """Handle language selection"""
+        chat_id = str(query.message.chat.id)
+        set_user_language(chat_id, lang)
+        await query.answer()
+        if lang == 'fa':
+            await query.edit_message_text("زبان به فارسی تغییر یافت.\nLanguage set to Farsi.")
+        else:
+            await query.edit_message_text("Language set to English.\nزبان به انگلیسی تغییر یافت.")
+        await self.send_welcome_message(query, lang)
+
+    async def on_topic_category(self, query, context, category_id):
+        """Handle topic category selection"""
+        # Write pending toggles before the keyboard is replaced
+        await self.toggles.settle(query)
+        chat_id = str(query.message.chat.id)
+        result = await self.show_topic_category(chat_id, category_id)
+        if result:
+            message_text, reply_markup = result
+            await query.edit_message_text(text=message_text, reply_markup=reply_markup)
+        else:
+            await query.message.reply_text("❌ Category not found.")
+
+    async def on_source_category(self, query, context, category_id):
+        """Handle source category selection"""
+        # Write pending toggles before the keyboard is replaced
+        await self.toggles.settle(query)
+        chat_id = str(query.message.chat.id)
+        result = await self.show_source_category(chat_id, category_id)
+        if result:
+            message_text, reply_markup = result
+            await query.edit_message_text(text=message_text, reply_markup=reply_markup)
+        else:
+            await query.message.reply_text("❌ Category not found.")
+
+    async def on_topic_toggle(self, query, context, topic_name):
+        """Handle topic toggle"""
+        await self.toggles.tap(query, self.menus.topic_buttons[topic_name], topic=topic_name)
+
+    async def on_source_toggle(self, query, context, source_domain):
+        """Handle source toggle"""
+        await self.toggles.tap(query, self.menus.source_buttons[source_domain], source=source_domain)
+
+    async def on_show_topics(self, query, context):
+        """Handle navigation to the topic categories"""
+        # Write pending toggles before the keyboard is replaced
+        await self.toggles.settle(query)
+        chat_id = str(query.message.chat.id)
+        # Initialize topics if not already done
+        initialize_user_topics(chat_id)
+        lang = get_user_language(chat_id)
+        message, reply_markup = self.menus.topics_menu(lang)
+        await query.edit_message_text(text=message, reply_markup=reply_markup)
+
+    async def on_show_sources(self, query, context):
+        """Handle navigation to the source categories"""
+        # Write pending toggles before the keyboard is replaced
+        await self.toggles.settle(query)
+        chat_id = str(query.message.chat.id)
+        # Initialize sources if not already done
+        initialize_user_sources(chat_id)
+        lang = get_user_language(chat_id)
+        message, reply_markup = self.menus.sources_menu(lang)
+        await query.edit_message_text(text=message, reply_markup=reply_markup)
+
+    async def on_get_news(self, query, context):
+        """Handle the Get News button"""
+        chat_id = str(query.message.chat.id)
+        await self.request_news(chat_id, query.message, context=context, loading=True)
+
     async def send_news(self, update: Update, context: CallbackContext):
         """Handle /news command"""
         try:
             chat_id = str(update.message.chat.id)
             update_user_activity(chat_id)
-            await self.send_news_to_user(chat_id, update, context)
+            await self.request_news(chat_id, update.message, update, context)
         except Exception as e:
             logger.exception("Error in send_news")
             lang = get_user_language(chat_id)
             error_message = "❌ An error occurred. Please try again." if lang != 'fa' else "❌ خطایی رخ داد. لطفا دوباره تلاش کنید."
             await update.message.reply_text(error_message)
 
-    async def send_news_to_user(self, chat_id, update=None, context=None):
+    async def request_news(self, chat_id, message, update=None, context=None, loading=False):
+        """Start an on-demand news delivery in the background, unless one is running or the chat is rate limited"""
+        lang = get_user_language(chat_id)
+        if self.news_in_flight.running(chat_id):
+            busy_message = "⏳ Your news is already on its way!" if lang != 'fa' else "⏳ اخبار شما در راه است!"
+            await message.reply_text(busy_message)
+            return
+        retry_after = self.news_limiter.take(chat_id)
+        if retry_after:
+            seconds = int(retry_after) + 1
+            wait_message = f"🙏 Easy there! You can ask for news again in {seconds} seconds." if lang != 'fa' else f"🙏 کمی صبر کنید! تا {seconds} ثانیه دیگر می‌توانید دوباره خبر بگیرید."
+            await message.reply_text(wait_message)
+            return
+        if loading:
+            loading_message = "📰 Fetching your personalized news..." if lang != 'fa' else "📰 در حال دریافت اخبار شخصی‌سازی شده شما..."
+            await message.reply_text(loading_message)
+
+        # Preferences are read within this update, the fetch and send run after it
+        enabled_sources = get_enabled_sources_for_user(chat_id)
+        enabled_topics = get_enabled_topics_for_user(chat_id)
+        # The delivery runs on after this update, in the update's trace but not its request
+        self.news_in_flight.start(chat_id, tracing.continued('deliver', detached(lambda: self.send_news_to_user(
+            chat_id, update, context, lang, priority=INTERACTIVE,
+            enabled_topics=enabled_topics, enabled_sources=enabled_sources
+        ))))
+
+    async def send_news_to_user(self, chat_id, update=None, context=None, lang=None, priority=SCHEDULED, enabled_topics=None, enabled_sources=None):
         """Send personalized news to a specific user"""
         try:
             # Get user preferences and language
-            enabled_sources = get_enabled_sources_for_user(chat_id)
-            enabled_topics = get_enabled_topics_for_user(chat_id)
-            lang = get_user_language(chat_id)
+            if enabled_sources is None:
+                enabled_sources = get_enabled_sources_for_user(chat_id)
+            if enabled_topics is None:
+                enabled_topics = get_enabled_topics_for_user(chat_id)
+            if lang is None:
+                lang = get_user_language(chat_id)
             
             # Check if user has any preferences set
             if not enabled_topics and not enabled_sources:
@@ -640,75 +607,111 @@ class TelegramBot:
                     await update.message.reply_text(message)
                 return
             
+            # Don't hold the update's transaction open during the NewsAPI call
+            commit_request()
+
             # Fetch personalized news using the new topic system
-            articles = self.news_fetcher.fetch_news_by_topics_and_sources(
-                enabled_topics, enabled_sources
+            articles = []
+            stale = False
+            seen = set()
+            pages = self.news_fetcher.stream_news(
+                enabled_topics, enabled_sources, priority,
+                run=functools.partial(self.upstream.run, priority)
             )
+            try:
+                # Further pages are only fetched when filtering left too few articles
+                async for page in pages:
+                    stale = stale or page.stale
+                    for article in page:
+                        key = article.id
+                        if key in seen or article.title == REMOVED_TITLE:
+                            continue
+                        seen.add(key)
+                        articles.append(article)
+                    if len(articles) >= DIGEST_MAX_ARTICLES:
+                        break
+            finally:
+                await pages.aclose()
             
             if not articles:
-                message = "📭 No news found matching your preferences. Try adjusting your topics or sources." if lang != 'fa' else "📭 هیچ خبری مطابق با تنظیمات شما یافت نشد. موضوعات یا منابع خود را تنظیم کنید."
+                if stale:
+                    message = "📡 The news service is not responding right now. Please try again in a few minutes." if lang != 'fa' else "📡 سرویس خبر در حال حاضر پاسخ نمی‌دهد. لطفا چند دقیقه دیگر دوباره تلاش کنید."
+                else:
+                    message = "📭 No news found matching your preferences. Try adjusting your topics or sources." if lang != 'fa' else "📭 هیچ خبری مطابق با تنظیمات شما یافت نشد. موضوعات یا منابع خود را تنظیم کنید."
                 if update:
                     await update.message.reply_text(message)
                 return
             
-            # Format news message
-            news_message = f"📰 Latest News (based on your preferences):\n\n" if lang != 'fa' else f"📰 آخرین اخبار (بر اساس تنظیمات شما):\n\n"
-            
-            # Show what topics/sources were used
-            if enabled_topics:
-                topics_label = "📚 Topics:" if lang != 'fa' else "📚 موضوعات:"
-                news_message += f"{topics_label} {', '.join(enabled_topics[:3])}"
-                if len(enabled_topics) > 3:
-                    more_text = " more" if lang != 'fa' else " بیشتر"
-                    news_message += f" (+{len(enabled_topics)-3}{more_text})"
-                news_message += "\n"
-            
-            if enabled_sources:
-                sources_label = "📰 Sources:" if lang != 'fa' else "📰 منابع:"
-                news_message += f"{sources_label} {', '.join(enabled_sources[:3])}"
-                if len(enabled_sources) > 3:
-                    more_text = " more" if lang != 'fa' else " بیشتر"
-                    news_message += f" (+{len(enabled_sources)-3}{more_text})"
-                news_message += "\n"
-            
-            news_message += "\n" + "="*50 + "\n\n"
-            
-            for i, article in enumerate(articles[:5], 1):  # Limit to 5 articles
-                title = article.get("title", "No title")
-                url = article.get("url", "")
-                desc = article.get("description", "No description")
-                source = article.get("source", {}).get("name", "Unknown")
-                
-                news_message += f"🔸 {title}\n"
-                news_message += f"📝 {desc[:100]}...\n"
-                source_label = "📰 Source:" if lang != 'fa' else "📰 منبع:"
-                news_message += f"{source_label} {source}\n"
-                news_message += f"🔗 {url}\n\n"
+            # Format news messages; the article part is shared by users with the same articles
+            with tracing.span('digest', 'render', articles=min(len(articles), DIGEST_MAX_ARTICLES)):
+                news_messages = self.renderer.render(
+                    articles[:DIGEST_MAX_ARTICLES], lang, enabled_topics, enabled_sources, stale
+                )
             
-            # Send message
-            if update:
-                await update.message.reply_text(news_message)
-            else:
-                await self.app.bot.send_message(chat_id, news_message)
+            # Send messages, with at most the first article's link previewed
+            for i, news_message in enumerate(news_messages):
+                options = dict(parse_mode=ParseMode.HTML, disable_web_page_preview=not (DIGEST_LINK_PREVIEW and i == 0))
+                if update:
+                    await self.send_with_backoff(update.message.reply_text, news_message, **options)
+                else:
+                    await self.send_with_backoff(self.app.bot.send_message, chat_id, news_message, **options)
+            return True
         except Exception as e:
+            if update is None and isinstance(e, TelegramError):
+                handle_delivery_error(chat_id, e)
+                return False
             logger.exception("Error in send_news_to_user")
             error_message = "❌ An error occurred while fetching news. Please try again later." if lang != 'fa' else "❌ خطایی در دریافت اخبار رخ داد. لطفا دوباره تلاش کنید."
             if update:
                 await update.message.reply_text(error_message)
             return
 
-    async def send_scheduled_news(self, context: CallbackContext):
-        """Send scheduled news to all users"""
-        try:
-            users = get_all_users()
+    async def send_with_backoff(self, send, *args, **kwargs):
+        """Call a Bot API send method, waiting out flood control (RetryAfter) up to FLOOD_RETRIES times"""
+        for attempt in range(FLOOD_RETRIES + 1):
+            try:
+                return await send(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == FLOOD_RETRIES:
+                    raise
+                logger.warning(f"Flood control, retrying in {e.retry_after}s")
+                await asyncio.sleep(float(e.retry_after))
+
+    async def send_scheduled_news(self, slot_range=None, active_since=None):
+        """
+        Send scheduled news to users in a delivery slot range, returns how many were delivered
+
+        Errors of a single user's delivery are handled per user; anything
+        else (e.g. the user query failing) is raised, so the whole slot range
+        can be retried.
+        """
+        sent = 0
+        # Read the next page of users in a worker thread while the
+        # current page is being sent, so delivery starts right away
+        loop = asyncio.get_running_loop()
+        pages = iter_user_batches(slot_range=slot_range, active_since=active_since, deliverable=True)
+        next_page = loop.run_in_executor(None, next, pages, None)
+        while True:
+            users = await next_page
+            if not users:
+                break
+            next_page = loop.run_in_executor(None, next, pages, None)
             for user in users:
-                await self.send_news_to_user(user.chat_id)
-        except Exception as e:
-            logger.exception("Error in send_scheduled_news")
+                with tracing.trace('delivery', chat_id=user.chat_id) as trace, query_profiler.profile('delivery'):
+                    delivered = await self.send_news_to_user(user.chat_id, lang=user.language)
+                    result = "delivered" if delivered else "failed" if delivered is False else "skipped"
+                    trace.set(result=result)
+                metrics.DELIVERIES.inc(result)
+                if delivered:
+                    sent += 1
+        return sent
 
     async def error(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle errors"""
         logger.error(f"Update {update} caused error", exc_info=context.error)
+        request = current_request()
+        if request is not None:
+            request.failed = True
         try:
             if update and update.effective_message:
                 await update.effective_message.reply_text(
@@ -724,10 +727,5 @@ class TelegramBot:
             prompt = "لطفا زبان مورد نظر خود را انتخاب کنید:"
         else:
             prompt = "Please select your language:"
-        keyboard = [
-            [InlineKeyboardButton("English 🇬🇧", callback_data="set_lang_en")],
-            [InlineKeyboardButton("فارسی 🇮🇷", callback_data="set_lang_fa")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(prompt, reply_markup=reply_markup)
+        await update.message.reply_text(prompt, reply_markup=self.menus.language_menu)
 
@@ -0,0 +1,120 @@
+import asyncio
+import functools
+import logging
+import os
+
+from src.menus import MenuRegistry
+from src.request_context import detached
+
+logger = logging.getLogger(__name__)
+
+# Quiet time after the last tap before the pending toggles are written
+TOGGLE_DEBOUNCE_SECONDS = float(os.getenv('TOGGLE_DEBOUNCE_SECONDS', 0.7))
+
+
+class PendingToggles:
+    """Toggle taps on one keyboard message that are not written yet"""
+
+    __slots__ = ('markup', 'sent_markup', 'topics', 'sources', 'query', 'timer', 'lock')
+
+    def __init__(self, markup):
+        self.markup = markup          # keyboard with every tap applied
+        self.sent_markup = markup     # keyboard Telegram currently shows
+        self.topics = {}              # topic name -> wanted state
+        self.sources = {}             # source domain -> wanted state
+        self.query = None
+        self.timer = None
+        self.lock = asyncio.Lock()
+
+
+class ToggleCoalescer:
+    """
+    Coalesce rapid toggle taps on one keyboard into one write and one edit
+
+    Each tap is answered right away and applied to a local copy of the
+    keyboard. Once no tap has arrived for the debounce delay, the wanted
+    states are written with ``apply(chat_id, topics, sources)`` in a single
+    transaction and the keyboard is edited once. The states written are the
+    ones shown on the buttons, so two quick taps on the same button cancel
+    out, and overlapping taps cannot flip a row twice. ``apply`` is a
+    blocking database call and runs in the default executor.
+    """
+
+    def __init__(self, apply, delay=TOGGLE_DEBOUNCE_SECONDS):
+        self.apply = apply
+        self.delay = delay
+        self._pending = {}
+
+    async def tap(self, query, buttons, topic=None, source=None):
+        """Register a tap on a topic or source toggle button"""
+        key = (str(query.message.chat.id), query.message.message_id)
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = PendingToggles(query.message.reply_markup)
+
+        is_enabled = not MenuRegistry.shows_enabled(entry.markup, query.data, buttons)
+        markup = MenuRegistry.flip(entry.markup, query.data, buttons, is_enabled)
+        if markup is None:
+            await query.answer()
+            return
+
+        entry.markup = markup
+        entry.query = query
+        if topic is not None:
+            entry.topics[topic] = is_enabled
+        if source is not None:
+            entry.sources[source] = is_enabled
+
+        # Restart the debounce timer; it fires after the tap's update is done
+        if entry.timer is not None:
+            entry.timer.cancel()
+        entry.timer = asyncio.create_task(detached(lambda: self._flush_later(key, entry))())
+
+        await query.answer(buttons[is_enabled].text)
+
+    async def settle(self, query):
+        """Write pending toggles of the query's message now, e.g. before it is replaced"""
+        key = (str(query.message.chat.id), query.message.message_id)
+        entry = self._pending.get(key)
+        if entry is not None:
+            await self._settle(key, entry)
+
+    async def flush(self):
+        """Write the pending toggles of every keyboard now, e.g. before the bot stops"""
+        for key, entry in list(self._pending.items()):
+            await self._settle(key, entry)
+
+    async def _settle(self, key, entry):
+        if entry.timer is not None:
+            entry.timer.cancel()
+            entry.timer = None
+        async with entry.lock:
+            await self._flush(key, entry)
+
+    async def _flush_later(self, key, entry):
+        await asyncio.sleep(self.delay)
+        async with entry.lock:
+            if entry.timer is not asyncio.current_task():
+                return
+            entry.timer = None
+            await self._flush(key, entry)
+
+    async def _flush(self, key, entry):
+        topics, sources = entry.topics, entry.sources
+        entry.topics, entry.sources = {}, {}
+        try:
+            if topics or sources:
+                # Not in the update's context: the write uses its own session
+                await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self.apply, key[0], topics=topics, sources=sources)
+                )
+            if entry.markup is not entry.sent_markup:
+                markup = entry.markup
+                await entry.query.edit_message_reply_markup(reply_markup=markup)
+                entry.sent_markup = markup
+        except Exception:
+            logger.exception(f"Error applying toggles for {key[0]}")
+        finally:
+            # Once the edit has landed, later taps carry the current keyboard
+            if entry.timer is None and self._pending.get(key) is entry:
+                del self._pending[key]
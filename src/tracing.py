@@ -0,0 +1,366 @@
+"""
+Lightweight span tracing
+
+Each update and each scheduled delivery gets a trace; db_helper calls,
+NewsAPI fetches, rendering and Bot API calls inside it are recorded as
+nested spans. Finished traces are written as JSON lines to TRACE_FILE,
+rotated by size.
+
+Summarize them with: python -m src.tracing [files...] --top 10
+"""
+
+import argparse
+import contextvars
+import functools
+import glob
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# JSONL file traces are written to; empty to turn tracing off
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+# Share of traces written (head sampling)
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))
+# Traces slower than this are written even when not sampled; 0 to only sample
+TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', 1000))
+# Size at which the file is rotated, and rotated files kept
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', 10 * 1024 * 1024))
+TRACE_BACKUPS = int(os.getenv('TRACE_BACKUPS', 5))
+
+TRACING = bool(TRACE_FILE) and (TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0)
+
+# Innermost open span of the running task or thread
+_current = contextvars.ContextVar('trace_span', default=None)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class Trace:
+    """Spans of one update or delivery, written once every holder has released it"""
+
+    def __init__(self, name, sampled):
+        self.id = os.urandom(8).hex()
+        self.name = name
+        self.sampled = sampled
+        self.wall_started = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self._ids = itertools.count()
+        self._holds = 1
+        self._lock = threading.Lock()
+
+    def hold(self):
+        with self._lock:
+            self._holds += 1
+
+    def release(self):
+        with self._lock:
+            self._holds -= 1
+            done = self._holds == 0
+        if done:
+            _write(self)
+
+
+class Span:
+    """A timed operation in a trace; a context manager that makes it current"""
+
+    __slots__ = ('trace', 'id', 'parent', 'name', 'kind', 'attrs', 'started', 'duration', 'error', '_token')
+
+    def __init__(self, trace, name, kind=None, parent=None, attrs=None):
+        self.trace = trace
+        self.id = next(trace._ids)
+        self.parent = parent
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs or {}
+        self.started = None
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.trace.spans.append(self)
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if exc_type is not None and self.error is None:
+            self.error = exc_type.__name__
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Ended from a different context than it was started in
+            _current.set(None)
+        return False
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'parent': self.parent,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ms': round((self.started - self.trace.started) * 1000, 3),
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class _NoSpan:
+    """Stands in for spans while nothing is traced"""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def begin(name, **attrs):
+    """Start a trace and make its root span current; returns the root span, or NO_SPAN when not traced"""
+    if not TRACING:
+        return NO_SPAN
+    sampled = random.random() < TRACE_SAMPLE_RATE
+    if not sampled and not TRACE_SLOW_MS:
+        return NO_SPAN
+    root = Span(Trace(name, sampled), name, name, attrs=attrs)
+    return root.__enter__()
+
+
+def end(root, error=None):
+    """End a trace started with begin(); it is written once continued tasks are done too"""
+    if root is NO_SPAN or root.duration is not None:
+        return
+    if error and root.error is None:
+        root.error = error if isinstance(error, str) else type(error).__name__
+    root.__exit__(None, None, None)
+    root.trace.release()
+
+
+class trace:
+    """Context manager tracing its block as a trace of its own"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.root = NO_SPAN
+
+    def __enter__(self):
+        self.root = begin(self.name, **self.attrs)
+        return self.root
+
+    def __exit__(self, exc_type, exc, tb):
+        end(self.root, exc_type.__name__ if exc_type else None)
+        return False
+
+
+def span(name, kind=None, **attrs):
+    """Span of the current trace around a block; NO_SPAN outside of a trace"""
+    parent = _current.get()
+    if parent is None:
+        return NO_SPAN
+    return Span(parent.trace, name, kind, parent.id, attrs)
+
+
+def traced(kind):
+    """Decorator recording each call of a function as a span named after it"""
+    def decorator(func):
+        if not TRACING:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            parent = _current.get()
+            if parent is None:
+                return func(*args, **kwargs)
+            with Span(parent.trace, func.__name__, kind, parent.id):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def continued(name, coroutine_factory, kind=None):
+    """
+    Wrap a coroutine factory so the task it starts stays in the current trace
+
+    The trace is kept open until the coroutine finishes, e.g. a news
+    delivery that runs on after its update has been handled.
+    """
+    parent = _current.get()
+    if parent is None:
+        return coroutine_factory
+
+    async def run():
+        try:
+            with Span(parent.trace, name, kind, parent.id):
+                return await coroutine_factory()
+        finally:
+            parent.trace.release()
+
+    def factory():
+        parent.trace.hold()
+        return run()
+    return factory
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            handler = logging.handlers.RotatingFileHandler(
+                TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            _writer = logging.getLogger('newsbot.traces')
+            _writer.propagate = False
+            _writer.setLevel(logging.INFO)
+            _writer.addHandler(handler)
+        return _writer
+
+
+def _write(trace):
+    # Continued tasks may end after the root span, the trace lasts until the last span ends
+    spans = list(trace.spans)
+    ended = max(span.started + span.duration for span in spans if span.duration is not None)
+    duration_ms = (ended - trace.started) * 1000
+    root = spans[0]
+    if not trace.sampled and duration_ms < TRACE_SLOW_MS:
+        return
+    record = {
+        'trace_id': trace.id,
+        'name': trace.name,
+        'start': datetime.utcfromtimestamp(trace.wall_started).isoformat() + 'Z',
+        'duration_ms': round(duration_ms, 3),
+        'sampled': trace.sampled,
+        'attrs': root.attrs,
+        'spans': [span.to_dict() for span in spans],
+    }
+    try:
+        _get_writer().info(json.dumps(record, ensure_ascii=False, default=str))
+    except Exception:
+        logger.exception("Error writing trace")
+
+
+# Summaries
+
+def load_traces(paths):
+    """Read trace records from JSONL files, skipping lines that don't parse"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def _end(span):
+    return span['start_ms'] + (span['duration_ms'] or 0)
+
+
+def critical_path(record):
+    """
+    Spans that the trace's duration depends on, as (depth, span, self_ms)
+
+    From each span, the child that finished last is on the path, then the
+    last child to finish before that one started, and so on; ``self_ms``
+    is the time of a span not covered by its children on the path. For the
+    root that is time spent outside of any span.
+    """
+    children = defaultdict(list)
+    for span in record['spans']:
+        if span['parent'] is not None:
+            children[span['parent']].append(span)
+    path = []
+
+    def visit(span, depth, limit):
+        chain = []
+        for child in sorted(children[span['id']], key=_end, reverse=True):
+            if child['duration_ms'] is not None and _end(child) <= limit + 1e-6:
+                chain.append(child)
+                limit = child['start_ms']
+        chain.reverse()
+        covered = sum(child['duration_ms'] for child in chain)
+        path.append((depth, span, max(0.0, (_end(span) if depth else record['duration_ms']) - span['start_ms'] - covered)))
+        for child in chain:
+            visit(child, depth + 1, _end(child))
+
+    roots = [span for span in record['spans'] if span['parent'] is None]
+    if roots:
+        # The root covers the whole trace, including tasks continued after it
+        visit(roots[0], 0, record['duration_ms'])
+    return path
+
+
+def _describe(record):
+    attrs = record.get('attrs') or {}
+    return " ".join(f"{name}={value}" for name, value in attrs.items())
+
+
+def summarize(records, top=10, name=None):
+    """Return a text report of the slowest traces and where their time went"""
+    records = [record for record in records if name is None or record['name'] == name]
+    if not records:
+        return "No traces"
+    records.sort(key=lambda record: record['duration_ms'], reverse=True)
+    lines = [f"{len(records)} traces"]
+
+    # Time on the critical paths by kind of span, over all traces
+    by_kind = defaultdict(float)
+    for record in records:
+        for depth, span, self_ms in critical_path(record):
+            by_kind[span['kind'] or span['name'] if depth else 'unaccounted'] += self_ms
+    total = sum(by_kind.values()) or 1
+    lines.append("\nCritical path time by kind:")
+    for kind, ms in sorted(by_kind.items(), key=lambda item: -item[1]):
+        lines.append(f"  {kind:<14} {ms:12.1f} ms  {ms / total:6.1%}")
+
+    lines.append(f"\nSlowest {min(top, len(records))}:")
+    for record in records[:top]:
+        lines.append(f"\n{record['duration_ms']:10.1f} ms  {record['name']}  {_describe(record)}  "
+                     f"[{record['trace_id']}, {record['start']}, {len(record['spans'])} spans]")
+        for depth, span, self_ms in critical_path(record)[1:]:
+            label = f"{span['kind']}:{span['name']}" if span['kind'] else span['name']
+            error = f"  !{span['error']}" if span.get('error') else ""
+            lines.append(f"    {'  ' * depth}{label:<{40 - 2 * depth}} {span['duration_ms']:9.1f} ms  "
+                         f"(self {self_ms:.1f}){error}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the slowest traces and their critical paths")
+    parser.add_argument('files', nargs='*', help="trace files; default: TRACE_FILE and its rotated files")
+    parser.add_argument('--top', type=int, default=10, help="slowest traces to show")
+    parser.add_argument('--name', default=None, help="only traces of this kind, e.g. update or delivery")
+    args = parser.parse_args()
+    paths = args.files or sorted(glob.glob(glob.escape(TRACE_FILE or 'traces.jsonl') + '*'))
+    if not paths:
+        parser.error("no trace files found")
+    print(summarize(load_traces(paths), args.top, args.name))
+
+
+if __name__ == "__main__":
+    main()
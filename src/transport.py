@@ -0,0 +1,78 @@
+import importlib.util
+import logging
+import os
+
+from telegram.request import BaseRequest, HTTPXRequest
+
+from src import tracing
+
+logger = logging.getLogger(__name__)
+
+# Bot API endpoint, the bot token is appended to it. Point it at a local
+# server (see benchmarks/fake_telegram.py) to test delivery offline
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')
+
+# Connections for outgoing Bot API calls (sendMessage, edits, answers)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 256))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 10))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', 10))
+# Seconds a call may wait for a free connection before failing
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', 5))
+# HTTP/2 for outgoing calls; needs httpx's http2 extra (the h2 package)
+TELEGRAM_HTTP2 = os.getenv('TELEGRAM_HTTP2', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _http_version(http2):
+    if not http2:
+        return '1.1'
+    if importlib.util.find_spec('h2') is None:
+        logger.warning("TELEGRAM_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+        return '1.1'
+    return '2'
+
+
+def build_requests(pool_size=TELEGRAM_POOL_SIZE, http2=TELEGRAM_HTTP2):
+    """
+    Return (request, get_updates_request) for the Bot API
+
+    Outgoing calls get their own pool, sized for delivery fan-out, so they
+    never wait behind the long-polling getUpdates connection, which uses a
+    separate single-connection pool.
+    """
+    request = HTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        http_version=_http_version(http2),
+    )
+    # getUpdates adds its long-polling timeout to the read timeout itself
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=1,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+    )
+    return request, get_updates_request
+
+
+class TracedRequest(BaseRequest):
+    """Wraps a Bot API request object, recording each call as a span of the current trace"""
+
+    def __init__(self, request):
+        self.request = request
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        with tracing.span(url.rsplit('/', 1)[-1], 'telegram') as span:
+            code, payload = await self.request.do_request(url, method, request_data, **timeouts)
+            span.set(status=code)
+            return code, payload
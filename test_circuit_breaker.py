@@ -0,0 +1,94 @@
+"""
+Tests for the NewsAPI circuit breaker
+Drives the breaker with a fake clock, alone and through NewsFetcher
+"""
+
+import pytest
+import requests
+
+
+@pytest.fixture
+def breaker(clock):
+    from src.circuit_breaker import CircuitBreaker
+
+    return CircuitBreaker("test", failure_threshold=2, reset_timeout=60, clock=clock)
+
+
+def test_open_and_close(breaker, clock):
+    """Failures open the circuit, and one probe after the timeout closes it"""
+    from src.circuit_breaker import CLOSED, OPEN, HALF_OPEN
+
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    # One probe once the timeout has passed, the other calls still fail fast
+    clock.now += 60
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit again
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0 and breaker.allow()
+
+
+def test_release(breaker, clock):
+    """A released probe lets the next call probe, and release does nothing once the outcome is recorded"""
+    from src.circuit_breaker import OPEN
+
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    breaker.release()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_fetcher_probe_raises(breaker, clock, monkeypatch):
+    """A probe that raises something other than a requests error does not leave the circuit stuck"""
+    import src.news_fetcher as news_fetcher
+    from src.circuit_breaker import CLOSED
+
+    def unreachable(url, params=None, timeout=None):
+        raise requests.ConnectionError("NewsAPI unreachable")
+
+    def broken(url, params=None, timeout=None):
+        raise ValueError("unexpected")
+
+    fetcher = news_fetcher.NewsFetcher("test-key")
+    fetcher.breaker = breaker
+    news_fetcher.page_cache._pages.clear()
+    monkeypatch.setattr(news_fetcher.requests, "get", unreachable)
+    for page in (1, 2):
+        assert fetcher._get_articles({"q": "breaker", "page": page}).stale
+    assert not breaker.allow()
+
+    clock.now += 60
+    monkeypatch.setattr(news_fetcher.requests, "get", broken)
+    with pytest.raises(ValueError):
+        fetcher._get_articles({"q": "breaker", "page": 3})
+
+    # The next call is let through as the probe
+    calls = []
+
+    def answer(url, params=None, timeout=None):
+        calls.append(params["page"])
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"status": "ok", "totalResults": 0, "articles": []}'
+        return response
+
+    monkeypatch.setattr(news_fetcher.requests, "get", answer)
+    result = fetcher._get_articles({"q": "breaker", "page": 4})
+    assert calls == [4] and not result.stale
+    assert breaker.state == CLOSED
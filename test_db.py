@@ -209,6 +209,220 @@ def test_categories():
         logger.error(f"❌ Category test failed: {e}")
         return False
 
+def test_request_query_count():
+    """Test that one update uses one session and loads the user once"""
+    logger.info("🔁 Testing per-update query count...")
+    from sqlalchemy import event
+    from db_helper import (
+        get_engine_and_session, begin_request, end_request, update_user_activity,
+        get_user_language, get_enabled_topics_for_user, get_enabled_sources_for_user,
+        get_user_topics, set_user_preferences
+    )
+    
+    test_chat_id = _recreate_test_users("123456789-request-", 1)[0]
+    engine, _ = get_engine_and_session()
+    statements = []
+    
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        # Same calls as a /news update
+        begin_request(test_chat_id)
+        update_user_activity(test_chat_id)
+        get_enabled_sources_for_user(test_chat_id)
+        get_enabled_topics_for_user(test_chat_id)
+        get_user_language(test_chat_id)
+        end_request()
+        news_statements = list(statements)
+        
+        # A toggle write followed by a category menu refresh
+        statements.clear()
+        begin_request(test_chat_id)
+        set_user_preferences(test_chat_id, topics={"AI": False})
+        topics = get_user_topics(test_chat_id)
+        end_request()
+        toggle_statements = list(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    
+    user_lookups = [s for s in news_statements if s.lstrip().upper().startswith("SELECT") and "FROM users" in s]
+    assert len(user_lookups) == 1, f"user loaded {len(user_lookups)} times in one update"
+    # user, sources, topics, activity update
+    assert len(news_statements) <= 4, f"too many statements for /news: {news_statements}"
+    logger.info(f"✅ /news update: {len(news_statements)} statements, 1 user lookup")
+    
+    assert topics.get("AI") is False, "toggle not visible in the same update"
+    # user, topics, topic update
+    assert len(toggle_statements) <= 3, f"too many statements for a toggle: {toggle_statements}"
+    logger.info(f"✅ Toggle update: {len(toggle_statements)} statements")
+    
+    return True
+
+def test_delivery_failures():
+    """Test which failed scheduled sends mark a chat undeliverable"""
+    logger.info("🚫 Testing delivery failures...")
+    import asyncio
+    from telegram.error import TimedOut, NetworkError, RetryAfter, BadRequest, Forbidden
+    from db_helper import get_user, mark_user_deliverable, mark_user_undeliverable
+    from src.article import Article
+    from src.news_fetcher import NewsResult
+    from src.telegram_bot import TelegramBot
+    
+    test_chat_id = _recreate_test_users("123456789-delivery-", 1)[0]
+    
+    # /start makes a chat deliverable again
+    assert mark_user_undeliverable(test_chat_id) is True
+    assert get_user(test_chat_id).is_deliverable is False
+    mark_user_deliverable(test_chat_id)
+    assert get_user(test_chat_id).is_deliverable is True
+    assert mark_user_undeliverable("123456789-missing") is False
+    logger.info("✅ Deliverable flag set and cleared")
+    
+    # Scheduled sends that fail with ``error``, as send_scheduled_news makes them
+    bot = TelegramBot(token="123456:TEST", api_key="test-key")
+    
+    async def stream_news(*args, **kwargs):
+        yield NewsResult([Article("Story", "Something happened", "Example", "https://example.com/1", "2030-01-01T00:00:00Z")])
+    
+    bot.news_fetcher.stream_news = stream_news
+    
+    def deliver(error):
+        async def send_with_backoff(send, *args, **kwargs):
+            raise error
+        bot.send_with_backoff = send_with_backoff
+        return asyncio.run(bot.send_news_to_user(test_chat_id))
+    
+    # Timeouts, network errors, flood control and bad requests say nothing about the chat
+    for error in (TimedOut(), NetworkError("down"), RetryAfter(30), BadRequest("Can't parse entities")):
+        assert deliver(error) is False
+        assert get_user(test_chat_id).is_deliverable is True
+    logger.info("✅ Transient send errors leave the chat deliverable")
+    
+    # Blocked bots and deleted chats take effect at once
+    assert deliver(BadRequest("Chat not found")) is False
+    assert get_user(test_chat_id).is_deliverable is False
+    mark_user_deliverable(test_chat_id)
+    assert deliver(Forbidden("bot was blocked by the user")) is False
+    assert get_user(test_chat_id).is_deliverable is False
+    logger.info("✅ Blocked or deleted chats marked undeliverable")
+    
+    return True
+
+def _recreate_test_users(prefix, count):
+    """Delete users left by earlier runs under ``prefix`` and create ``count`` new ones; returns their chat ids"""
+    from db_helper import create_user, get_session
+    from src.models import User
+    
+    session = get_session()
+    try:
+        for user in session.query(User).filter(User.chat_id.like(f"{prefix}%")).all():
+            session.delete(user)
+        session.commit()
+    finally:
+        session.close()
+    chat_ids = [f"{prefix}{i}" for i in range(count)]
+    for chat_id in chat_ids:
+        create_user(chat_id=chat_id, first_name="Test", language='en')
+    return chat_ids
+
+def _set_users(chat_ids, **values):
+    """Write column values straight to the test users' rows"""
+    from db_helper import get_session
+    from src.models import User
+    
+    session = get_session()
+    try:
+        session.query(User).filter(User.chat_id.in_(chat_ids)).update(values, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+def test_user_batches():
+    """Test keyset paging over users and its shard, slot, activity and deliverability filters"""
+    logger.info("📄 Testing user batches...")
+    from db_helper import iter_user_batches, iter_users, DELIVERY_COLUMNS
+    from src.models import User
+    
+    chat_ids = _recreate_test_users("123456789-batch-", 7)
+    ours = set(chat_ids)
+    columns = DELIVERY_COLUMNS + (User.delivery_slot, User.is_deliverable)
+    
+    def collect(**filters):
+        return [row for row in iter_users(columns, batch_size=2, **filters) if row.chat_id in ours]
+    
+    # Pages hold at most batch_size rows, in id order, and never repeat a row
+    pages = list(iter_user_batches(columns, batch_size=2))
+    assert all(1 <= len(page) <= 2 for page in pages)
+    ids = [row.id for page in pages for row in page]
+    assert ids == sorted(ids) and len(ids) == len(set(ids))
+    rows = collect()
+    assert sorted(row.chat_id for row in rows) == sorted(chat_ids)
+    logger.info(f"✅ {len(pages)} pages of 2, every test user once")
+    
+    # Shards split users by id, each user in exactly one of them
+    shards = [collect(shard=shard, shard_count=3) for shard in range(3)]
+    for shard, shard_rows in enumerate(shards):
+        assert all(row.id % 3 == shard for row in shard_rows)
+    assert sorted(row.chat_id for shard_rows in shards for row in shard_rows) == sorted(chat_ids)
+    logger.info("✅ Shards cover every user once")
+    
+    # Slot ranges are half-open
+    slot = rows[0].delivery_slot
+    in_slot = collect(slot_range=(slot, slot + 1))
+    assert rows[0].chat_id in {row.chat_id for row in in_slot}
+    assert all(row.delivery_slot == slot for row in in_slot)
+    assert rows[0].chat_id not in {row.chat_id for row in collect(slot_range=(slot + 1, slot + 2))}
+    logger.info("✅ Slot range filter")
+    
+    # Activity and deliverability
+    _set_users(chat_ids[:3], last_activity=datetime(2000, 1, 1))
+    _set_users(chat_ids[3:], last_activity=datetime.utcnow())
+    _set_users(chat_ids[-1:], is_deliverable=False)
+    active = {row.chat_id for row in collect(active_since=datetime(2020, 1, 1))}
+    assert active == set(chat_ids[3:])
+    deliverable = {row.chat_id for row in collect(active_since=datetime(2020, 1, 1), deliverable=True)}
+    assert deliverable == set(chat_ids[3:-1])
+    assert {row.chat_id for row in collect(deliverable=False)} == set(chat_ids[-1:])
+    logger.info("✅ Activity and deliverability filters")
+    
+    return True
+
+def test_activity_tiers():
+    """Test that count_users_by_activity puts each user in exactly one tier"""
+    logger.info("📊 Testing activity tiers...")
+    from datetime import timedelta
+    from db_helper import count_users_by_activity
+    
+    now = datetime.utcnow()
+    active_since = now - timedelta(days=7)
+    dormant_since = now - timedelta(days=30)
+    
+    # New users are active; move them to their tiers and compare the counts
+    chat_ids = _recreate_test_users("123456789-tier-", 5)
+    active, dormant, abandoned, blocked, blocked_recent = chat_ids
+    before = count_users_by_activity(active_since, dormant_since)
+    _set_users([dormant], last_activity=active_since - timedelta(seconds=1))
+    _set_users([abandoned, blocked], last_activity=dormant_since - timedelta(days=1))
+    _set_users([blocked, blocked_recent], is_deliverable=False)
+    after = count_users_by_activity(active_since, dormant_since)
+    
+    changed = {tier: after[tier] - before[tier] for tier in after}
+    expected = {'active': -4, 'dormant': 1, 'abandoned': 1, 'undeliverable': 2}
+    assert changed == expected, f"Tiers changed by {changed}, expected {expected}"
+    logger.info(f"✅ Tiers: {after}")
+    
+    # Tier boundaries are inclusive
+    _set_users([dormant], last_activity=active_since)
+    _set_users([abandoned], last_activity=dormant_since)
+    boundaries = count_users_by_activity(active_since, dormant_since)
+    assert boundaries['active'] == after['active'] + 1
+    assert boundaries['dormant'] == after['dormant']
+    assert boundaries['abandoned'] == after['abandoned'] - 1
+    logger.info("✅ Boundaries count toward the more active tier")
+    return True
+
 def cleanup_test_data():
     """Clean up test data"""
     logger.info("🧹 Cleaning up test data...")
@@ -234,6 +448,44 @@ def cleanup_test_data():
         logger.error(f"❌ Cleanup failed: {e}")
         return False
 
+def test_catalogue_misses():
+    """Test that preference rows without an id are skipped and new ids reload the catalogue"""
+    logger.info("🗃️ Testing catalogue misses...")
+    from types import SimpleNamespace
+    import db_helper
+    from db_helper import get_session, get_user_topics, get_enabled_topics_for_user
+    from src.models import Topic, UserTopic, User
+    
+    chat_id = _recreate_test_users("123456789-catalogue-", 1)[0]
+    name = "Catalogue Test Topic"
+    session = get_session()
+    try:
+        topic = session.query(Topic).filter_by(name=name).first()
+        if topic is None:
+            topic = Topic(id=session.query(Topic.id).order_by(Topic.id.desc()).first()[0] + 1, name=name, category='other')
+            session.add(topic)
+            session.flush()
+        user = session.query(User).filter_by(chat_id=chat_id).one()
+        user.topics.append(UserTopic(topic_id=topic.id, is_enabled=True))
+        session.commit()
+        topic_id = topic.id
+    finally:
+        session.close()
+    
+    # As if another process had added the topic after this one started
+    db_helper._topic_names.pop(topic_id, None)
+    assert get_user_topics(chat_id)[name] is True
+    assert name in get_enabled_topics_for_user(chat_id)
+    assert db_helper._topic_names[topic_id] == name
+    logger.info("✅ Catalogue reloaded for a new topic id")
+    
+    # Rows written by the old code during the migration have no id yet
+    rows = [SimpleNamespace(topic_id=None), SimpleNamespace(topic_id=topic_id)]
+    assert [row for _, row in db_helper._named(rows, 'topic_id', db_helper._topic_names)] == rows[1:]
+    logger.info("✅ Rows without an id skipped")
+    
+    return True
+
 def main():
     """Main test function"""
     print("🧪 NewsReaderBot Database Test Suite")
@@ -263,6 +515,11 @@ def main():
         ("Language Operations", test_language_operations),
         ("User Preferences", test_preferences),
         ("Category System", test_categories),
+        ("Per-Update Query Count", test_request_query_count),
+        ("Delivery Failures", test_delivery_failures),
+        ("User Batches", test_user_batches),
+        ("Activity Tiers", test_activity_tiers),
+        ("Catalogue Misses", test_catalogue_misses),
     ]
     
     passed = 0
@@ -0,0 +1,95 @@
+"""
+Tests for the staggered delivery scheduler
+Runs the scheduler's buckets at chosen times with a fake delivery function
+and an in-memory progress store, so the bot_state of the database in
+DATABASE_URL is left alone
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+WINDOW = 4
+
+
+class FakeDelivery:
+    """Records the buckets it is asked to deliver; raises for buckets in ``failing``"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.buckets = []
+        self.failing = set()
+
+    async def __call__(self, slot_range, active_since):
+        bucket = [b for b in range(WINDOW) if self.scheduler.slot_range(b) == slot_range][0]
+        if bucket in self.failing:
+            raise RuntimeError("database went away")
+        self.buckets.append(bucket)
+        return 1
+
+
+@pytest.fixture
+def scheduler():
+    from src.delivery_scheduler import DeliveryScheduler
+
+    state = {}
+    scheduler = DeliveryScheduler(
+        None, None, window_minutes=WINDOW, hours=[8, 12],
+        load=lambda: state.get('progress'), save=lambda raw: state.update(progress=raw)
+    )
+    scheduler.deliver = FakeDelivery(scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def cycle(scheduler):
+    return scheduler.time_zone.localize(datetime(2030, 1, 1, 8, 0))
+
+
+def test_due_buckets(scheduler, cycle):
+    """Each tick delivers the buckets due so far, once"""
+    start = cycle - timedelta(minutes=WINDOW // 2)
+
+    asyncio.run(scheduler.run_due(start))
+    asyncio.run(scheduler.run_due(start + timedelta(seconds=30)))
+    assert scheduler.deliver.buckets == [0]
+    asyncio.run(scheduler.run_due(start + timedelta(minutes=WINDOW - 1)))
+    assert scheduler.deliver.buckets == [0, 1, 2, 3]
+    asyncio.run(scheduler.run_due(start + timedelta(minutes=WINDOW + 5)))
+    assert scheduler.deliver.buckets == [0, 1, 2, 3]
+
+
+def test_unfinished_cycle(scheduler, cycle):
+    """Buckets left when the window closes are still delivered"""
+    start = cycle - timedelta(minutes=WINDOW // 2)
+
+    asyncio.run(scheduler.run_due(start))
+    # The next tick only comes after the window, e.g. after a restart
+    asyncio.run(scheduler.run_due(start + timedelta(minutes=WINDOW + 10)))
+    assert scheduler.deliver.buckets == [0, 1, 2, 3]
+
+
+def test_failed_bucket(scheduler, cycle):
+    """A bucket whose delivery fails is retried on the next tick"""
+    start = cycle - timedelta(minutes=WINDOW // 2)
+
+    scheduler.deliver.failing = {1}
+    asyncio.run(scheduler.run_due(start + timedelta(minutes=2)))
+    assert scheduler.deliver.buckets == [0]
+    scheduler.deliver.failing = set()
+    asyncio.run(scheduler.run_due(start + timedelta(minutes=3)))
+    assert scheduler.deliver.buckets == [0, 1, 2, 3]
+
+
+def test_superseded_cycle(scheduler, cycle):
+    """An unfinished cycle is given up once the next one has begun"""
+    start = cycle - timedelta(minutes=WINDOW // 2)
+
+    asyncio.run(scheduler.run_due(start))
+    # Down until the 12:00 window has started
+    asyncio.run(scheduler.run_due(start + timedelta(hours=4)))
+    assert scheduler.deliver.buckets == [0, 0]
+    progress = json.loads(scheduler.load())
+    assert progress['cycle'] == (cycle + timedelta(hours=4)).isoformat() and progress['bucket'] == 0
@@ -0,0 +1,64 @@
+"""
+Tests for the prebuilt menus and toggle keyboards
+Builds the menus against the database in DATABASE_URL, which holds the
+topic and source ids their callback data carries
+"""
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+@pytest.fixture(scope="module")
+def menus():
+    from src.menus import MenuRegistry
+
+    return MenuRegistry()
+
+
+def make_keyboard(menus, user_topics):
+    _, markup = menus.topic_category('en', 'tech', user_topics)
+    return markup
+
+
+def test_flip(menus):
+    """A flip swaps only the tapped button"""
+    markup = make_keyboard(menus, {'AI': False})
+    buttons = menus.topic_buttons['AI']
+    data = buttons[0].callback_data
+
+    flipped = menus.flip(markup, data, buttons, True)
+    assert flipped is not markup
+    rows, flipped_rows = markup.inline_keyboard, flipped.inline_keyboard
+    assert len(flipped_rows) == len(rows)
+    for row, flipped_row in zip(rows, flipped_rows):
+        if row[0].callback_data == data:
+            assert flipped_row == (buttons[1],)
+        else:
+            # Other rows are reused as they are
+            assert flipped_row is row
+
+    # Flipping to the state already shown is a no-op
+    assert menus.flip(flipped, data, buttons, True) is flipped
+    assert menus.flip(menus.flip(flipped, data, buttons, False), data, buttons, False).inline_keyboard == rows
+
+    # A button missing from the keyboard, or no keyboard at all
+    other = menus.topic_buttons['Space']
+    assert menus.flip(markup, other[0].callback_data, other, True) is None
+    assert menus.flip(None, data, buttons, True) is None
+
+
+def test_shows_enabled(menus):
+    """A toggle's state is read off the keyboard Telegram shows"""
+    markup = make_keyboard(menus, {'AI': True, 'Programming': False})
+    ai, programming = menus.topic_buttons['AI'], menus.topic_buttons['Programming']
+    assert menus.shows_enabled(markup, ai[1].callback_data, ai) is True
+    assert menus.shows_enabled(markup, programming[0].callback_data, programming) is False
+    flipped = menus.flip(markup, ai[1].callback_data, ai, False)
+    assert menus.shows_enabled(flipped, ai[1].callback_data, ai) is False
+    assert menus.shows_enabled(None, ai[1].callback_data, ai) is False
+
+    # Buttons on messages sent before the compact callback data still match
+    old = InlineKeyboardMarkup([[InlineKeyboardButton("✅ AI", callback_data="topic:AI")]])
+    assert menus.shows_enabled(old, "topic:AI", ai) is True
+    flipped = menus.flip(old, "topic:AI", ai, False)
+    assert flipped.inline_keyboard == ((ai[0],),)
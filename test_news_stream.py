@@ -0,0 +1,132 @@
+"""
+Tests for paged news streams and the shared page cache
+Streams run against a fake NewsAPI that records the pages asked for
+"""
+
+import asyncio
+
+import pytest
+import requests
+
+TOTAL_RESULTS = 35
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.status_code = 200
+        self.data = data
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeNewsAPI:
+    """Stands in for requests.get; ``failing`` pages raise a connection error"""
+
+    def __init__(self, failing=()):
+        self.pages = []
+        self.failing = set(failing)
+
+    def __call__(self, url, params=None, timeout=None):
+        page = params.get("page", 1)
+        self.pages.append(page)
+        if page in self.failing:
+            raise requests.ConnectionError("NewsAPI unreachable")
+        start = (page - 1) * params["pageSize"]
+        count = max(0, min(params["pageSize"], TOTAL_RESULTS - start))
+        articles = [{
+            "title": f"{params['q']} article {start + i}",
+            "description": "Test",
+            "source": {"name": "Test"},
+            "url": f"https://example.com/{params['q']}/{start + i}",
+            "publishedAt": "2030-01-01T00:00:00Z",
+        } for i in range(count)]
+        return FakeResponse({"status": "ok", "totalResults": TOTAL_RESULTS, "articles": articles})
+
+
+@pytest.fixture
+def make_fetcher(monkeypatch):
+    """Build a fetcher whose requests go to ``api``, with an empty page cache"""
+    import src.news_fetcher as news_fetcher
+
+    def make(api):
+        monkeypatch.setattr(news_fetcher.requests, "get", api)
+        news_fetcher.page_cache._pages.clear()
+        return news_fetcher.NewsFetcher("test-key")
+    return make
+
+
+def read(stream, pages=None):
+    """Consume up to ``pages`` pages of an async stream"""
+    async def consume():
+        results = []
+        async for page in stream:
+            results.append(page)
+            if pages is not None and len(results) == pages:
+                break
+        await stream.aclose()
+        return results
+    return asyncio.run(consume())
+
+
+def test_lazy_paging(make_fetcher):
+    """Pages are only requested when the consumer asks for them"""
+    api = FakeNewsAPI()
+    fetcher = make_fetcher(api)
+
+    read(fetcher.stream_news(["lazy"], ["example.com"]), pages=1)
+    assert api.pages == [1]
+
+    # Pages already fetched come from the cache; the stream ends with the last page
+    results = read(fetcher.stream_news(["lazy"], ["example.com"]))
+    assert api.pages == [1, 2, 3, 4]
+    assert [len(page) for page in results] == [10, 10, 10, 5]
+    assert [page.more for page in results] == [True, True, True, False]
+
+    # max_pages caps the stream even when more pages exist
+    api.pages.clear()
+    read(fetcher.stream_news(["capped"], ["example.com"], max_pages=2))
+    assert api.pages == [1, 2]
+
+    # A stale page ends the stream
+    api = FakeNewsAPI(failing={2})
+    fetcher = make_fetcher(api)
+    results = read(fetcher.stream_news(["stale"], ["example.com"]))
+    assert api.pages == [1, 2]
+    assert [page.stale for page in results] == [False, True]
+
+    # Each request goes through ``run``
+    calls = []
+
+    async def run(func, *args, **kwargs):
+        calls.append(func.__name__)
+        return func(*args, **kwargs)
+
+    api = FakeNewsAPI()
+    fetcher = make_fetcher(api)
+    read(fetcher.stream_news(["gated"], ["example.com"], run=run), pages=2)
+    assert calls == ["_get_articles", "_get_articles"] and api.pages == [1, 2]
+
+
+def test_page_cache_ttl(clock):
+    """Cached pages expire after the TTL and the least recently used go first"""
+    from src.news_fetcher import PageCache
+
+    cache = PageCache(ttl=300, size=2, clock=clock)
+    cache.put("a", ["page a"])
+    clock.now += 300
+    assert cache.get("a") == ["page a"]
+    clock.now += 1
+    assert cache.get("a") is None
+    assert "a" not in cache._pages
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.put("a", ["page a"])
+    cache.put("b", ["page b"])
+    cache.get("a")
+    cache.put("c", ["page c"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ["page a"] and cache.get("c") == ["page c"]
@@ -0,0 +1,101 @@
+"""
+Tests for the on-demand news limits
+Checks the per-chat token bucket against a fake clock and the order in
+which the upstream gate admits waiting calls
+"""
+
+import asyncio
+import threading
+import time
+
+
+def test_token_bucket(clock):
+    """Bursts are rejected with the wait, and buckets refill per chat"""
+    from src.rate_limit import TokenBucket
+
+    bucket = TokenBucket(capacity=3, rate=1.0, clock=clock)
+
+    # A full burst, then rejections telling how long to wait
+    assert [bucket.take("a") for _ in range(3)] == [0, 0, 0]
+    assert abs(bucket.take("a") - 1.0) < 1e-9
+    clock.now += 0.25
+    assert abs(bucket.take("a") - 0.75) < 1e-9
+
+    # Chats have their own buckets
+    assert bucket.take("b") == 0
+
+    # Tokens refill at the rate, up to the capacity
+    clock.now += 0.75
+    assert bucket.take("a") == 0
+    assert bucket.take("a") > 0
+    clock.now += 100
+    takes = [bucket.take("a") for _ in range(4)]
+    assert takes[:3] == [0, 0, 0] and takes[3] > 0
+
+    # Without a rate, a spent bucket never refills
+    frozen = TokenBucket(capacity=1, rate=0, clock=clock)
+    assert frozen.take("a") == 0
+    assert frozen.take("a") == float('inf')
+
+    # Full buckets are dropped once there are many keys
+    for key in range(10001):
+        bucket.take(key)
+    clock.now += 10
+    bucket.take("c")
+    assert len(bucket._buckets) <= 2
+
+
+def test_priority_gate_order():
+    """Waiters are admitted by priority, then in arrival order"""
+    from src.rate_limit import PriorityGate, INTERACTIVE, SCHEDULED
+
+    admitted = []
+
+    async def scenario():
+        gate = PriorityGate(limit=1)
+        await gate.acquire(SCHEDULED)
+
+        async def wait(name, priority):
+            await gate.acquire(priority)
+            admitted.append(name)
+
+        tasks = [asyncio.create_task(wait(name, priority)) for name, priority in (
+            ("scheduled 1", SCHEDULED), ("scheduled 2", SCHEDULED), ("cancelled", INTERACTIVE),
+            ("interactive 1", INTERACTIVE), ("interactive 2", INTERACTIVE),
+        )]
+        await asyncio.sleep(0)
+        tasks[2].cancel()
+        await asyncio.sleep(0)
+        for _ in range(4):
+            gate.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        gate.release()
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+    assert admitted == ["interactive 1", "interactive 2", "scheduled 1", "scheduled 2"]
+
+
+def test_priority_gate_limit():
+    """run() never has more than ``limit`` calls in flight"""
+    from src.rate_limit import PriorityGate, INTERACTIVE, SCHEDULED
+
+    lock = threading.Lock()
+    state = {'running': 0, 'most': 0}
+
+    def call():
+        with lock:
+            state['running'] += 1
+            state['most'] = max(state['most'], state['running'])
+        time.sleep(0.02)
+        with lock:
+            state['running'] -= 1
+
+    async def scenario():
+        gate = PriorityGate(limit=2)
+        await asyncio.gather(*(gate.run(INTERACTIVE if i % 2 else SCHEDULED, call) for i in range(8)))
+        assert gate.active == 0
+
+    asyncio.run(scenario())
+    assert state['most'] == 2
@@ -0,0 +1,114 @@
+"""
+Tests for rendering news digests
+Checks the cached digest bodies and headers, and how digests are split
+into messages within Telegram's 4096 character limit
+"""
+
+
+def test_body_cache(make_articles):
+    """Bodies are rendered once per article set and language"""
+    from src.renderer import DigestRenderer
+
+    renderer = DigestRenderer(cache_size=2)
+    articles = make_articles(3)
+
+    first = renderer.render(articles, 'en', topics=["AI"], sources=["bbc.com"])
+    second = renderer.render(articles, 'en', topics=["Space", "Health"], sources=["cnn.com"])
+    assert (renderer.hits, renderer.misses) == (1, 1)
+    # Users with other settings share the body, only the header differs
+    assert first[0].split("🔸", 1)[1] == second[0].split("🔸", 1)[1]
+    assert "AI" in first[0] and "Space, Health" in second[0]
+
+    renderer.render(articles, 'fa')
+    assert renderer.misses == 2
+    assert renderer.body(articles, 'en') is renderer.body(articles, 'en')
+
+    # The least recently used body is dropped beyond cache_size
+    renderer.render(make_articles(2, prefix="https://example.org/"), 'en')
+    renderer.body(articles, 'fa')
+    assert renderer.misses == 4
+
+
+def test_header():
+    """The header lists a few names, counts the rest and escapes HTML"""
+    from src.renderer import DigestRenderer
+
+    renderer = DigestRenderer()
+    header = renderer.header('en', ["AI", "Space", "Health", "Science", "<Tech>"], ["bbc.com"], stale=True)
+    assert "AI, Space, Health (+2 more)" in header
+    assert "Science" not in header
+    assert "📰 Sources: bbc.com\n" in header
+    assert "not responding" in header
+    assert renderer.header('en', ["AI", "Space", "Health", "Science", "<Tech>"], ["bbc.com"], stale=True) is header
+    assert "<Tech>" not in renderer.header('en', ["<Tech>"], [])
+    assert "&lt;Tech&gt;" in renderer.header('en', ["<Tech>"], [])
+    assert "موضوعات" in renderer.header('fa', ["AI"], [])
+
+
+def check_split(messages, articles, limit):
+    """Assert every message fits, every article is whole and in order, and no message could have taken more"""
+    from src.renderer import html_length
+
+    for message in messages:
+        assert html_length(message) <= limit, f"{html_length(message)} > {limit}"
+    urls = [article.url for article in articles]
+    shown = [url for message in messages for url in urls if f'href="{url}"' in message]
+    assert shown == urls, "articles missing, repeated or out of order"
+    assert all(message.count("🔸") == message.count("</a>") for message in messages), "article split"
+    # Only the first message has the header
+    assert not messages[0].startswith("🔸") and all(message.startswith("🔸") for message in messages[1:])
+    for message, following in zip(messages, messages[1:]):
+        # Both lengths lose the "\n\n" after the article
+        first_article = following.split("\n\n")[0]
+        assert html_length(message) + html_length(first_article) + 4 > limit, "messages not packed"
+
+
+def test_split_limit(make_articles):
+    """Long digests are packed into as few messages as fit in 4096 characters"""
+    from src.renderer import DigestRenderer, MESSAGE_LIMIT
+
+    renderer = DigestRenderer()
+    assert renderer.limit == MESSAGE_LIMIT == 4096
+
+    # A short digest is one message
+    articles = make_articles(5)
+    messages = renderer.render(articles, 'en', topics=["AI"])
+    assert len(messages) == 1
+    check_split(messages, articles, 4096)
+
+    # Long descriptions take several messages
+    articles = make_articles(12, description="Lorem ipsum dolor sit amet. " * 40)
+    messages = renderer.render(articles, 'en', topics=["AI"], sources=["bbc.com"])
+    assert len(messages) > 2
+    check_split(messages, articles, 4096)
+
+    # Smaller limits pack the same way
+    articles = make_articles(30, title="خبر")
+    messages = DigestRenderer(limit=400).render(articles, 'fa', topics=["AI"])
+    assert len(messages) > 2
+    check_split(messages, articles, 400)
+
+
+def test_split_counting(make_articles):
+    """The limit is counted as Telegram does"""
+    from src.renderer import DigestRenderer, TITLE_LENGTH, html_length, message_length
+
+    # Tags and link targets don't count
+    articles = make_articles(8, prefix="https://example.com/" + "a" * 600 + "/")
+    messages = DigestRenderer().render(articles, 'en')
+    assert len(messages) == 1 and len(messages[0]) > 4096
+    check_split(messages, articles, 4096)
+    assert html_length('<b>x</b> <a href="https://example.com">y</a> &amp;') == 5
+
+    # Characters outside the BMP count twice, as in UTF-16
+    assert message_length("😀") == 2 and message_length("خبر") == 3
+    articles = make_articles(2, description="😀" * 1200)
+    messages = DigestRenderer().render(articles, 'en')
+    assert len(messages) == 2
+    assert sum(len(message) for message in messages) < 4096
+    check_split(messages, articles, 4096)
+
+    # Titles are cut so that any single article fits
+    articles = make_articles(1, title="T" * 5000)
+    message = DigestRenderer().render(articles, 'en')[0]
+    assert "T" * TITLE_LENGTH in message and "T" * (TITLE_LENGTH + 1) not in message
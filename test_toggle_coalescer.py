@@ -0,0 +1,134 @@
+"""
+Tests for coalescing toggle taps
+Taps fake callback queries on a topic keyboard and checks what is written
+and edited once the debounce delay has passed
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+DELAY = 0.05
+
+# (disabled, enabled) buttons, as MenuRegistry builds them
+BUTTONS = {
+    topic: (InlineKeyboardButton(f"❌ {topic}", callback_data=f"tt{index:05d}"),
+            InlineKeyboardButton(f"✅ {topic}", callback_data=f"tt{index:05d}"))
+    for index, topic in enumerate(("AI", "Programming", "Space"), 1)
+}
+
+
+class FakeQuery:
+    """Callback query on a keyboard message; records answers and edits"""
+
+    def __init__(self, message, data, log):
+        self.message = message
+        self.data = data
+        self.log = log
+
+    async def answer(self, text=None):
+        self.log.append(('answer', text))
+
+    async def edit_message_reply_markup(self, reply_markup=None):
+        self.log.append(('edit', reply_markup))
+        self.message.reply_markup = reply_markup
+
+
+def make_message(message_id=1):
+    markup = InlineKeyboardMarkup([[BUTTONS[topic][0]] for topic in BUTTONS])
+    return SimpleNamespace(chat=SimpleNamespace(id=123456789), message_id=message_id, reply_markup=markup)
+
+
+@pytest.fixture
+def writes():
+    return []
+
+
+@pytest.fixture
+def coalescer(writes):
+    from src.toggle_coalescer import ToggleCoalescer
+
+    return ToggleCoalescer(lambda chat_id, topics, sources: writes.append((chat_id, topics, sources)), delay=DELAY)
+
+
+async def tap(coalescer, message, topic, log):
+    await coalescer.tap(FakeQuery(message, BUTTONS[topic][0].callback_data, log), BUTTONS[topic], topic=topic)
+
+
+def edits(log):
+    return [markup for kind, markup in log if kind == 'edit']
+
+
+def test_coalescing(coalescer, writes):
+    """Rapid taps are written and edited once"""
+    message = make_message()
+    log = []
+
+    async def scenario():
+        for topic in ("AI", "AI", "Programming", "AI"):
+            await tap(coalescer, message, topic, log)
+        assert writes == [] and edits(log) == []
+        await asyncio.sleep(DELAY * 3)
+
+    asyncio.run(scenario())
+    assert writes == [("123456789", {'AI': True, 'Programming': True}, {})]
+    answers = [text for kind, text in log if kind == 'answer']
+    assert answers == ["✅ AI", "❌ AI", "✅ Programming", "✅ AI"]
+    assert len(edits(log)) == 1
+    assert [row[0].text for row in edits(log)[0].inline_keyboard] == ["✅ AI", "✅ Programming", "❌ Space"]
+    assert coalescer._pending == {}
+
+    # Two taps on the same button cancel out
+    writes.clear()
+
+    async def cancel_out():
+        await tap(coalescer, message, "Space", log)
+        await tap(coalescer, message, "Space", log)
+        await asyncio.sleep(DELAY * 3)
+
+    asyncio.run(cancel_out())
+    assert writes == [("123456789", {'Space': False}, {})]
+
+
+def test_settle(coalescer, writes):
+    """settle() writes pending taps at once and the timer then does nothing"""
+    message = make_message()
+    other = make_message(message_id=2)
+    log = []
+
+    async def scenario():
+        await tap(coalescer, message, "AI", log)
+        await tap(coalescer, other, "Space", log)
+        await coalescer.settle(FakeQuery(message, None, log))
+        assert writes == [("123456789", {'AI': True}, {})]
+        await asyncio.sleep(DELAY * 3)
+        # Nothing pending for the message any more
+        await coalescer.settle(FakeQuery(message, None, log))
+
+    asyncio.run(scenario())
+    # The other keyboard is written by its own timer
+    assert writes == [("123456789", {'AI': True}, {}), ("123456789", {'Space': True}, {})]
+    assert len(edits(log)) == 2
+    assert coalescer._pending == {}
+
+
+def test_flush(coalescer, writes):
+    """flush() writes the pending taps of every keyboard, e.g. on shutdown"""
+    message = make_message()
+    other = make_message(message_id=2)
+    log = []
+
+    async def scenario():
+        await tap(coalescer, message, "AI", log)
+        await tap(coalescer, other, "Space", log)
+        await coalescer.flush()
+        assert writes == [("123456789", {'AI': True}, {}), ("123456789", {'Space': True}, {})]
+        assert coalescer._pending == {}
+        await asyncio.sleep(DELAY * 3)
+
+    asyncio.run(scenario())
+    # The timers were cancelled, nothing is written twice
+    assert len(writes) == 2
+    assert len(edits(log)) == 2